@@ -0,0 +1,141 @@
+# Several authorized accounts used side by side
+from oauth2client.service_account import ServiceAccountCredentials
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import discoverycache
+import wire
+from credentialmanager import AtomicStorage, CredentialManager
+
+SCOPES = 'https://www.googleapis.com/auth/calendar'
+
+class Account():
+	"""
+	An authorized account. An httplib2.Http object cannot be shared
+	between threads, so every thread using the account gets its own
+	authorized Http and calendar service. The threads share one
+	CredentialManager, so the token is refreshed once for all of them.
+
+	Required arguments:
+		name -- the name the account is registered under
+		credentials -- the oauth2client credentials of the account
+
+	Keyword arguments:
+		max_concurrency -- the most requests allowed in flight for
+			this account at once (default 4)
+	"""
+	def __init__(self, name, credentials, max_concurrency=4):
+		self.name = name
+		self.credentials = credentials
+		self.max_concurrency = max_concurrency
+		self.manager = CredentialManager(credentials)
+
+		self.__local = threading.local()
+
+	def service(self):
+		"""
+		Returns the calendar service of the calling thread, building
+		it the first time the thread asks.
+		"""
+		service = getattr(self.__local, 'service', None)
+		if service is None:
+			http = self.manager.authorize(wire.Http())
+			document = discoverycache.load_document('calendar', 'v3')
+			service = wire.build(document, http)
+			self.__local.service = service
+		return service
+
+class AccountRegistry():
+	"""
+	Keeps one Account per name so each account is authorized once
+	and reused by every calendar it writes to.
+	"""
+	def __init__(self):
+		self.accounts = {}
+		self.__lock = threading.Lock()
+
+	def add(self, name, credentials, max_concurrency=4):
+		"""
+		Registers credentials under name and returns the Account.
+		"""
+		if not credentials or credentials.invalid:
+			raise ValueError("ERROR. Account '{}' has no valid credentials.".format(name))
+
+		account = Account(name, credentials, max_concurrency)
+		with self.__lock:
+			previous = self.accounts.get(name)
+			self.accounts[name] = account
+		if previous:
+			previous.manager.stop()
+		account.manager.start()
+		return account
+
+	def add_stored(self, name, credential_path, max_concurrency=4):
+		"""
+		Registers the user credentials saved at credential_path, ie. by
+		a previous login.
+		"""
+		return self.add(name, AtomicStorage(credential_path).get(), max_concurrency)
+
+	def add_service_account(self, name, keyfile, subject=None, max_concurrency=4):
+		"""
+		Registers a service account from its JSON key file. If subject
+		is given the service account acts on behalf of that user.
+		"""
+		credentials = ServiceAccountCredentials.from_json_keyfile_name(keyfile, SCOPES)
+		if subject:
+			credentials = credentials.create_delegated(subject)
+		return self.add(name, credentials, max_concurrency)
+
+	def get(self, name):
+		try:
+			return self.accounts[name]
+		except KeyError:
+			raise KeyError("ERROR. No account registered as '{}'.".format(name))
+
+def fan_out(registry, events, targets):
+	"""
+	Creates every CalendarEvent in events on every target calendar.
+	Each account sends its inserts in parallel, with no more than its
+	max_concurrency in flight at once, and all accounts run side by
+	side.
+
+	Required arguments:
+		registry -- the AccountRegistry holding the accounts
+		events -- the CalendarEvents to create
+		targets -- (account name, calendar id) pairs to create the
+			events on
+
+	Returns:
+		A list of (account name, calendar id, event, response,
+		exception) tuples in the order the inserts were made.
+	"""
+	events = list(events)
+
+	# One pool per account caps how many requests it has in flight
+	pools = {}
+	futures = []
+	try:
+		for name, calendar_id in targets:
+			account = registry.get(name)
+			if name not in pools:
+				pools[name] = ThreadPoolExecutor(account.max_concurrency)
+
+			for event in events:
+				future = pools[name].submit(
+					lambda account=account, calendar_id=calendar_id, event=event:
+						event.create_event(account.service(), calendar_id, account.name)
+				)
+				futures.append((name, calendar_id, event, future))
+
+		results = []
+		for name, calendar_id, event, future in futures:
+			try:
+				results.append((name, calendar_id, event, future.result(), None))
+			except Exception as e:
+				results.append((name, calendar_id, event, None, e))
+		return results
+	finally:
+		for pool in pools.values():
+			pool.shutdown()
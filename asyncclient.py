@@ -0,0 +1,336 @@
+# An asyncio client for the Calendar API, for embedding the scheduler
+# in asyncio services
+from apiclient.errors import HttpError
+
+import asyncio
+import gzip, zlib
+import httplib2
+import json
+import ssl
+import urllib.parse
+import logging
+
+from metrics import metrics
+from executor import default_executor, is_retryable, retry_after
+from freebusy import parse_time, format_time, merge, _as_utc
+import wire
+
+log = logging.getLogger(__name__)
+
+BASE_URI = 'https://www.googleapis.com/calendar/v3'
+
+class AsyncHttp():
+	"""
+	A minimal HTTP/1.1 client on asyncio streams. Connections are kept
+	alive and reused for later requests to the same host. Compressed
+	responses are decompressed, and every byte sent and received is
+	counted in the wire_bytes_total metric.
+
+	Keyword arguments:
+		max_idle -- the most idle connections kept for each host
+			(default 10)
+	"""
+	def __init__(self, max_idle=10):
+		self.max_idle = max_idle
+		# (scheme, host, port) -> [(reader, writer)]
+		self.idle = {}
+		self.ssl_context = None
+
+	async def __connect(self, key):
+		scheme, host, port = key
+		connections = self.idle.get(key)
+		while connections:
+			reader, writer = connections.pop()
+			if not reader.at_eof() and not writer.is_closing():
+				return reader, writer, True
+			writer.close()
+
+		context = None
+		if scheme == 'https':
+			if self.ssl_context is None:
+				self.ssl_context = ssl.create_default_context()
+			context = self.ssl_context
+		reader, writer = await asyncio.open_connection(host, port, ssl=context)
+		return reader, writer, False
+
+	def __release(self, key, reader, writer):
+		connections = self.idle.setdefault(key, [])
+		if len(connections) < self.max_idle:
+			connections.append((reader, writer))
+		else:
+			writer.close()
+
+	async def request(self, method, url, body=None, headers=None):
+		"""
+		Sends a request and returns (status, headers, content). Header
+		names are lower case.
+		"""
+		parts = urllib.parse.urlsplit(url)
+		port = parts.port or (443 if parts.scheme == 'https' else 80)
+		key = (parts.scheme, parts.hostname, port)
+		target = parts.path or '/'
+		if parts.query:
+			target += '?' + parts.query
+
+		lines = [
+			'{} {} HTTP/1.1'.format(method, target),
+			'Host: {}'.format(parts.netloc),
+			'Content-Length: {}'.format(len(body) if body else 0),
+		]
+		for name, value in (headers or {}).items():
+			lines.append('{}: {}'.format(name, value))
+		head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+		while True:
+			reader, writer, reused = await self.__connect(key)
+			try:
+				writer.write(head + (body or b''))
+				await writer.drain()
+				wire.count('sent', len(head) + len(body or b''))
+				status_line = await reader.readline()
+				if not status_line:
+					# The server closed an idle connection; try a new one
+					writer.close()
+					if reused:
+						continue
+					raise ConnectionError("ERROR. {} closed the connection.".format(parts.netloc))
+				status, response_headers, content, keep_alive = await self.__read_response(
+					reader, method, status_line
+				)
+			except BaseException:
+				# Including cancellation: the connection is in an
+				# unknown state, so never reuse it
+				writer.close()
+				raise
+
+			if keep_alive:
+				self.__release(key, reader, writer)
+			else:
+				writer.close()
+
+			encoding = response_headers.pop('content-encoding', '').lower()
+			if encoding == 'gzip':
+				content = gzip.decompress(content)
+			elif encoding == 'deflate':
+				content = zlib.decompress(content)
+			return status, response_headers, content
+
+	async def __read_response(self, reader, method, status_line):
+		status = int(status_line.split()[1])
+		headers = {}
+		received = len(status_line)
+		while True:
+			line = await reader.readline()
+			received += len(line)
+			if line in (b'\r\n', b'\n', b''):
+				break
+			name, _, value = line.decode('latin-1').partition(':')
+			headers[name.strip().lower()] = value.strip()
+
+		keep_alive = headers.get('connection', '').lower() != 'close'
+		if method == 'HEAD' or status in (204, 304) or status < 200:
+			content = b''
+		elif headers.get('transfer-encoding', '').lower() == 'chunked':
+			chunks = []
+			while True:
+				size = int((await reader.readline()).split(b';')[0], 16)
+				if size == 0:
+					# Skip any trailers
+					while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+						pass
+					break
+				chunks.append(await reader.readexactly(size))
+				await reader.readline()
+			content = b''.join(chunks)
+			received += len(content)
+		elif 'content-length' in headers:
+			content = await reader.readexactly(int(headers['content-length']))
+			received += len(content)
+		else:
+			content = await reader.read()
+			received += len(content)
+			keep_alive = False
+		wire.count('received', received)
+		return status, headers, content, keep_alive
+
+	def close(self):
+		for connections in self.idle.values():
+			for reader, writer in connections:
+				writer.close()
+		self.idle.clear()
+
+class AsyncCalendarClient():
+	"""
+	Inserts, lists, patches and deletes events and queries freebusy
+	without blocking the event loop.
+
+	At most max_concurrency requests are in flight at once. Each
+	attempt is cancelled after timeout seconds, and rate limit, server
+	and timeout errors are retried with the backoff of the request
+	executor. Cancelling a call closes its connection.
+
+	Keyword arguments:
+		manager -- the CredentialManager whose token authorizes the
+			requests. Refreshes run in a thread so they don't block
+			the loop. (default None, unauthorized)
+		base_uri -- the root of the API, ie. a local stand-in of it
+			(default BASE_URI)
+		max_concurrency -- the most requests in flight (default 10)
+		timeout -- seconds before an attempt is cancelled (default 30)
+		max_retries -- retries before giving up on a request
+			(default 5)
+		user -- the account the requests count against in the quota
+			of the request executor, which every attempt takes a
+			token from like the blocking client's requests do
+	"""
+	def __init__(self, manager=None, base_uri=BASE_URI, max_concurrency=10, timeout=30.0, max_retries=5, http=None,
+			user=None):
+		self.manager = manager
+		self.user = user
+		self.base_uri = base_uri.rstrip('/')
+		self.timeout = timeout
+		self.max_retries = max_retries
+		self.http = http or AsyncHttp(max_idle=max_concurrency)
+		self.semaphore = asyncio.Semaphore(max_concurrency)
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		self.close()
+
+	def close(self):
+		self.http.close()
+
+	async def __headers(self, body):
+		headers = { 'Accept' : 'application/json' }
+		if wire.is_lean():
+			# Google only compresses for user agents that say so
+			headers['Accept-Encoding'] = 'gzip'
+			headers['User-Agent'] = 'scheduler (gzip)'
+		if body is not None:
+			headers['Content-Type'] = 'application/json'
+		if self.manager:
+			if self.manager.expires_soon():
+				await asyncio.get_running_loop().run_in_executor(None, self.manager.ensure_fresh)
+			headers['Authorization'] = 'Bearer {}'.format(self.manager.credentials.access_token)
+		return headers
+
+	async def request(self, method_id, method, path, params=None, body=None):
+		"""
+		Sends one API request and returns its decoded JSON response,
+		or None for an empty one. Failures raise HttpError like the
+		blocking client does.
+		"""
+		url = self.base_uri + path
+		# Like the blocking client, parameters that are None are left
+		# out, ie. fields outside lean mode
+		params = { name : value for name, value in (params or {}).items() if value is not None }
+		if params:
+			url += '?' + urllib.parse.urlencode(params)
+		data = None if body is None else json.dumps(body, separators=(',', ':')).encode('utf-8')
+
+		attempt = 0
+		while True:
+			try:
+				async with self.semaphore:
+					# Waiting for quota blocks, so it waits in a thread
+					await asyncio.get_running_loop().run_in_executor(None, default_executor.throttle, self.user)
+					headers = await self.__headers(body)
+					with metrics.span('api_call', method=method_id):
+						status, response_headers, content = await asyncio.wait_for(
+							self.http.request(method, url, data, headers), self.timeout
+						)
+						if status >= 400:
+							raise HttpError(httplib2.Response(dict(response_headers, status=status)), content, uri=url)
+			except Exception as e:
+				if attempt >= self.max_retries or not is_retryable(e):
+					raise
+				delay = retry_after(e)
+				if delay is None:
+					delay = default_executor.backoff(attempt)
+				metrics.inc('api_retried_total', method=method_id)
+				log.warning("%s failed (%s), retrying in %.1fs", method_id, e, delay)
+				await asyncio.sleep(delay)
+				attempt += 1
+			else:
+				if not content:
+					return None
+				with metrics.span('parse_response'):
+					return json.loads(content.decode('utf-8'))
+
+	def __events_path(self, calendar_id, event_id=None):
+		path = '/calendars/{}/events'.format(urllib.parse.quote(calendar_id, safe=''))
+		if event_id:
+			path += '/' + urllib.parse.quote(event_id, safe='')
+		return path
+
+	async def insert(self, calendar_id, body, **params):
+		return await self.request(
+			'calendar.events.insert', 'POST', self.__events_path(calendar_id), params, body
+		)
+
+	async def insert_many(self, calendar_id, bodies):
+		"""
+		Inserts every body concurrently, up to max_concurrency at a
+		time. Returns the created events in order, with the exception
+		in place of each insert that failed.
+		"""
+		return await asyncio.gather(
+			*(self.insert(calendar_id, body) for body in bodies), return_exceptions=True
+		)
+
+	async def list(self, calendar_id, **params):
+		"""
+		Returns every event of calendar_id matching params, following
+		the pages of the listing.
+		"""
+		items = []
+		while True:
+			page = await self.request(
+				'calendar.events.list', 'GET', self.__events_path(calendar_id), params
+			)
+			items.extend(page.get('items', []))
+			if not page.get('nextPageToken'):
+				return items
+			params = dict(params, pageToken=page['nextPageToken'])
+
+	async def get(self, calendar_id, event_id, **params):
+		return await self.request(
+			'calendar.events.get', 'GET', self.__events_path(calendar_id, event_id), params
+		)
+
+	async def patch(self, calendar_id, event_id, body, **params):
+		return await self.request(
+			'calendar.events.patch', 'PATCH', self.__events_path(calendar_id, event_id), params, body
+		)
+
+	async def delete(self, calendar_id, event_id, **params):
+		await self.request(
+			'calendar.events.delete', 'DELETE', self.__events_path(calendar_id, event_id), params
+		)
+
+	async def freebusy(self, calendar_ids, time_min, time_max):
+		"""
+		Returns a dictionary of calendar id to the merged busy
+		intervals between time_min and time_max. Naive datetimes and
+		dates are taken to be UTC.
+		"""
+		body = {
+			'timeMin' : format_time(_as_utc(time_min)),
+			'timeMax' : format_time(_as_utc(time_max)),
+			'items' : [{ 'id' : calendar_id } for calendar_id in calendar_ids],
+		}
+		response = await self.request('calendar.freebusy.query', 'POST', '/freeBusy', body=body)
+
+		busy = {}
+		for calendar_id in calendar_ids:
+			calendar = response.get('calendars', {}).get(calendar_id, {})
+			if calendar.get('errors'):
+				raise Exception("ERROR. Freebusy failed for '{}': {}".format(
+					calendar_id, calendar['errors'][0].get('reason')
+				))
+			busy[calendar_id] = merge(
+				(parse_time(b['start']), parse_time(b['end'])) for b in calendar.get('busy', [])
+			)
+		return busy
@@ -0,0 +1,387 @@
+# Benchmarks of the scheduling and rendering hot paths
+#
+#	> python benchmark.py --save         record a baseline
+#	> python benchmark.py                compare against it
+#
+# Exits with 1 when a benchmark got slower than its baseline by more
+# than the threshold.
+import argparse
+import contextlib, io
+import datetime
+import functools
+import json, os, re
+import subprocess, time
+import tracemalloc
+
+import httplib2
+from apiclient import discovery
+
+import discoverycache
+from executor import default_executor
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# A benchmark slower than its baseline by more than this fails
+THRESHOLD = 0.25
+
+BENCHMARKS = []
+MEMORY_BENCHMARKS = []
+
+def benchmark(name, number=1, setup=None):
+	"""
+	Registers a function as a benchmark. The function runs number
+	operations and the time per operation is reported.
+
+	Keyword arguments:
+		setup -- called once before timing, and only if the benchmark
+			is selected; the function gets what it returns. If it
+			returns None the benchmark is skipped.
+	"""
+	def register(func):
+		BENCHMARKS.append((name, func, number, setup))
+		return func
+	return register
+
+def shared(func):
+	"""
+	Wraps a setup function so the benchmarks using it run it once.
+	"""
+	result = []
+	def setup():
+		if not result:
+			result.append(func())
+		return result[0]
+	return setup
+
+def measure(func, number, repeat):
+	"""
+	Returns the fastest time per operation of func over repeat runs.
+	The fastest run is the one least disturbed by the rest of the
+	machine.
+	"""
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		elapsed = (time.perf_counter() - start) / number
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def measure_memory(func, number):
+	"""
+	Returns the bytes still allocated per operation once func returns.
+	func must return what it built so it stays alive while measured.
+	"""
+	tracemalloc.start()
+	try:
+		before = tracemalloc.get_traced_memory()[0]
+		kept = func()
+		after = tracemalloc.get_traced_memory()[0]
+	finally:
+		tracemalloc.stop()
+	del kept
+	return (after - before) / number
+
+def memory_benchmark(name, number=1):
+	"""
+	Registers a function as a memory benchmark, reported in bytes per
+	operation. Its name starts with 'memory.' so baselines keep it
+	apart from the timings.
+	"""
+	def register(func):
+		MEMORY_BENCHMARKS.append(('memory.' + name, func, number, None))
+		return func
+	return register
+
+def quiet():
+	# Keeps prints inside the code under test out of the timings
+	return contextlib.redirect_stdout(io.StringIO())
+
+def task(days, available_days, start=datetime.date(2030, 1, 7)):
+	return {
+		'summary' : 'Benchmark',
+		'location' : '',
+		'description' : '',
+		'start' : { 'dateTime' : start.isoformat(), 'timeZone' : 'UTC' },
+		'end' : { 'dateTime' : start.isoformat(), 'timeZone' : 'UTC' },
+		'hoursNeeded' : 40,
+		'availableDays' : available_days,
+		'startTime' : datetime.time(10),
+		'endDate' : start + datetime.timedelta(days=days),
+	}
+
+MASKS = {
+	'1day' : ['WE'],
+	'weekdays' : ['MO', 'TU', 'WE', 'TH', 'FR'],
+	'everyday' : ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU'],
+}
+
+def register_event_benchmarks():
+	from scheduler import CalendarEvent, EventRecord
+
+	for days in (30, 365, 5 * 365):
+		for mask_name, mask in MASKS.items():
+			def run(days=days, mask=mask):
+				with quiet():
+					for _ in range(200):
+						CalendarEvent(**task(days, mask))
+			benchmark('CalendarEvent.{}d.{}'.format(days, mask_name), 200)(run)
+
+	# The compact record against CalendarEvent for large planning runs
+	for kind, make in (('CalendarEvent', CalendarEvent), ('EventRecord', EventRecord.from_task)):
+		def build(make=make):
+			with quiet():
+				return [make(**task(365, MASKS['weekdays'])) for _ in range(10000)]
+		benchmark('construct.{}'.format(kind), 10000)(build)
+		memory_benchmark(kind, 10000)(build)
+
+		def submit(make=make):
+			with quiet():
+				events = [make(**task(365, MASKS['weekdays'])) for _ in range(1000)]
+			return [event.insert_body() for event in events]
+		benchmark('construct_and_body.{}'.format(kind), 1000)(submit)
+
+	# Making every occurrence of a large planning run aware
+	import zones
+	# Daily occurrences, all distinct like those of a real plan
+	local_times = shared(lambda: [
+		datetime.datetime(2030, 1, 1, 9, 30) + datetime.timedelta(days=i)
+		for i in range(200000)
+	])
+
+	@benchmark('zones.localize_many', 200000, setup=local_times)
+	def localize_many(local_times):
+		zones.localize_many(local_times, 'Europe/Berlin')
+
+	@benchmark('zones.to_utc', 200000, setup=local_times)
+	def to_utc(local_times):
+		for local in local_times:
+			zones.to_utc(local, 'Europe/Berlin')
+
+	@benchmark('bulk_bodies.parse_and_build', 1000)
+	def bulk_bodies():
+		from bulkimport import parse_task
+		raw = {
+			'summary' : 'Benchmark',
+			'start' : { 'dateTime' : '2030-01-07', 'timeZone' : 'UTC' },
+			'hoursNeeded' : '20',
+			'availableDays' : 'MO,WE,FR',
+			'startTime' : '09:30',
+			'endDate' : '2030-06-30',
+		}
+		with quiet():
+			for _ in range(1000):
+				CalendarEvent(**parse_task(raw, 'UTC')).options
+
+	from planner import Planner, Task, TaskGraph
+
+	@benchmark('bulk_bodies.planner', 2000)
+	def planner_bodies():
+		start = datetime.date(2030, 1, 7)
+		tasks = [
+			Task(str(i), 3, MASKS['weekdays'], start + datetime.timedelta(days=i % 300),
+				start + datetime.timedelta(days=i % 300 + 30))
+			for i in range(2000)
+		]
+		list(Planner().plan(tasks).bodies('UTC'))
+
+	# Moving one deadline in a 5000 task workload, back and forth
+	def workload():
+		graph = TaskGraph(time_zone='UTC')
+		start = datetime.date(2030, 1, 7)
+		graph.update([
+			Task(str(i), 1 + i % 3, MASKS['weekdays'], start + datetime.timedelta(days=i % 1000),
+				start + datetime.timedelta(days=i % 1000 + 14))
+			for i in range(5000)
+		])
+		return graph
+
+	@benchmark('replan.one_change', 100, setup=workload)
+	def replan_one_change(graph):
+		for i in range(100):
+			task = graph.tasks[str(i * 47)]
+			# A week later, and back again on the next run
+			days = -7 if task.deadline - task.start_date > datetime.timedelta(days=14) else 7
+			graph.update([Task(
+				task.task_id, task.minutes_needed / 60.0, MASKS['weekdays'], task.start_date,
+				task.deadline + datetime.timedelta(days=days),
+			)])
+
+class FakeCalendarHttp():
+	"""
+	Answers calendar inserts and batches in process, like Google would
+	but without the network, so the client's own work can be timed.
+	"""
+	def __init__(self):
+		self.calls = 0
+
+	def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+		self.calls += 1
+		headers = headers or {}
+		if '/batch' in uri:
+			return self.__batch(body, headers)
+		return httplib2.Response({ 'status' : '200', 'content-type' : 'application/json' }), \
+			b'{"id": "fake", "htmlLink": "https://calendar.google.com/fake"}'
+
+	def __batch(self, body, headers):
+		if isinstance(body, bytes):
+			body = body.decode('utf-8')
+		boundary = 'fake_batch_boundary'
+		parts = []
+		for content_id in re.findall(r'Content-ID: <([^>]+)>', body):
+			parts.append(
+				'--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}>\r\n\r\n'
+				'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n'
+				'{{"id": "fake", "htmlLink": "https://calendar.google.com/fake"}}\r\n'.format(boundary, content_id)
+			)
+		parts.append('--{}--'.format(boundary))
+		return httplib2.Response({
+			'status' : '200',
+			'content-type' : 'multipart/mixed; boundary={}'.format(boundary),
+		}), ''.join(parts).encode('utf-8')
+
+def fake_service():
+	# Never the network, so the benchmarks run anywhere
+	document = discoverycache.local_document('calendar', 'v3')
+	return discovery.build_from_document(document, http=FakeCalendarHttp())
+
+def register_insert_benchmarks():
+	from scheduler import CalendarEvent
+
+	# Only the client is being timed, not our quota
+	default_executor.set_rates(user_rate=1e9, project_rate=1e9)
+
+	@shared
+	def setup():
+		with quiet():
+			events = [CalendarEvent(**task(90, MASKS['weekdays'])) for _ in range(500)]
+		return events, fake_service()
+
+	@benchmark('insert.single', 100, setup=setup)
+	def insert_single(setup):
+		events, service = setup
+		with quiet():
+			for event in events[:100]:
+				event.create_event(service)
+
+	@benchmark('insert.batch', 500, setup=setup)
+	def insert_batch(setup):
+		events, service = setup
+		CalendarEvent.create_many(events, service=service)
+
+def start_virtual_display():
+	"""
+	Starts Xvfb when there is no display so tkinter can draw. Returns
+	the process, or None if a display already exists or Xvfb isn't
+	installed.
+	"""
+	if os.environ.get('DISPLAY'):
+		return None
+	try:
+		process = subprocess.Popen(['Xvfb', ':99', '-screen', '0', '1024x768x24'],
+			stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	except OSError:
+		return None
+	os.environ['DISPLAY'] = ':99'
+	time.sleep(0.5)
+	return process
+
+def register_tkcalendar_benchmarks():
+	@shared
+	def setup():
+		try:
+			from tkinter import Tk
+			from tkcalendar import TkCalendar
+			root = Tk()
+		except Exception as e:
+			print("Skipping TkCalendar benchmarks: {}".format(e))
+			return None
+		root.withdraw()
+
+		c = TkCalendar(root)
+		c.grid()
+		return root, c
+
+	@benchmark('TkCalendar.next_month', 24, setup=setup)
+	def next_month(setup):
+		root, c = setup
+		for _ in range(24):
+			c.next_month.invoke()
+			root.update_idletasks()
+
+	@benchmark('TkCalendar.previous_month', 24, setup=setup)
+	def previous_month(setup):
+		root, c = setup
+		for _ in range(24):
+			c.previous_month.invoke()
+			root.update_idletasks()
+
+def compare(results, baseline, threshold):
+	"""
+	Returns the (name, baseline, result) of every benchmark that got
+	slower than its baseline by more than threshold.
+	"""
+	return [
+		(name, baseline[name], result)
+		for name, result in results.items()
+		if name in baseline and result > baseline[name] * (1 + threshold)
+	]
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the scheduler's hot paths.")
+	parser.add_argument('--baseline', default=BASELINE_PATH)
+	parser.add_argument('--save', action='store_true', help="store the results as the baseline")
+	parser.add_argument('--threshold', type=float, default=THRESHOLD)
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--filter', default='', help="only run benchmarks whose name contains this")
+	args = parser.parse_args(argv)
+
+	register_event_benchmarks()
+	register_insert_benchmarks()
+	register_tkcalendar_benchmarks()
+	selected = [b for b in BENCHMARKS if args.filter in b[0]]
+	selected_memory = [b for b in MEMORY_BENCHMARKS if args.filter in b[0]]
+
+	# Only start a display when a TkCalendar benchmark will draw
+	display = start_virtual_display() if any(b[0].startswith('TkCalendar.') for b in selected) else None
+	try:
+		results = {}
+		for name, func, number, setup in selected:
+			if setup:
+				prepared = setup()
+				if prepared is None:
+					continue
+				func = functools.partial(func, prepared)
+			results[name] = measure(func, number, args.repeat)
+			print("{:<40} {:>12.1f} us/op".format(name, results[name] * 1e6))
+		for name, func, number, setup in selected_memory:
+			results[name] = measure_memory(func, number)
+			print("{:<40} {:>12.1f} B/op".format(name, results[name]))
+	finally:
+		if display:
+			display.terminate()
+
+	if args.save:
+		with open(args.baseline, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+		print("Saved baseline to " + args.baseline)
+		return 0
+
+	if not os.path.exists(args.baseline):
+		print("No baseline at {}; run with --save to record one.".format(args.baseline))
+		return 0
+
+	with open(args.baseline) as f:
+		baseline = json.load(f)
+
+	regressions = compare(results, baseline, args.threshold)
+	for name, before, after in regressions:
+		if name.startswith('memory.'):
+			before_s, after_s = "{:.1f} B/op".format(before), "{:.1f} B/op".format(after)
+		else:
+			before_s, after_s = "{:.1f} us/op".format(before * 1e6), "{:.1f} us/op".format(after * 1e6)
+		print("REGRESSION {}: {} -> {} ({:+.0%})".format(name, before_s, after_s, after / before - 1))
+	return 1 if regressions else 0
+
+if __name__ == '__main__':
+	raise SystemExit(main())
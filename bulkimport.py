@@ -0,0 +1,284 @@
+# Headless entry point for creating many events at once
+from scheduler import CalendarEvent, EventRecord, CalendarCredentials
+from oauth2client import tools
+from occurrences import DAYS
+from metrics import metrics
+from eventstore import EventStore
+import zones
+import wire
+
+import argparse
+import csv, json
+import datetime, time
+import queue, threading
+import logging
+
+# Marks the end of the stream of tasks on the pipeline queue
+_DONE = object()
+
+def read_tasks(path):
+	"""
+	Lazily reads the tasks in a JSONL or CSV file, yielding
+	(line number, raw) pairs one row at a time. raw is a dictionary
+	for CSV rows and the undecoded text for JSONL lines, so a line
+	that isn't valid JSON fails on its own in decode_task.
+
+	CSV columns use the keys get_form_data produces; nested keys
+	are written with a dot, ie. 'start.dateTime'.
+	"""
+	with open(path, newline='') as f:
+		if path.endswith('.csv'):
+			# Line 1 is the header
+			for line, row in enumerate(csv.DictReader(f), 2):
+				yield line, _unflatten(row)
+		else:
+			for line, text in enumerate(f, 1):
+				if text.strip():
+					yield line, text
+
+def decode_task(raw):
+	"""
+	Returns the dictionary of a row from read_tasks.
+	"""
+	if isinstance(raw, str):
+		try:
+			raw = json.loads(raw)
+		except ValueError as e:
+			raise ValueError("ERROR. Invalid JSON: {}".format(e))
+		if not isinstance(raw, dict):
+			raise ValueError("ERROR. A task must be a JSON object.")
+	return raw
+
+def _unflatten(row):
+	d = {}
+	for key, value in row.items():
+		if '.' in key:
+			outer, inner = key.split('.', 1)
+			d.setdefault(outer, {})[inner] = value
+		else:
+			d[key] = value
+	return d
+
+def _parse_date(value):
+	if isinstance(value, datetime.date):
+		return value
+	return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+def _parse_time(value):
+	if isinstance(value, datetime.time):
+		return value
+	return datetime.datetime.strptime(value, '%H:%M').time()
+
+def _parse_days(value):
+	if isinstance(value, str):
+		value = [day.strip() for day in value.split(',') if day.strip()]
+	days = [day.upper() for day in value]
+	for day in days:
+		if day not in DAYS:
+			raise ValueError("ERROR. Invalid available day '{}'.".format(day))
+	if len(days) == 0:
+		raise ValueError("ERROR. Toggle at least one day.")
+	return days
+
+def parse_task(raw, time_zone=None):
+	"""
+	Validates a raw task dictionary the same way EventForm does and
+	converts it into the keyword arguments of a CalendarEvent.
+	"""
+	if not raw.get('summary'):
+		raise ValueError("ERROR. Enter event name.")
+
+	time_zone = time_zone or zones.local_zone_name()
+	start = raw.get('start') or {}
+	if isinstance(start, str):
+		start = { 'dateTime' : start }
+	if not start.get('dateTime'):
+		raise ValueError("ERROR. Select a start date.")
+	if not raw.get('endDate'):
+		raise ValueError("ERROR. Select an end date.")
+	if not raw.get('hoursNeeded'):
+		raise ValueError("ERROR. Enter hours needed.")
+
+	start_date = _parse_date(start['dateTime'])
+	end_date = _parse_date(raw['endDate'])
+	if start_date >= end_date:
+		raise ValueError("ERROR. End date must be after start date.")
+
+	zone = start.get('timeZone') or time_zone
+	task = {
+		'summary' : raw['summary'],
+		'location' : raw.get('location') or '',
+		'description' : raw.get('description') or '',
+		# Like the form, the task ends on the day it starts since
+		# the time is allocated over a recurring number of days
+		'start' : { 'dateTime' : start_date.isoformat(), 'timeZone' : zone },
+		'end' : { 'dateTime' : start_date.isoformat(), 'timeZone' : zone },
+		'hoursNeeded' : int(raw['hoursNeeded']),
+		'availableDays' : _parse_days(raw.get('availableDays') or []),
+		'startTime' : _parse_time(raw.get('startTime') or '10:00'),
+		'endDate' : end_date,
+	}
+	# Optional; tasks without one are identified by their fields
+	if raw.get('taskId'):
+		task['taskId'] = str(raw['taskId'])
+	return task
+
+def build_events(path, failures, time_zone=None):
+	"""
+	Yields an EventRecord for every valid task in the file at path.
+	Tasks that fail validation are appended to failures as
+	(line number, error) pairs and skipped.
+	"""
+	# Resolve the local zone once rather than for every row
+	time_zone = time_zone or zones.local_zone_name()
+	for line, raw in read_tasks(path):
+		try:
+			event = EventRecord.from_task(**parse_task(decode_task(raw), time_zone))
+		except Exception as e:
+			failures.append((line, e))
+			continue
+		# Remember where the event came from to report failures
+		event.line = line
+		yield event
+
+class BulkImport():
+	"""
+	Streams the tasks of a JSONL or CSV file into Google Calendar.
+	A reader thread validates tasks and builds the events while the
+	calling thread submits them in batches; the queue between the
+	two is bounded so memory stays flat for any number of rows.
+
+	Required arguments:
+		path -- the JSONL or CSV file of tasks
+
+	Keyword arguments:
+		batch_size -- the number of inserts sent per batch request
+		queue_size -- the number of built events allowed to wait
+			for submission (default four batches)
+		dry_run -- validate and build the events without sending them
+		index -- an EventStore used as the idempotency index, so
+			running the same import again skips the events it
+			already created (default None)
+		store -- an EventStore to keep the created events in, so
+			they can be rescheduled later (default None)
+		service -- the calendar service to insert with
+			(default CalendarCredentials.service)
+	"""
+	def __init__(self, path, batch_size=CalendarEvent.BATCH_SIZE, queue_size=None, dry_run=False, index=None,
+			store=None, service=None):
+		self.path = path
+		self.batch_size = batch_size
+		self.queue = queue.Queue(queue_size or 4 * batch_size)
+		self.dry_run = dry_run
+		self.index = index
+		self.store = store
+		self.service = service
+
+		self.created = 0
+		self.failures = []
+		self.elapsed = 0.0
+
+	def __produce(self):
+		try:
+			for event in build_events(self.path, self.failures):
+				self.queue.put(event)
+		except Exception as e:
+			self.failures.append((None, e))
+		finally:
+			self.queue.put(_DONE)
+
+	def __consume(self):
+		while True:
+			event = self.queue.get()
+			if event is _DONE:
+				return
+			yield event
+
+	def __handle_result(self, event, response, exception):
+		if exception:
+			self.failures.append((event.line, exception))
+		else:
+			self.created += 1
+
+	def run(self):
+		"""
+		Imports every task in the file and returns self with the
+		created, failures and elapsed attributes filled in.
+		"""
+		start = time.perf_counter()
+
+		reader = threading.Thread(target=self.__produce, daemon=True)
+		reader.start()
+
+		if self.dry_run:
+			for event in self.__consume():
+				self.created += 1
+		else:
+			CalendarEvent.create_many(
+				self.__consume(),
+				batch_size=self.batch_size,
+				callback=self.__handle_result,
+				service=self.service,
+				index=self.index,
+				store=self.store,
+			)
+
+		reader.join()
+		self.elapsed = time.perf_counter() - start
+		return self
+
+	def report(self):
+		"""
+		Returns a human readable summary of the import.
+		"""
+		rate = self.created / self.elapsed if self.elapsed else 0.0
+		lines = [
+			"{} events {} in {:.2f}s ({:.1f} events/s), {} failed.".format(
+				self.created,
+				'validated' if self.dry_run else 'created',
+				self.elapsed,
+				rate,
+				len(self.failures),
+			)
+		]
+		for line, error in sorted(self.failures, key=lambda f: f[0] or 0):
+			lines.append("  line {}: {}".format(line if line else '?', error))
+		return '\n'.join(lines)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+		description="Create calendar events from a JSONL or CSV file of tasks.",
+		parents=[tools.argparser],
+	)
+	parser.add_argument('path', help="a .jsonl or .csv file of tasks")
+	parser.add_argument('--batch-size', type=int, default=CalendarEvent.BATCH_SIZE)
+	parser.add_argument('--queue-size', type=int, default=None)
+	parser.add_argument('--dry-run', action='store_true',
+		help="validate the tasks without creating any events")
+	parser.add_argument('--no-index', action='store_true',
+		help="send every event, even ones a previous run already created")
+	parser.add_argument('--lean', action='store_true',
+		help="ask Google for partial responses and send compact bodies")
+	parser.add_argument('--metrics', default=None,
+		help="write timings and counters to this file (.json, otherwise Prometheus text)")
+	parser.add_argument('--log-level', default='WARNING')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=args.log_level.upper(), format='%(levelname)s %(name)s: %(message)s')
+	if args.lean:
+		wire.set_lean(True)
+
+	if not args.dry_run:
+		CalendarCredentials.get_credentials()
+
+	# The created events are kept even when the index is ignored
+	store = None if args.dry_run else EventStore()
+	index = None if args.no_index else store
+	bulk = BulkImport(args.path, args.batch_size, args.queue_size, args.dry_run, index, store).run()
+	print(bulk.report())
+	if args.metrics:
+		metrics.export(args.metrics)
+	return 1 if bulk.failures else 0
+
+if __name__ == '__main__':
+	raise SystemExit(main())
@@ -0,0 +1,172 @@
+# Tests of task validation and of streaming a file of tasks into a
+# FakeCalendarServer
+#
+#	> python -m unittest bulkimport_test
+#
+import datetime, json, os, tempfile
+import unittest
+from unittest import mock
+
+import httplib2
+
+from bulkimport import BulkImport, parse_task
+from eventstore import EventStore
+from executor import RequestExecutor
+from fakecalendar import FakeCalendarServer
+import wire
+
+def task(i, **changes):
+	raw = {
+		'summary' : 'Task {}'.format(i),
+		'start' : { 'dateTime' : '2030-01-07', 'timeZone' : 'Europe/Berlin' },
+		'endDate' : '2030-01-31',
+		'hoursNeeded' : 6,
+		'availableDays' : ['MO', 'WE', 'FR'],
+		'startTime' : '09:30',
+		'taskId' : 'task-{}'.format(i),
+	}
+	raw.update(changes)
+	return raw
+
+class ParseTaskTest(unittest.TestCase):
+	def test_valid_task(self):
+		parsed = parse_task(task(1))
+		self.assertEqual(parsed['start'], { 'dateTime' : '2030-01-07', 'timeZone' : 'Europe/Berlin' })
+		self.assertEqual(parsed['end'], parsed['start'])
+		self.assertEqual(parsed['endDate'], datetime.date(2030, 1, 31))
+		self.assertEqual(parsed['startTime'], datetime.time(9, 30))
+		self.assertEqual(parsed['hoursNeeded'], 6)
+		self.assertEqual(parsed['taskId'], 'task-1')
+
+	def test_csv_values(self):
+		# CSV cells are all strings
+		raw = task(1, hoursNeeded='6', availableDays='mo, we', start={ 'dateTime' : '2030-01-07' })
+		parsed = parse_task(raw, time_zone='America/New_York')
+		self.assertEqual(parsed['availableDays'], ['MO', 'WE'])
+		self.assertEqual(parsed['start']['timeZone'], 'America/New_York')
+
+	def test_defaults(self):
+		raw = task(1)
+		del raw['startTime'], raw['taskId']
+		parsed = parse_task(raw)
+		self.assertEqual(parsed['startTime'], datetime.time(10, 0))
+		self.assertEqual(parsed['location'], '')
+		self.assertNotIn('taskId', parsed)
+
+	def test_invalid_tasks(self):
+		for raw, message in [
+			(task(1, summary=''), 'event name'),
+			(task(1, start={}), 'start date'),
+			(task(1, endDate=None), 'end date'),
+			(task(1, hoursNeeded=0), 'hours needed'),
+			(task(1, endDate='2030-01-07'), 'after start date'),
+			(task(1, availableDays=['XX']), "'XX'"),
+			(task(1, availableDays=[]), 'at least one day'),
+		]:
+			with self.assertRaisesRegex(ValueError, message):
+				parse_task(raw)
+
+	def test_invalid_formats(self):
+		with self.assertRaises(ValueError):
+			parse_task(task(1, endDate='31/01/2030'))
+		with self.assertRaises(ValueError):
+			parse_task(task(1, startTime='9.30'))
+
+class BulkImportTest(unittest.TestCase):
+	def setUp(self):
+		self.server = FakeCalendarServer().start()
+		self.addCleanup(self.server.stop)
+		self.service = wire.build(self.server.document(), httplib2.Http())
+		# The fake has no quota to stay under
+		patcher = mock.patch('scheduler.default_executor', RequestExecutor(user_rate=1000.0, project_rate=1000.0))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		self.directory = directory.name
+		self.store = EventStore(os.path.join(self.directory, 'events.sqlite3'))
+
+	def write(self, name, lines):
+		path = os.path.join(self.directory, name)
+		with open(path, 'w') as f:
+			f.write('\n'.join(lines) + '\n')
+		return path
+
+	def run_import(self, path, **kwargs):
+		kwargs.setdefault('index', self.store)
+		return BulkImport(path, service=self.service, store=self.store, **kwargs).run()
+
+	def live_events(self):
+		return {
+			event_id : event for event_id, event in self.server.calendars.get('primary', {}).items()
+			if event['status'] != 'cancelled'
+		}
+
+	def test_streams_every_task(self):
+		# More tasks than the queue holds, so the reader has to wait
+		# for the batches to be sent
+		path = self.write('tasks.jsonl', [json.dumps(task(i)) for i in range(25)])
+		bulk = self.run_import(path, batch_size=4, queue_size=2)
+
+		self.assertEqual(bulk.failures, [])
+		self.assertEqual(bulk.created, 25)
+		self.assertEqual(len(self.live_events()), 25)
+		# One batch request for every four events
+		self.assertEqual(self.server.stats['requests'], 7)
+		for i in range(25):
+			self.assertEqual(len(self.store.task_events('task-{}'.format(i))), 1)
+
+	def test_malformed_lines_fail_alone(self):
+		path = self.write('tasks.jsonl', [
+			json.dumps(task(1)),
+			'{"summary": ',
+			'',
+			'["not", "an", "object"]',
+			json.dumps(task(4, availableDays=['XX'])),
+			json.dumps(task(5)),
+		])
+		bulk = self.run_import(path)
+
+		self.assertEqual(bulk.created, 2)
+		self.assertEqual([line for line, error in sorted(bulk.failures)], [2, 4, 5])
+		errors = dict(bulk.failures)
+		self.assertIn('Invalid JSON', str(errors[2]))
+		self.assertIn('JSON object', str(errors[4]))
+		self.assertIn("'XX'", str(errors[5]))
+		self.assertIn('line 4: ERROR. A task must be a JSON object.', bulk.report())
+
+	def test_csv(self):
+		path = self.write('tasks.csv', [
+			'summary,start.dateTime,start.timeZone,endDate,hoursNeeded,availableDays,startTime,taskId',
+			'Report,2030-01-07,Europe/Berlin,2030-01-31,6,"MO,WE",09:30,report',
+			'Broken,2030-01-07,Europe/Berlin,2030-01-31,6,"MO,XX",09:30,broken',
+		])
+		bulk = self.run_import(path)
+
+		self.assertEqual(bulk.created, 1)
+		self.assertEqual([line for line, error in bulk.failures], [3])
+		(event,) = self.live_events().values()
+		self.assertEqual(event['summary'], 'Report')
+
+	def test_second_run_sends_nothing(self):
+		path = self.write('tasks.jsonl', [json.dumps(task(i)) for i in range(10)])
+		self.run_import(path)
+		requests = self.server.stats['requests']
+
+		bulk = self.run_import(path)
+		self.assertEqual(bulk.created, 10)
+		self.assertEqual(self.server.stats['requests'], requests)
+		self.assertEqual(len(self.live_events()), 10)
+
+	def test_dry_run(self):
+		path = self.write('tasks.jsonl', [json.dumps(task(i)) for i in range(3)] + ['{'])
+		bulk = BulkImport(path, dry_run=True).run()
+
+		self.assertEqual(bulk.created, 3)
+		self.assertEqual([line for line, error in bulk.failures], [4])
+		self.assertEqual(self.server.stats['requests'], 0)
+		self.assertIn('3 events validated', bulk.report())
+
+if __name__ == '__main__':
+	unittest.main()
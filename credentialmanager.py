@@ -0,0 +1,217 @@
+# Keeps OAuth access tokens fresh before requests need them
+from oauth2client import client
+from oauth2client.file import Storage
+from oauth2client import _helpers
+
+import httplib2
+import datetime
+import os
+import threading
+import logging
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Tokens are refreshed this long before they expire, in seconds
+MARGIN = 5 * 60
+# How long to wait before trying again after a failed refresh
+RETRY_DELAY = 30
+
+def utcnow():
+	# oauth2client keeps token_expiry as a naive UTC datetime
+	return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+class AtomicStorage(Storage):
+	"""
+	An oauth2client file Storage that writes the credentials to a
+	temporary file and moves it over the old one, so a crash or a
+	concurrent reader never sees half written credentials.
+	"""
+	def locked_put(self, credentials):
+		_helpers.validate_file(self._filename)
+		tmp_path = '{}.{}.tmp'.format(self._filename, os.getpid())
+		# Only the user may read the credentials. The mode is given to
+		# os.open rather than set with umask, which is process wide and
+		# would change the files other threads create.
+		flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+		try:
+			fd = os.open(tmp_path, flags, 0o600)
+		except FileExistsError:
+			# Left behind by a process with our pid that died
+			os.remove(tmp_path)
+			fd = os.open(tmp_path, flags, 0o600)
+		try:
+			with os.fdopen(fd, 'w') as f:
+				f.write(credentials.to_json())
+			os.replace(tmp_path, self._filename)
+		except BaseException:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+
+class _Flight():
+	"""
+	A refresh in progress that other threads can wait on.
+	"""
+	__slots__ = ('done', 'error')
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.error = None
+
+class CredentialManager():
+	"""
+	Refreshes the access token of credentials on a background timer
+	shortly before it expires, so API calls don't stall on a refresh
+	or come back with 401s in the middle of a bulk run.
+
+	Threads that find the token about to expire while a refresh is
+	already running wait for that refresh instead of starting their
+	own. If the credentials have a Storage, oauth2client writes the
+	new token to it; use AtomicStorage so that write is atomic.
+
+	Required arguments:
+		credentials -- the oauth2client credentials to keep fresh
+
+	Keyword arguments:
+		margin -- refresh this many seconds before expiry
+			(default MARGIN)
+		http_factory -- makes the Http used to refresh
+		clock -- returns the current naive UTC datetime
+	"""
+	def __init__(self, credentials, margin=MARGIN, http_factory=httplib2.Http, clock=utcnow):
+		self.credentials = credentials
+		self.margin = datetime.timedelta(seconds=margin)
+		self.http_factory = http_factory
+		self.clock = clock
+
+		self.refreshes = 0
+		self.__lock = threading.Lock()
+		self.__flight = None
+		self.__timer = None
+		self.__running = False
+
+	def expires_soon(self):
+		"""
+		Returns True if there is no access token or it expires within
+		the margin.
+		"""
+		credentials = self.credentials
+		if not credentials.access_token:
+			return True
+		if not credentials.token_expiry:
+			return False
+		return credentials.token_expiry - self.clock() <= self.margin
+
+	def refresh(self, if_expires_soon=False):
+		"""
+		Refreshes the access token. If another thread is already
+		refreshing it, waits for that refresh instead.
+
+		Keyword arguments:
+			if_expires_soon -- only refresh if the token still expires
+				within the margin, ie. no other thread refreshed it
+				since the caller checked
+		"""
+		with self.__lock:
+			flight = self.__flight
+			leader = flight is None
+			if leader:
+				if if_expires_soon and not self.expires_soon():
+					return
+				flight = self.__flight = _Flight()
+
+		if not leader:
+			flight.done.wait()
+			if flight.error:
+				raise flight.error
+			return
+
+		try:
+			with metrics.span('credential_refresh'):
+				self.credentials.refresh(self.http_factory())
+			self.refreshes += 1
+			log.info("Access token refreshed, expires %s", self.credentials.token_expiry)
+		except Exception as e:
+			flight.error = e
+			raise
+		finally:
+			with self.__lock:
+				self.__flight = None
+			flight.done.set()
+			self.__schedule(RETRY_DELAY if flight.error else None)
+
+	def ensure_fresh(self):
+		"""
+		Refreshes the access token if it expires within the margin.
+		Cheap when it doesn't, so it can run before every request.
+		"""
+		if self.expires_soon():
+			self.refresh(if_expires_soon=True)
+
+	def authorize(self, http):
+		"""
+		Authorizes http with the credentials and makes sure the token
+		is fresh before each of its requests.
+		"""
+		http = self.credentials.authorize(http)
+		request = http.request
+
+		def fresh_request(*args, **kwargs):
+			self.ensure_fresh()
+			return request(*args, **kwargs)
+
+		# googleapiclient finds the credentials of a batch here
+		fresh_request.credentials = self.credentials
+		http.request = fresh_request
+		return http
+
+	def start(self):
+		"""
+		Starts refreshing in the background.
+		"""
+		self.__running = True
+		self.__schedule()
+		return self
+
+	def stop(self):
+		self.__running = False
+		with self.__lock:
+			if self.__timer:
+				self.__timer.cancel()
+				self.__timer = None
+
+	def __schedule(self, delay=None):
+		if not self.__running:
+			return
+		if self.credentials.invalid:
+			log.warning("Credentials were revoked; background refresh stopped.")
+			return
+
+		if delay is None:
+			if not self.credentials.token_expiry:
+				# The token never expires, or there isn't one yet and the
+				# first request will get it
+				return
+			due = self.credentials.token_expiry - self.margin - self.clock()
+			delay = max(0.0, due.total_seconds())
+
+		timer = threading.Timer(delay, self.__refresh_in_background)
+		timer.daemon = True
+		with self.__lock:
+			if self.__timer:
+				self.__timer.cancel()
+			self.__timer = timer
+		timer.start()
+
+	def __refresh_in_background(self):
+		try:
+			self.ensure_fresh()
+		except client.HttpAccessTokenRefreshError as e:
+			log.error("Refreshing the access token failed: %s", e)
+		except Exception as e:
+			log.warning("Refreshing the access token failed (%s), retrying in %ss", e, RETRY_DELAY)
+		else:
+			# ensure_fresh did nothing if another thread just refreshed
+			self.__schedule()
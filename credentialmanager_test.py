@@ -0,0 +1,100 @@
+# Tests that concurrent requests share a single token refresh, against
+# the token endpoint of a FakeCalendarServer, and that AtomicStorage
+# writes credentials only the user can read
+#
+#	> python -m unittest credentialmanager_test
+#
+import os, tempfile
+import threading
+import unittest
+from unittest import mock
+
+from oauth2client import client
+
+from credentialmanager import AtomicStorage, CredentialManager
+from fakecalendar import FakeCalendarServer
+
+THREADS = 16
+
+def credentials(token_uri):
+	# No access token yet, so the first request must refresh
+	return client.OAuth2Credentials(None, 'client-id', 'client-secret', 'refresh-token', None, token_uri, 'scheduler-test')
+
+class SingleRefreshTest(unittest.TestCase):
+	def setUp(self):
+		# Slow enough that every thread arrives while the first
+		# refresh is still running
+		self.server = FakeCalendarServer(latency=0.2).start()
+		self.addCleanup(self.server.stop)
+
+	def ensure_fresh_at_once(self, manager):
+		# Calls ensure_fresh from every thread at the same moment and
+		# returns what each raised
+		barrier = threading.Barrier(THREADS)
+		errors = [None] * THREADS
+		def run(position):
+			barrier.wait()
+			try:
+				manager.ensure_fresh()
+			except Exception as e:
+				errors[position] = e
+		threads = [threading.Thread(target=run, args=(position,)) for position in range(THREADS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join(10)
+		return errors
+
+	def test_one_refresh_for_all_threads(self):
+		manager = CredentialManager(credentials(self.server.token_uri))
+		self.assertTrue(manager.expires_soon())
+
+		self.assertEqual(self.ensure_fresh_at_once(manager), [None] * THREADS)
+		self.assertEqual(self.server.stats['tokens'], 1)
+		self.assertEqual(manager.refreshes, 1)
+		self.assertIn(manager.credentials.access_token, self.server.tokens)
+		self.assertFalse(manager.expires_soon())
+
+		# A fresh token isn't refreshed again
+		manager.ensure_fresh()
+		self.assertEqual(self.server.stats['tokens'], 1)
+
+	def test_waiting_threads_get_the_error(self):
+		manager = CredentialManager(credentials(self.server.uri + '/no-token-here'))
+
+		errors = self.ensure_fresh_at_once(manager)
+		self.assertTrue(all(isinstance(e, client.HttpAccessTokenRefreshError) for e in errors), errors)
+		self.assertEqual(self.server.stats['requests'], 1)
+		self.assertEqual(manager.refreshes, 0)
+
+class AtomicStorageTest(unittest.TestCase):
+	def setUp(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		self.path = os.path.join(directory.name, 'credentials.json')
+		self.storage = AtomicStorage(self.path)
+
+	def test_only_the_user_can_read(self):
+		old_umask = os.umask(0)
+		try:
+			with mock.patch('os.umask') as umask:
+				self.storage.put(credentials('https://example.com/token'))
+			umask.assert_not_called()
+		finally:
+			os.umask(old_umask)
+		self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+		self.assertEqual(self.storage.get().refresh_token, 'refresh-token')
+		self.assertEqual(os.listdir(os.path.dirname(self.path)), ['credentials.json'])
+
+	def test_stale_temporary_file(self):
+		tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+		with open(tmp_path, 'w') as f:
+			f.write('half written')
+		os.chmod(tmp_path, 0o644)
+		self.storage.put(credentials('https://example.com/token'))
+		self.assertFalse(os.path.exists(tmp_path))
+		self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+		self.assertEqual(self.storage.get().client_id, 'client-id')
+
+if __name__ == '__main__':
+	unittest.main()
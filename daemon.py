@@ -0,0 +1,346 @@
+# Long running scheduler that keeps the authorized Calendar service,
+# its connections and caches warm, and schedules tasks sent to it over
+# a local socket. See daemonclient.py for the client.
+#
+#	> python daemon.py                     serve on ~/.cache/scheduler/daemon.sock
+#	> python daemon.py --port 8765         serve on 127.0.0.1:8765 instead
+#
+# Any local user can connect to a TCP port, so with --port the daemon
+# keeps a random secret in ~/.cache/scheduler/daemon.secret, readable
+# only by its owner, and every connection must start with it:
+#
+#	{"id": 0, "op": "auth", "secret": "..."}
+#
+# Every line sent to the daemon is a JSON request and every line it
+# sends back a JSON reply carrying the request's id:
+#
+#	{"id": 1, "op": "schedule", "calendar_id": "primary", "tasks": [...], "avoid_busy": true}
+#	{"id": 1, "index": 0, "event_id": "...", "htmlLink": "..."}
+#	{"id": 1, "index": 1, "error": "ERROR. ..."}
+#	{"id": 1, "done": true, "failed": 1}
+#
+# The other ops are "ping" and "metrics".
+import argparse
+import hmac, json, os, secrets
+import signal, socket, socketserver
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+
+from oauth2client import tools
+
+from scheduler import CalendarEvent, CalendarCredentials
+from bulkimport import parse_task
+from daemonclient import DEFAULT_SOCKET, DEFAULT_SECRET, read_secret
+from eventstore import EventStore
+from freebusy import BusyCache, event_busy
+from metrics import metrics
+import discoverycache
+import wire
+
+log = logging.getLogger(__name__)
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+	daemon_threads = True
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+def create_secret(path=DEFAULT_SECRET):
+	"""
+	Returns the secret stored at path, first writing a new random one
+	only this user can read if there is none.
+	"""
+	directory = os.path.dirname(os.path.abspath(path))
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	try:
+		fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+	except FileExistsError:
+		pass
+	else:
+		with os.fdopen(fd, 'w') as f:
+			f.write(secrets.token_urlsafe(32) + '\n')
+	return read_secret(path)
+
+class _Handler(socketserver.StreamRequestHandler):
+	scheduler = None
+	secret = None
+
+	def handle(self):
+		# Replies of a connection's jobs are written from the pool's
+		# threads, one line at a time
+		lock = threading.Lock()
+		def send(reply):
+			data = json.dumps(reply, separators=(',', ':')).encode('utf-8') + b'\n'
+			with lock:
+				try:
+					self.wfile.write(data)
+					self.wfile.flush()
+				except OSError:
+					# The client went away; its jobs still finish
+					pass
+
+		lines = iter(self.rfile)
+		if self.secret is not None and not self.__authorized(next(lines, b''), send):
+			return
+
+		jobs = []
+		for line in lines:
+			if not line.strip():
+				continue
+			try:
+				request = json.loads(line.decode('utf-8'))
+				if not isinstance(request, dict):
+					raise ValueError()
+			except ValueError:
+				send({ 'id' : None, 'done' : True, 'error' : "ERROR. Requests must be JSON objects." })
+				continue
+			jobs.extend(self.scheduler.handle(request, send))
+
+		# Finish what the client asked for before the connection closes
+		wait(jobs)
+
+	def __authorized(self, line, send):
+		request_id, given = None, None
+		try:
+			request = json.loads(line.decode('utf-8'))
+		except ValueError:
+			request = None
+		if isinstance(request, dict):
+			request_id = request.get('id')
+			if request.get('op') == 'auth':
+				given = request.get('secret')
+		if not isinstance(given, str) or not hmac.compare_digest(given.encode('utf-8'), self.secret.encode('utf-8')):
+			send({ 'id' : request_id, 'done' : True, 'error' : "ERROR. Connections to the daemon's port must start with its secret." })
+			return False
+		send({ 'id' : request_id, 'done' : True })
+		return True
+
+class SchedulerDaemon():
+	"""
+	Schedules tasks on behalf of local clients with one authorized
+	Calendar service per worker thread, built once from the cached
+	discovery document, so no request pays for imports, argument
+	parsing, loading credentials or building the service.
+
+	Required arguments:
+		manager -- the CredentialManager keeping the token fresh
+
+	Keyword arguments:
+		address -- a Unix socket path, or a (host, port) pair to serve
+			on localhost (default DEFAULT_SOCKET)
+		workers -- tasks scheduled at the same time (default 8)
+		index -- an EventStore whose idempotency index keeps repeated
+			jobs from creating events twice
+		document -- the discovery document to build services from
+			(default the cached Calendar v3 document)
+		secret -- the secret every connection must start with;
+			required when serving on a port
+	"""
+	def __init__(self, manager, address=DEFAULT_SOCKET, workers=8, index=None, document=None, secret=None):
+		if not isinstance(address, str) and not secret:
+			raise Exception("ERROR. Serving on a port requires a secret.")
+		self.manager = manager
+		self.address = address
+		self.index = index
+		self.document = document or discoverycache.load_document('calendar', 'v3')
+
+		self.busy_cache = BusyCache()
+		self.pool = ThreadPoolExecutor(workers, thread_name_prefix='daemon')
+		self.local = threading.local()
+		self.started = time.time()
+		self.in_flight = 0
+		self.lock = threading.Lock()
+
+		daemon = self
+		class Handler(_Handler):
+			scheduler = daemon
+		if not isinstance(address, str):
+			Handler.secret = secret
+
+		if isinstance(address, str):
+			self.__remove_stale_socket()
+			self.server = _UnixServer(address, Handler, bind_and_activate=False)
+			# Only this user may talk to the daemon; it acts with their
+			# calendar credentials
+			umask = os.umask(0o177)
+			try:
+				self.server.server_bind()
+			finally:
+				os.umask(umask)
+			self.server.server_activate()
+		else:
+			self.server = _TCPServer(address, Handler)
+		self.thread = None
+
+	def __remove_stale_socket(self):
+		if not os.path.exists(self.address):
+			return
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(self.address)
+		except OSError:
+			# Left behind by a daemon that didn't shut down cleanly
+			os.remove(self.address)
+		else:
+			raise Exception("ERROR. A scheduler daemon is already running at {}.".format(self.address))
+		finally:
+			probe.close()
+
+	@property
+	def server_address(self):
+		return self.server.server_address
+
+	def service(self):
+		# An Http can't be shared between threads, so every worker
+		# keeps its own service and the connections in it
+		service = getattr(self.local, 'service', None)
+		if service is None:
+			http = self.manager.authorize(wire.Http())
+			service = self.local.service = wire.build(self.document, http)
+		return service
+
+	def start(self):
+		"""
+		Serves on a background thread and returns self.
+		"""
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		log.info("Serving on %s", self.server_address)
+		return self
+
+	def stop(self):
+		"""
+		Stops accepting jobs, waits for the running ones and removes
+		the socket.
+		"""
+		self.server.shutdown()
+		self.server.server_close()
+		self.pool.shutdown(wait=True)
+		if isinstance(self.address, str) and os.path.exists(self.address):
+			os.remove(self.address)
+
+	def handle(self, request, send):
+		"""
+		Answers one request through send, returning the futures of
+		the jobs it started.
+		"""
+		op = request.get('op')
+		request_id = request.get('id')
+		if op == 'ping':
+			send({
+				'id' : request_id, 'done' : True, 'pid' : os.getpid(),
+				'uptime' : time.time() - self.started, 'in_flight' : self.in_flight,
+			})
+			return []
+		if op == 'metrics':
+			send({ 'id' : request_id, 'done' : True, 'metrics' : metrics.snapshot() })
+			return []
+		if op != 'schedule':
+			send({ 'id' : request_id, 'done' : True, 'error' : "ERROR. Unknown op '{}'.".format(op) })
+			return []
+
+		tasks = request.get('tasks') or []
+		calendar_id = request.get('calendar_id') or 'primary'
+		avoid_busy = bool(request.get('avoid_busy'))
+		metrics.inc('daemon_jobs_total')
+		if not tasks:
+			send({ 'id' : request_id, 'done' : True, 'failed' : 0 })
+			return []
+
+		# The last task to finish closes the job
+		state = { 'left' : len(tasks), 'failed' : 0 }
+		state_lock = threading.Lock()
+		def finish(index, reply):
+			reply = dict(reply, id=request_id, index=index)
+			send(reply)
+			with state_lock:
+				state['left'] -= 1
+				state['failed'] += 'error' in reply
+				done = state['left'] == 0
+			if done:
+				send({ 'id' : request_id, 'done' : True, 'failed' : state['failed'] })
+
+		jobs = []
+		for index, raw in enumerate(tasks):
+			try:
+				jobs.append(self.pool.submit(self.__schedule, raw, calendar_id, avoid_busy, index, finish))
+			except RuntimeError:
+				# stop() shut the pool while the connection was still open
+				finish(index, { 'error' : "ERROR. The scheduler daemon is shutting down." })
+		return jobs
+
+	def __schedule(self, raw, calendar_id, avoid_busy, index, finish):
+		with self.lock:
+			self.in_flight += 1
+		try:
+			with metrics.span('daemon_task'):
+				event = CalendarEvent(**parse_task(raw))
+				event.calendar_id = calendar_id
+				busy = None
+				if avoid_busy:
+					# One worker's own service, on its own thread
+					busy = lambda event: event_busy(event, self.service, self.busy_cache, max_workers=1)
+				response = event.create_event(
+					self.service(), calendar_id, index=self.index, store=self.index, busy=busy
+				)
+		except Exception as e:
+			log.warning("Task %d failed: %s", index, e)
+			reply = { 'error' : str(e) }
+		else:
+			reply = { 'event_id' : response.get('id'), 'htmlLink' : response.get('htmlLink') }
+		finally:
+			with self.lock:
+				self.in_flight -= 1
+		finish(index, reply)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+		description="Keep the scheduler running and schedule tasks sent over a local socket.",
+		parents=[tools.argparser],
+	)
+	parser.add_argument('--socket', default=DEFAULT_SOCKET)
+	parser.add_argument('--port', type=int, default=None, help="serve on this localhost port instead")
+	parser.add_argument('--secret-file', default=DEFAULT_SECRET,
+		help="with --port, the file holding the secret clients must send; created if missing")
+	parser.add_argument('--workers', type=int, default=8)
+	parser.add_argument('--no-index', action='store_true',
+		help="send every event, even ones a previous job already created")
+	parser.add_argument('--lean', action='store_true',
+		help="ask Google for partial responses and send compact bodies")
+	parser.add_argument('--log-level', default='INFO')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=args.log_level.upper(), format='%(levelname)s %(name)s: %(message)s')
+	if args.lean:
+		wire.set_lean(True)
+
+	CalendarCredentials.get_credentials()
+	if not CalendarCredentials.manager:
+		raise Exception("ERROR. User must be logged in to run the daemon.")
+
+	address = ('127.0.0.1', args.port) if args.port else args.socket
+	directory = os.path.dirname(os.path.abspath(args.socket))
+	if not args.port and not os.path.exists(directory):
+		os.makedirs(directory)
+
+	secret = create_secret(args.secret_file) if args.port else None
+	index = None if args.no_index else EventStore()
+	daemon = SchedulerDaemon(CalendarCredentials.manager, address, args.workers, index, secret=secret).start()
+
+	stopping = threading.Event()
+	signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+	try:
+		while not stopping.wait(1):
+			pass
+	except KeyboardInterrupt:
+		pass
+	log.info("Shutting down")
+	daemon.stop()
+	CalendarCredentials.manager.stop()
+	return 0
+
+if __name__ == '__main__':
+	raise SystemExit(main())
@@ -0,0 +1,174 @@
+# Tests of the scheduler daemon and its client against a
+# FakeCalendarServer
+#
+#	> python -m unittest daemon_test
+#
+import json, os, socket, tempfile
+import unittest
+from unittest import mock
+
+from oauth2client import client
+
+from credentialmanager import CredentialManager
+from daemon import SchedulerDaemon, create_secret
+from daemonclient import DaemonClient, DaemonError, read_secret
+from eventstore import EventStore
+from executor import RequestExecutor
+from fakecalendar import FakeCalendarServer
+
+def task(i, **changes):
+	raw = {
+		'summary' : 'Task {}'.format(i),
+		'start' : { 'dateTime' : '2030-01-07', 'timeZone' : 'Europe/Berlin' },
+		'endDate' : '2030-01-31',
+		'hoursNeeded' : 6,
+		'availableDays' : ['MO', 'WE', 'FR'],
+		'startTime' : '09:30',
+		'taskId' : 'task-{}'.format(i),
+	}
+	raw.update(changes)
+	return raw
+
+class DaemonTestCase(unittest.TestCase):
+	def setUp(self):
+		self.server = FakeCalendarServer().start()
+		self.addCleanup(self.server.stop)
+		patcher = mock.patch('scheduler.default_executor', RequestExecutor(user_rate=1000.0, project_rate=1000.0))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		self.directory = directory.name
+		self.index = EventStore(os.path.join(self.directory, 'events.sqlite3'))
+
+		credentials = client.OAuth2Credentials(
+			None, 'client-id', 'client-secret', 'refresh-token', None, self.server.token_uri, 'scheduler-test'
+		)
+		self.manager = CredentialManager(credentials)
+
+	def start_daemon(self, address, **kwargs):
+		daemon = SchedulerDaemon(
+			self.manager, address, workers=4, index=self.index, document=self.server.document(), **kwargs
+		).start()
+		self.addCleanup(daemon.stop)
+		return daemon
+
+	def live_events(self):
+		return {
+			event_id : event for event_id, event in self.server.calendars.get('primary', {}).items()
+			if event['status'] != 'cancelled'
+		}
+
+class ScheduleTest(DaemonTestCase):
+	def setUp(self):
+		super().setUp()
+		self.daemon = self.start_daemon(os.path.join(self.directory, 'daemon.sock'))
+
+	def test_results_stream_in(self):
+		tasks = [task(i) for i in range(6)] + [task(6, availableDays=['XX'])]
+		with DaemonClient(self.daemon.server_address, timeout=30) as client:
+			with self.assertLogs('daemon', 'WARNING'):
+				results = list(client.schedule(tasks))
+
+		self.assertEqual(sorted(result['index'] for result in results), list(range(7)))
+		failed = [result for result in results if 'error' in result]
+		self.assertEqual([result['index'] for result in failed], [6])
+		self.assertIn("'XX'", failed[0]['error'])
+
+		events = self.live_events()
+		self.assertEqual(len(events), 6)
+		for result in results:
+			if 'error' not in result:
+				self.assertIn(result['event_id'], events)
+
+	def test_repeated_job_creates_nothing(self):
+		tasks = [task(i) for i in range(3)]
+		with DaemonClient(self.daemon.server_address, timeout=30) as client:
+			first = sorted((result['index'], result['event_id']) for result in client.schedule(tasks))
+			calls = self.server.stats['calls']
+			second = sorted((result['index'], result['event_id']) for result in client.schedule(tasks))
+		self.assertEqual(first, second)
+		self.assertEqual(self.server.stats['calls'], calls)
+		self.assertEqual(len(self.live_events()), 3)
+
+	def test_ping_and_invalid_requests(self):
+		with DaemonClient(self.daemon.server_address, timeout=30) as client:
+			self.assertEqual(client.ping()['pid'], os.getpid())
+
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout(30)
+		sock.connect(self.daemon.server_address)
+		with sock, sock.makefile('rb') as reader:
+			sock.sendall(b'[1, 2]\n{"id": 3, "op": "nope"}\n')
+			self.assertEqual(json.loads(reader.readline())['error'], "ERROR. Requests must be JSON objects.")
+			self.assertEqual(json.loads(reader.readline())['error'], "ERROR. Unknown op 'nope'.")
+
+	def test_jobs_after_stop_fail(self):
+		self.daemon.stop()
+		replies = []
+		self.daemon.handle({ 'id' : 1, 'op' : 'schedule', 'tasks' : [task(0), task(1)] }, replies.append)
+		self.assertEqual([reply.get('error') for reply in replies[:2]], ["ERROR. The scheduler daemon is shutting down."] * 2)
+		self.assertEqual(replies[2], { 'id' : 1, 'done' : True, 'failed' : 2 })
+		self.assertEqual(self.live_events(), {})
+
+class SecretTest(DaemonTestCase):
+	def setUp(self):
+		super().setUp()
+		self.secret_path = os.path.join(self.directory, 'daemon.secret')
+		self.secret = create_secret(self.secret_path)
+		self.daemon = self.start_daemon(('127.0.0.1', 0), secret=self.secret)
+
+	def lines(self, data):
+		# Sends raw data and returns the replies until the daemon
+		# closes the connection
+		sock = socket.create_connection(self.daemon.server_address, timeout=30)
+		with sock, sock.makefile('rb') as reader:
+			sock.sendall(data)
+			return [json.loads(line) for line in reader]
+
+	def test_secret_file(self):
+		self.assertEqual(os.stat(self.secret_path).st_mode & 0o777, 0o600)
+		self.assertEqual(read_secret(self.secret_path), self.secret)
+		# An existing secret is kept
+		self.assertEqual(create_secret(self.secret_path), self.secret)
+
+	def test_readable_secret_file_is_refused(self):
+		os.chmod(self.secret_path, 0o644)
+		with self.assertRaisesRegex(DaemonError, 'chmod 600'):
+			read_secret(self.secret_path)
+
+	def test_port_requires_a_secret(self):
+		with self.assertRaisesRegex(Exception, 'requires a secret'):
+			SchedulerDaemon(self.manager, ('127.0.0.1', 0), document=self.server.document())
+
+	def test_right_secret(self):
+		with DaemonClient(self.daemon.server_address, timeout=30, secret=self.secret) as client:
+			self.assertEqual(client.ping()['pid'], os.getpid())
+			(result,) = client.schedule([task(0)])
+		self.assertIn(result['event_id'], self.live_events())
+
+	def test_bad_secret(self):
+		with self.assertRaisesRegex(DaemonError, 'must start with its secret'):
+			DaemonClient(self.daemon.server_address, timeout=30, secret='wrong').connect()
+
+	def test_missing_secret(self):
+		# A job without the secret first is refused, and nothing after
+		# it is read
+		job = json.dumps({ 'id' : 1, 'op' : 'schedule', 'tasks' : [task(0)] })
+		replies = self.lines(job.encode('utf-8') + b'\n')
+		self.assertEqual(len(replies), 1)
+		self.assertEqual(replies[0]['id'], 1)
+		self.assertIn('must start with its secret', replies[0]['error'])
+		self.assertEqual(self.live_events(), {})
+
+	def test_empty_connection(self):
+		sock = socket.create_connection(self.daemon.server_address, timeout=30)
+		with sock, sock.makefile('rb') as reader:
+			sock.shutdown(socket.SHUT_WR)
+			reply = json.loads(reader.readline())
+		self.assertIsNone(reply['id'])
+		self.assertIn('must start with its secret', reply['error'])
+
+if __name__ == '__main__':
+	unittest.main()
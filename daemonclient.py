@@ -0,0 +1,209 @@
+# Thin client of the scheduler daemon. Only the standard library is
+# imported so submitting a job starts in milliseconds.
+#
+#	> python daemonclient.py tasks.jsonl
+#	> python daemonclient.py --port 8765 tasks.jsonl     sends ~/.cache/scheduler/daemon.secret first
+#	> python daemonclient.py --ping
+#
+import argparse
+import datetime
+import json, os
+import socket, sys
+
+# Where the daemon listens unless told otherwise. Kept here rather than
+# in daemon.py so the client never imports the Google libraries.
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.cache', 'scheduler', 'daemon.sock')
+# Any local user can connect to a TCP port, so a client of a daemon
+# serving on one must first send the secret the daemon keeps here
+DEFAULT_SECRET = os.path.join(os.path.expanduser('~'), '.cache', 'scheduler', 'daemon.secret')
+
+def encode_task(d):
+	"""
+	Returns a copy of a dictionary from EventForm.get_form_data that
+	can be dumped to JSON. Dates and times become the strings
+	bulkimport.parse_task reads.
+	"""
+	d = dict(d)
+	if isinstance(d.get('endDate'), datetime.date):
+		d['endDate'] = d['endDate'].isoformat()
+	if isinstance(d.get('startTime'), datetime.time):
+		d['startTime'] = d['startTime'].strftime('%H:%M')
+	return d
+
+class DaemonError(Exception):
+	pass
+
+def read_secret(path=DEFAULT_SECRET):
+	"""
+	Returns the daemon's secret stored at path. The file must belong
+	to this user and nobody else may read or write it.
+	"""
+	try:
+		f = open(path)
+	except FileNotFoundError:
+		raise DaemonError("ERROR. No daemon secret at {}; daemon.py --port creates it.".format(path))
+	with f:
+		st = os.fstat(f.fileno())
+		if st.st_uid != os.getuid() or st.st_mode & 0o077:
+			raise DaemonError("ERROR. {} must belong to you and be readable only by you (chmod 600).".format(path))
+		secret = f.read().strip()
+	if not secret:
+		raise DaemonError("ERROR. The daemon secret at {} is empty.".format(path))
+	return secret
+
+class DaemonClient():
+	"""
+	Sends jobs to a running daemon.py and reads its results back as
+	they come in. One connection can carry any number of jobs, one
+	after the other.
+
+	Keyword arguments:
+		address -- the daemon's Unix socket path, or a (host, port)
+			pair when it serves on localhost (default DEFAULT_SOCKET)
+		timeout -- seconds to wait for each line of the reply
+			(default 300)
+		secret -- the daemon's secret, sent first on every
+			connection; needed when it serves on a TCP port
+	"""
+	def __init__(self, address=DEFAULT_SOCKET, timeout=300, secret=None):
+		self.address = address
+		self.timeout = timeout
+		self.secret = secret
+		self.sock = None
+		self.reader = None
+		self.next_id = 0
+
+	def connect(self):
+		if self.sock is None:
+			if isinstance(self.address, str):
+				self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			else:
+				self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			self.sock.settimeout(self.timeout)
+			try:
+				self.sock.connect(self.address)
+			except OSError as e:
+				self.close()
+				raise DaemonError("ERROR. No scheduler daemon at {}: {}".format(self.address, e))
+			self.reader = self.sock.makefile('rb')
+			if self.secret is not None:
+				try:
+					self.__result({ 'op' : 'auth', 'secret' : self.secret })
+				except DaemonError:
+					self.close()
+					raise
+		return self
+
+	def close(self):
+		if self.reader:
+			self.reader.close()
+			self.reader = None
+		if self.sock:
+			self.sock.close()
+			self.sock = None
+
+	def __enter__(self):
+		return self.connect()
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def __call(self, request):
+		self.connect()
+		self.next_id += 1
+		request = dict(request, id=self.next_id)
+		self.sock.sendall(json.dumps(request, separators=(',', ':')).encode('utf-8') + b'\n')
+
+		while True:
+			line = self.reader.readline()
+			if not line:
+				self.close()
+				raise DaemonError("ERROR. The scheduler daemon closed the connection.")
+			reply = json.loads(line.decode('utf-8'))
+			if reply.get('id') != request['id']:
+				continue
+			yield reply
+			if reply.get('done'):
+				return
+
+	def __result(self, request):
+		reply = list(self.__call(request))[-1]
+		if 'error' in reply:
+			raise DaemonError(reply['error'])
+		return reply
+
+	def schedule(self, tasks, calendar_id='primary', avoid_busy=False):
+		"""
+		Submits tasks, each like the dictionary get_form_data returns,
+		and yields a result for each as soon as its event exists:
+		{ 'index' : position in tasks, 'event_id' : ..., 'htmlLink' : ... }
+		or { 'index' : ..., 'error' : message }. Results come in the
+		order the daemon finishes them. With avoid_busy the daemon
+		leaves out the days the calendar is already busy at the time
+		of a task.
+		"""
+		request = {
+			'op' : 'schedule',
+			'calendar_id' : calendar_id,
+			'tasks' : [encode_task(task) for task in tasks],
+			'avoid_busy' : avoid_busy,
+		}
+		for reply in self.__call(request):
+			if reply.get('done'):
+				if 'error' in reply:
+					raise DaemonError(reply['error'])
+				return
+			yield reply
+
+	def ping(self):
+		"""
+		Returns the daemon's pid, uptime and jobs in flight.
+		"""
+		return self.__result({ 'op' : 'ping' })
+
+	def metrics(self):
+		"""
+		Returns the daemon's metrics.snapshot().
+		"""
+		return self.__result({ 'op' : 'metrics' })['metrics']
+
+def _address(args):
+	return ('127.0.0.1', args.port) if args.port else args.socket
+
+def _secret(args):
+	return read_secret(args.secret_file) if args.port else None
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Schedule tasks through a running scheduler daemon.")
+	parser.add_argument('path', nargs='?', help="a JSONL file of tasks; - reads standard input")
+	parser.add_argument('--socket', default=DEFAULT_SOCKET)
+	parser.add_argument('--port', type=int, default=None, help="the localhost port the daemon serves on")
+	parser.add_argument('--secret-file', default=DEFAULT_SECRET,
+		help="with --port, the file holding the daemon's secret")
+	parser.add_argument('--calendar', default='primary')
+	parser.add_argument('--ping', action='store_true', help="check the daemon is running")
+	parser.add_argument('--avoid-busy', action='store_true',
+		help="leave out the days the calendar is already busy at a task's time")
+	args = parser.parse_args(argv)
+
+	with DaemonClient(_address(args), secret=_secret(args)) as client:
+		if args.ping or not args.path:
+			print(json.dumps(client.ping()))
+			return 0
+
+		f = sys.stdin if args.path == '-' else open(args.path)
+		with f:
+			tasks = [json.loads(line) for line in f if line.strip()]
+
+		failed = 0
+		for result in client.schedule(tasks, args.calendar, args.avoid_busy):
+			failed += 'error' in result
+			print(json.dumps(result), flush=True)
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	try:
+		raise SystemExit(main())
+	except DaemonError as e:
+		print(e, file=sys.stderr)
+		raise SystemExit(2)
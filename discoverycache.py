@@ -0,0 +1,157 @@
+# On disk cache of the Google API discovery documents
+import httplib2
+import os, json, time
+import argparse
+import threading
+import logging
+
+try:
+	from googleapiclient.discovery_cache import get_static_doc
+except ImportError:
+	# google-api-python-client before 2.0 ships no documents
+	get_static_doc = None
+
+log = logging.getLogger(__name__)
+
+DISCOVERY_URI = 'https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest'
+
+# Where fetched documents are kept between runs
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'scheduler')
+# A static copy shipped next to the source, used when there is no
+# cache and no network
+BUNDLED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery')
+
+# Documents older than this are refetched (one week)
+MAX_AGE = 7 * 24 * 60 * 60
+
+class DiscoveryUnavailable(Exception):
+	pass
+
+def document_path(directory, api, version):
+	"""
+	Returns where the document of an api version is stored inside
+	directory. The version is part of the name so moving to a new
+	version never reads an old document.
+	"""
+	return os.path.join(directory, '{}.{}.json'.format(api, version))
+
+def _read(path):
+	with open(path) as f:
+		return f.read()
+
+def _write(path, content):
+	directory = os.path.dirname(path)
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+
+	# Write to a temporary file first so a reader never sees half
+	# a document
+	tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+	with open(tmp_path, 'w') as f:
+		f.write(content)
+	os.replace(tmp_path, path)
+
+def fetch_document(api, version, http=None):
+	"""
+	Downloads the discovery document of an api version and returns
+	it as a string.
+	"""
+	http = http or httplib2.Http()
+	response, content = http.request(DISCOVERY_URI.format(api=api, version=version))
+	if response.status >= 400:
+		raise DiscoveryUnavailable(
+			"ERROR. Fetching the {} {} discovery document returned {}.".format(api, version, response.status)
+		)
+	if isinstance(content, bytes):
+		content = content.decode('utf-8')
+	# Make sure what we store actually parses
+	json.loads(content)
+	return content
+
+def is_stale(path, max_age=MAX_AGE):
+	"""
+	Returns True if the file at path is missing or older than max_age
+	seconds.
+	"""
+	try:
+		return time.time() - os.path.getmtime(path) > max_age
+	except OSError:
+		return True
+
+def local_document(api, version, bundled_dir=BUNDLED_DIR):
+	"""
+	Returns the bundled copy of the discovery document of an api
+	version, or the static copy google-api-python-client ships with,
+	without touching the network. Returns None if there is neither.
+	"""
+	path = document_path(bundled_dir, api, version)
+	if os.path.exists(path):
+		return _read(path)
+	if get_static_doc:
+		return get_static_doc(api, version)
+	return None
+
+def _refresh(api, version, http, cache_path):
+	try:
+		_write(cache_path, fetch_document(api, version, http))
+	except Exception as e:
+		log.debug("Refreshing the %s %s discovery document failed: %s", api, version, e)
+
+def load_document(api, version, http=None, max_age=MAX_AGE, cache_dir=CACHE_DIR, bundled_dir=BUNDLED_DIR):
+	"""
+	Returns the discovery document of an api version as a string.
+
+	A cached copy younger than max_age is returned as is. Otherwise a
+	stale cached copy, the bundled copy or the one shipped with
+	google-api-python-client is returned, and the cache is refreshed on
+	a background thread for the next run, so starting up never waits on
+	the network. Only when there is no copy at all is the document
+	fetched before returning.
+	"""
+	cache_path = document_path(cache_dir, api, version)
+	if not is_stale(cache_path, max_age):
+		return _read(cache_path)
+
+	content = _read(cache_path) if os.path.exists(cache_path) else local_document(api, version, bundled_dir)
+	if content is not None:
+		threading.Thread(target=_refresh, args=(api, version, http, cache_path), daemon=True).start()
+		return content
+
+	try:
+		content = fetch_document(api, version, http)
+	except Exception as e:
+		raise DiscoveryUnavailable(
+			"ERROR. No local {} {} discovery document and fetching it failed: {}".format(api, version, e)
+		)
+
+	try:
+		_write(cache_path, content)
+	except OSError as e:
+		log.warning("Could not cache discovery document: %s", e)
+
+	return content
+
+def bundle_document(api, version, http=None, bundled_dir=BUNDLED_DIR):
+	"""
+	Fetches the discovery document of an api version and stores it as
+	the bundled copy.
+	"""
+	path = document_path(bundled_dir, api, version)
+	_write(path, fetch_document(api, version, http))
+	return path
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description="Refresh the cached discovery document or bundle a static copy of it."
+	)
+	parser.add_argument('--api', default='calendar')
+	parser.add_argument('--version', default='v3')
+	parser.add_argument('--bundle', action='store_true',
+		help="store the document next to the source instead of in the cache")
+	args = parser.parse_args()
+
+	if args.bundle:
+		print("Bundled discovery document at " + bundle_document(args.api, args.version))
+	else:
+		_write(document_path(CACHE_DIR, args.api, args.version), fetch_document(args.api, args.version))
+		print("Cached discovery document at " + document_path(CACHE_DIR, args.api, args.version))
@@ -5,7 +5,11 @@ from tkinter import WORD, NORMAL, END
 
 # The calendar widget
 from tkcalendar import TkCalendar
-import calendar, datetime, tzlocal
+# Runs our callback off of the tkinter thread
+from worker import BackgroundWorker
+import calendar, datetime
+
+import zones
 
 class EventForm(Frame):
 	"""
@@ -20,9 +24,15 @@ class EventForm(Frame):
 
 	Keyword arguments:
 		create_event_callback -- a callback function that handles
-			the returned event dictionary. 
+			the returned event dictionary. It runs on a background
+			thread so slow network calls don't freeze the form.
+		worker -- the BackgroundWorker that runs the callback. Pass
+			one in to share it with other widgets. (default a new
+			BackgroundWorker)
+		day_info -- passed on to the TkCalendar to show what is
+			already on each day. (default None)
 	"""
-	def __init__(self, parent, create_event_callback=lambda d: print(d)):
+	def __init__(self, parent, create_event_callback=lambda d: print(d), worker=None, day_info=None):
 		super().__init__(parent)
 
 		self.create_event_callback = create_event_callback
@@ -31,8 +41,13 @@ class EventForm(Frame):
 
 		# A TkCalendar that will be placed to the right 
 		# of our input form.
-		self.tkcalendar = TkCalendar(self, self.__handle_date)
+		self.tkcalendar = TkCalendar(self, self.__handle_date, day_info=day_info)
 		self.create_event = Button(self, text="Create Event", command=self.__handle_callback)
+
+		# Shows how many events are still being created and
+		# the result of the last one
+		self.status = Label(self, text='', anchor='w')
+		self.worker = worker or BackgroundWorker(self)
 		self.__draw_widgets()
 
 	def __setup_form_widgets(self):
@@ -87,6 +102,12 @@ class EventForm(Frame):
 		self.description_label = Label(self.form, text="Description: ")
 		self.description = Text(self.form, height=5, width=entry_width, font='TkDefaultFont', wrap=WORD)
 
+		# Off unless asked for, as planning around busy days needs a
+		# freebusy query for every event
+		self.avoid_busy_label = Label(self.form, text="Avoid Busy Days: ")
+		self.avoid_busy_var = IntVar()
+		self.avoid_busy = Checkbutton(self.form, variable=self.avoid_busy_var)
+
 		self.form_widgets = [
 			(self.event_label, self.event), 
 			(self.time_label, self.time),
@@ -96,6 +117,7 @@ class EventForm(Frame):
 			(self.hours_label, self.hours), 
 			(self.location_label, self.location), 
 			(self.description_label, self.description),
+			(self.avoid_busy_label, self.avoid_busy),
 		] 
 
 	def __set_focus(self, event):
@@ -111,6 +133,7 @@ class EventForm(Frame):
 
 		self.tkcalendar.grid(sticky='N', row=0, column=1, columnspan=7, pady=5)
 		self.create_event.grid(row=1, column=0)
+		self.status.grid(sticky='W', row=2, column=0, columnspan=8, padx=10)
 
 	def __handle_date(self, date):
 		self.focus_date.date = date
@@ -121,13 +144,37 @@ class EventForm(Frame):
 		self.focus_date.config(state='readonly')
 
 	def __handle_callback(self):
-		d = self.get_form_data()
-		self.create_event_callback(d)
+		try:
+			d = self.get_form_data()
+		except Exception as e:
+			self.status.config(text=str(e), foreground='red')
+			return
+
+		# Several events can be queued while earlier ones are
+		# still being sent
+		self.worker.submit(
+			self.create_event_callback, d,
+			on_success=self.__handle_created,
+			on_error=self.__handle_error,
+		)
+		self.__set_status("Creating {} ...".format(d['summary']))
+
+	def __set_status(self, text, foreground='black'):
+		if self.worker.pending:
+			text = "{} ({} in progress)".format(text, self.worker.pending)
+		self.status.config(text=text, foreground=foreground)
+
+	def __handle_created(self, result):
+		self.__set_status("Event created.")
+
+	def __handle_error(self, error):
+		self.__set_status(str(error), 'red')
 
 	def get_form_data(self):
 		"""
 		Returns a dictionary containing keys that correspond to
-		a CalendarEvent. 
+		a CalendarEvent, plus avoidBusy, whether to plan the event
+		around the days the calendar is already busy.
 		"""
 		# Make sure they made an event name
 		if self.event.get() == '':
@@ -142,26 +189,29 @@ class EventForm(Frame):
 		if self.start.date < self.tkcalendar.today:
 			raise Exception("ERROR. Cannot schedule event starting in the past.")
 
+		# The zone is looked up once per process
+		time_zone = zones.local_zone_name()
 		d = {
 			'summary' : self.event.get(),
 			'location' : self.location.get(),
 			'description' : self.description.get("1.0", END),
 			'start' : { 
 				'dateTime' : self.start.date.isoformat(), 
-				'timeZone' : str(tzlocal.get_localzone()),
+				'timeZone' : time_zone,
 			},
 			'end' : { 
 				# Our task will end on the same day since we
 				# will be allocating hours over a recurring 
 				# number of days
 				'dateTime' : self.start.date.isoformat(), 
-				'timeZone' : str(tzlocal.get_localzone()),
+				'timeZone' : time_zone,
 			},
 
 			'hoursNeeded' : self.hours.get(),
 			'availableDays' : self.available_days.selected_days(),
 			'startTime' : self.time.get_time(),
 			'endDate' : self.end.date,
+			'avoidBusy' : bool(self.avoid_busy_var.get()),
 		}
 
 		# End date is when we need the task completed by
@@ -0,0 +1,394 @@
+# Local SQLite mirror of calendar events
+import sqlite3
+import os, json
+import datetime
+import threading
+
+from discoverycache import CACHE_DIR
+from executor import default_executor
+from freebusy import parse_time, format_time
+import occurrences
+import zones
+import wire
+
+DEFAULT_PATH = os.path.join(CACHE_DIR, 'events.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+	calendar_id TEXT NOT NULL,
+	event_id TEXT NOT NULL,
+	task_id TEXT,
+	summary TEXT,
+	start TEXT,
+	end TEXT,
+	etag TEXT,
+	updated TEXT,
+	body TEXT NOT NULL,
+	PRIMARY KEY (calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_by_time ON events (calendar_id, start, end);
+CREATE INDEX IF NOT EXISTS events_by_task ON events (task_id);
+CREATE TABLE IF NOT EXISTS inserted (
+	calendar_id TEXT NOT NULL,
+	event_id TEXT NOT NULL,
+	PRIMARY KEY (calendar_id, event_id)
+);
+CREATE TABLE IF NOT EXISTS sync_tokens (
+	calendar_id TEXT PRIMARY KEY,
+	token TEXT NOT NULL
+);
+"""
+
+def event_time(when):
+	"""
+	Turns the start or end of an event resource into a UTC string
+	that sorts in time order. All day events start at midnight UTC.
+	"""
+	if not when:
+		return None
+	if 'dateTime' in when:
+		dt = parse_time(when['dateTime'])
+		if dt.tzinfo is None:
+			# Local time in the zone of the event, not of this machine
+			dt = zones.to_utc(dt, when.get('timeZone'))
+		return format_time(dt)
+	return when['date'] + 'T00:00:00Z'
+
+def task_id_of(event):
+	"""
+	Returns the scheduler task id stored on an event, if any.
+	"""
+	return event.get('extendedProperties', {}).get('private', {}).get('schedulerTaskId')
+
+def _rule_times(event):
+	# The UTC (start, end) of every occurrence of a recurring event
+	# made by set_recurrence, for when none of its instances are stored
+	when = event.get('start') or {}
+	if 'dateTime' not in when:
+		return []
+	start = parse_time(when['dateTime']).replace(tzinfo=None)
+	length = parse_time(event['end']['dateTime']).replace(tzinfo=None) - start
+	rules = event['recurrence']
+	try:
+		local = occurrences.expand_rule(rules[0], start, when.get('timeZone'))
+	except ValueError:
+		# A rule made by another client
+		return []
+	excluded = occurrences.parse_exdates(rules[1:])
+	return [
+		(zones.to_utc(occurrence, when.get('timeZone')), zones.to_utc(occurrence + length, when.get('timeZone')))
+		for occurrence in local if occurrence not in excluded
+	]
+
+class EventStore():
+	"""
+	Keeps a copy of calendar events in SQLite so availability checks,
+	duplicate detection and the calendar overlay don't need a round
+	trip to Google. It also holds the idempotency index: the ids of
+	the events we inserted, so reruns don't send them again.
+
+	Every thread gets its own connection. The database runs in WAL
+	mode so reads never wait on a write, and writes are serialized
+	by a lock.
+
+	Keyword arguments:
+		path -- the database file (default DEFAULT_PATH)
+	"""
+	def __init__(self, path=DEFAULT_PATH):
+		self.path = path
+		directory = os.path.dirname(os.path.abspath(path))
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+		self.__local = threading.local()
+		self.__write_lock = threading.Lock()
+
+		connection = self.connection()
+		connection.execute('PRAGMA journal_mode=WAL')
+		connection.executescript(SCHEMA)
+		connection.commit()
+
+	def connection(self):
+		"""
+		Returns the connection of the calling thread.
+		"""
+		connection = getattr(self.__local, 'connection', None)
+		if connection is None:
+			connection = sqlite3.connect(self.path, timeout=30)
+			self.__local.connection = connection
+		return connection
+
+	def close(self):
+		"""
+		Closes the connection of the calling thread.
+		"""
+		connection = getattr(self.__local, 'connection', None)
+		if connection is not None:
+			connection.close()
+			self.__local.connection = None
+
+	def upsert(self, calendar_id, events):
+		"""
+		Stores or replaces event resources from the API. Cancelled
+		events are removed instead.
+
+		Recurring events are kept for their rule, ie. to reschedule
+		them, but take up no time: only their single instances, as
+		synced, have a start and end.
+		"""
+		rows, removed = [], []
+		for event in events:
+			if event.get('status') == 'cancelled':
+				removed.append((calendar_id, event['id']))
+				continue
+			timed = not event.get('recurrence')
+			rows.append((
+				calendar_id,
+				event['id'],
+				task_id_of(event),
+				event.get('summary'),
+				event_time(event.get('start')) if timed else None,
+				event_time(event.get('end')) if timed else None,
+				event.get('etag'),
+				event.get('updated'),
+				json.dumps(event),
+			))
+
+		with self.__write_lock:
+			connection = self.connection()
+			with connection:
+				connection.executemany(
+					'INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+				)
+				connection.executemany(
+					'DELETE FROM events WHERE calendar_id = ? AND event_id = ?', removed
+				)
+
+	def delete(self, calendar_id, event_id=None):
+		"""
+		Removes one event, or every event of the calendar when no
+		event_id is given.
+		"""
+		with self.__write_lock:
+			connection = self.connection()
+			with connection:
+				if event_id is None:
+					connection.execute('DELETE FROM events WHERE calendar_id = ?', (calendar_id,))
+				else:
+					connection.execute(
+						'DELETE FROM events WHERE calendar_id = ? AND event_id = ?', (calendar_id, event_id)
+					)
+
+	def retain(self, calendar_id, event_ids):
+		"""
+		Removes every event of calendar_id whose id isn't in event_ids.
+		"""
+		with self.__write_lock:
+			connection = self.connection()
+			with connection:
+				connection.execute('CREATE TEMP TABLE IF NOT EXISTS retained (event_id TEXT PRIMARY KEY)')
+				connection.execute('DELETE FROM retained')
+				connection.executemany('INSERT OR IGNORE INTO retained VALUES (?)', ((i,) for i in event_ids))
+				connection.execute(
+					'DELETE FROM events WHERE calendar_id = ? AND event_id NOT IN (SELECT event_id FROM retained)',
+					(calendar_id,),
+				)
+
+	def sync_token(self, calendar_id):
+		row = self.connection().execute(
+			'SELECT token FROM sync_tokens WHERE calendar_id = ?', (calendar_id,)
+		).fetchone()
+		return row[0] if row else None
+
+	def set_sync_token(self, calendar_id, token):
+		"""
+		Stores the sync token of calendar_id, or forgets it when token
+		is None.
+		"""
+		with self.__write_lock:
+			connection = self.connection()
+			with connection:
+				if token is None:
+					connection.execute('DELETE FROM sync_tokens WHERE calendar_id = ?', (calendar_id,))
+				else:
+					connection.execute('INSERT OR REPLACE INTO sync_tokens VALUES (?, ?)', (calendar_id, token))
+
+	def populate(self, service, calendar_id, time_min=None, time_max=None):
+		"""
+		Lists the events of calendar_id through the API, page by page,
+		and stores them. Recurring events are stored as their single
+		instances. Returns the number of events listed.
+		"""
+		kwargs = {
+			'calendarId' : calendar_id, 'singleEvents' : True, 'maxResults' : 2500,
+			'fields' : wire.fields('list'),
+		}
+		if time_min:
+			kwargs['timeMin'] = format_time(time_min)
+		if time_max:
+			kwargs['timeMax'] = format_time(time_max)
+
+		listed = 0
+		request = service.events().list(**kwargs)
+		while request is not None:
+			response = default_executor.execute(request)
+			items = response.get('items', [])
+			self.upsert(calendar_id, items)
+			listed += len(items)
+			request = service.events().list_next(request, response)
+		return listed
+
+	def get(self, calendar_id, event_id):
+		row = self.connection().execute(
+			'SELECT body FROM events WHERE calendar_id = ? AND event_id = ?', (calendar_id, event_id)
+		).fetchone()
+		return json.loads(row[0]) if row else None
+
+	def events_between(self, calendar_id, time_min, time_max):
+		"""
+		Returns the stored events of calendar_id overlapping time_min
+		to time_max, ordered by start.
+		"""
+		rows = self.connection().execute(
+			'SELECT body FROM events WHERE calendar_id = ? AND start < ? AND end > ? ORDER BY start',
+			(calendar_id, format_time(time_max), format_time(time_min)),
+		)
+		return [json.loads(body) for body, in rows]
+
+	def busy_intervals(self, calendar_id, time_min, time_max):
+		"""
+		Returns the (start, end) datetimes of the stored events of
+		calendar_id overlapping time_min to time_max.
+		"""
+		rows = self.connection().execute(
+			'SELECT start, end FROM events WHERE calendar_id = ? AND start < ? AND end > ? ORDER BY start',
+			(calendar_id, format_time(time_max), format_time(time_min)),
+		)
+		return [(parse_time(start), parse_time(end)) for start, end in rows]
+
+	def is_free(self, calendar_id, time_min, time_max):
+		row = self.connection().execute(
+			'SELECT 1 FROM events WHERE calendar_id = ? AND start < ? AND end > ? LIMIT 1',
+			(calendar_id, format_time(time_max), format_time(time_min)),
+		).fetchone()
+		return row is None
+
+	def find_duplicate(self, calendar_id, body):
+		"""
+		Returns a stored event with the same summary and start as the
+		event body, or None.
+		"""
+		row = self.connection().execute(
+			'SELECT body FROM events WHERE calendar_id = ? AND summary = ? AND start = ? LIMIT 1',
+			(calendar_id, body.get('summary'), event_time(body.get('start'))),
+		).fetchone()
+		return json.loads(row[0]) if row else None
+
+	def record_inserted(self, calendar_id, event_ids):
+		"""
+		Adds the ids of events we inserted on calendar_id to the
+		idempotency index.
+		"""
+		with self.__write_lock:
+			connection = self.connection()
+			connection.executemany(
+				'INSERT OR IGNORE INTO inserted (calendar_id, event_id) VALUES (?, ?)',
+				[(calendar_id, event_id) for event_id in event_ids],
+			)
+			connection.commit()
+
+	def inserted_ids(self, calendar_id, event_ids):
+		"""
+		Returns the set of event_ids the idempotency index says were
+		already inserted on calendar_id.
+		"""
+		event_ids = list(event_ids)
+		found = set()
+		# Stay under SQLite's limit of variables in a statement
+		for i in range(0, len(event_ids), 500):
+			chunk = event_ids[i:i + 500]
+			rows = self.connection().execute(
+				'SELECT event_id FROM inserted WHERE calendar_id = ? AND event_id IN ({})'.format(
+					','.join('?' * len(chunk))
+				),
+				[calendar_id] + chunk,
+			)
+			found.update(row[0] for row in rows)
+		return found
+
+	def task_events(self, task_id):
+		"""
+		Returns (calendar id, event) pairs of every stored event
+		created for a scheduler task. A recurring event comes first,
+		followed by the instances synced of it.
+		"""
+		rows = self.connection().execute(
+			'SELECT calendar_id, body FROM events WHERE task_id = ? ORDER BY start', (task_id,)
+		)
+		return [(calendar_id, json.loads(body)) for calendar_id, body in rows]
+
+	def task_intervals(self, calendar_id, task_id, event_id):
+		"""
+		Returns the UTC (start, end) datetimes the stored events of a
+		scheduler task take on calendar_id: the events carrying
+		task_id and the event event_id. A recurring event none of
+		whose instances are stored is expanded from its rule.
+		"""
+		rows = self.connection().execute(
+			'SELECT start, end, body FROM events WHERE calendar_id = ? AND (task_id = ? OR event_id = ?)',
+			(calendar_id, task_id, event_id),
+		)
+		intervals, masters, expanded = [], [], set()
+		for start, end, body in rows:
+			event = json.loads(body)
+			if start:
+				intervals.append((parse_time(start), parse_time(end)))
+				expanded.add(event.get('recurringEventId'))
+			else:
+				masters.append(event)
+		for event in masters:
+			if event['id'] not in expanded:
+				intervals.extend(_rule_times(event))
+		return intervals
+
+	def day_summary(self, calendar_id, first_date, last_date, tz=None):
+		"""
+		Returns a dictionary of date to (event count, busy minutes)
+		for the days from first_date through last_date, in the time
+		zone tz (default the local zone). Days without events are left
+		out.
+		"""
+		tz = tz or zones.get_zone(zones.local_zone_name())
+		time_min = datetime.datetime.combine(first_date, datetime.time(0), tz)
+		time_max = datetime.datetime.combine(last_date + datetime.timedelta(days=1), datetime.time(0), tz)
+
+		summary = {}
+		for start, end in self.busy_intervals(calendar_id, time_min, time_max):
+			start, end = max(start, time_min), min(end, time_max)
+			# Split events that cross midnight across their days. Midnight
+			# is taken in UTC: aware datetimes of one zone subtract as wall
+			# clock times, which is an hour off on days the clocks change
+			day = start.astimezone(tz).date()
+			while True:
+				midnight = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(0), tz).astimezone(zones.UTC)
+				piece_end = min(end, midnight)
+				count, minutes = summary.get(day, (0, 0))
+				summary[day] = (count + 1, minutes + int((piece_end - start).total_seconds() // 60))
+				if end <= midnight:
+					break
+				start, day = midnight, day + datetime.timedelta(days=1)
+		return summary
+
+def busy_hours_info(store, calendar_id):
+	"""
+	Returns a function for TkCalendar's day_info that shows the hours
+	already busy on each day of a month, read from store.
+	"""
+	def day_info(year, month):
+		first = datetime.date(year, month, 1)
+		last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+		return {
+			day : '{:g}h'.format(round(minutes / 30) / 2)
+			for day, (count, minutes) in store.day_summary(calendar_id, first, last).items()
+		}
+	return day_info
@@ -0,0 +1,194 @@
+# Tests of the local SQLite mirror of calendar events
+#
+#	> python -m unittest eventstore_test
+#
+import datetime, os, tempfile
+import threading
+import unittest
+
+from eventstore import EventStore
+import zones
+
+BERLIN = zones.get_zone('Europe/Berlin')
+
+def event(event_id, start, end, **fields):
+	return dict(fields, id=event_id, status='confirmed', start={ 'dateTime' : start }, end={ 'dateTime' : end })
+
+def task_properties(task_id):
+	return { 'private' : { 'schedulerTaskId' : task_id } }
+
+class StoreTestCase(unittest.TestCase):
+	def setUp(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		self.store = EventStore(os.path.join(directory.name, 'events.sqlite3'))
+		self.addCleanup(self.store.close)
+
+class ConnectionTest(StoreTestCase):
+	def test_wal_mode(self):
+		self.assertEqual(self.store.connection().execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+	def test_connection_per_thread(self):
+		connections = []
+		thread = threading.Thread(target=lambda: connections.append(self.store.connection()))
+		thread.start()
+		thread.join()
+		self.assertIs(self.store.connection(), self.store.connection())
+		self.assertIsNot(connections[0], self.store.connection())
+
+	def test_reads_dont_wait_on_a_write(self):
+		self.store.upsert('primary', [event('a', '2030-01-07T09:00:00Z', '2030-01-07T10:00:00Z')])
+		# Hold a write transaction open on this thread's connection
+		connection = self.store.connection()
+		connection.execute('BEGIN IMMEDIATE')
+		connection.execute('DELETE FROM events')
+
+		found = []
+		def read():
+			found.append(self.store.get('primary', 'a'))
+			self.store.close()
+		thread = threading.Thread(target=read)
+		thread.start()
+		thread.join(5)
+		connection.rollback()
+		self.assertFalse(thread.is_alive())
+		# The reader saw the last committed state
+		self.assertEqual(found[0]['id'], 'a')
+
+	def test_concurrent_writes(self):
+		def write(thread):
+			for i in range(20):
+				start = '2030-01-{:02d}T09:00:00Z'.format(i + 1)
+				self.store.upsert('primary', [event('{}-{}'.format(thread, i), start, start.replace('09', '10'))])
+			self.store.close()
+		threads = [threading.Thread(target=write, args=(thread,)) for thread in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join(10)
+		count = self.store.connection().execute('SELECT COUNT(*) FROM events').fetchone()[0]
+		self.assertEqual(count, 160)
+
+class DaySummaryTest(StoreTestCase):
+	def summary(self, first, last):
+		return self.store.day_summary('primary', first, last, BERLIN)
+
+	def test_spring_forward_day(self):
+		# 31 March 2030 has 23 hours in Berlin
+		self.store.upsert('primary', [
+			event('day', '2030-03-31T00:00:00+01:00', '2030-04-01T00:00:00+02:00'),
+		])
+		self.assertEqual(
+			self.summary(datetime.date(2030, 3, 30), datetime.date(2030, 4, 1)),
+			{ datetime.date(2030, 3, 31) : (1, 23 * 60) },
+		)
+
+	def test_fall_back_day(self):
+		# 27 October 2030 has 25 hours in Berlin
+		self.store.upsert('primary', [
+			event('day', '2030-10-27T00:00:00+02:00', '2030-10-28T00:00:00+01:00'),
+		])
+		self.assertEqual(
+			self.summary(datetime.date(2030, 10, 26), datetime.date(2030, 10, 28)),
+			{ datetime.date(2030, 10, 27) : (1, 25 * 60) },
+		)
+
+	def test_split_at_local_midnight(self):
+		self.store.upsert('primary', [
+			event('night', '2030-03-30T23:00:00+01:00', '2030-03-31T04:00:00+02:00'),
+			event('winter', '2030-01-10T23:00:00+01:00', '2030-01-11T00:30:00+01:00'),
+		])
+		self.assertEqual(self.summary(datetime.date(2030, 3, 30), datetime.date(2030, 3, 31)), {
+			datetime.date(2030, 3, 30) : (1, 60),
+			datetime.date(2030, 3, 31) : (1, 180),
+		})
+		self.assertEqual(self.summary(datetime.date(2030, 1, 10), datetime.date(2030, 1, 11)), {
+			datetime.date(2030, 1, 10) : (1, 60),
+			datetime.date(2030, 1, 11) : (1, 30),
+		})
+
+	def test_local_times_in_the_event_zone(self):
+		# Times without an offset are in the zone of the event, not of
+		# this machine
+		self.store.upsert('primary', [{
+			'id' : 'local',
+			'status' : 'confirmed',
+			'start' : { 'dateTime' : '2030-03-31T09:00:00', 'timeZone' : 'Europe/Berlin' },
+			'end' : { 'dateTime' : '2030-03-31T11:30:00', 'timeZone' : 'Europe/Berlin' },
+		}])
+		(start, end), = self.store.busy_intervals(
+			'primary', datetime.datetime(2030, 3, 31, tzinfo=zones.UTC), datetime.datetime(2030, 4, 1, tzinfo=zones.UTC)
+		)
+		self.assertEqual(start, datetime.datetime(2030, 3, 31, 7, tzinfo=zones.UTC))
+		self.assertEqual(self.summary(datetime.date(2030, 3, 31), datetime.date(2030, 3, 31)), {
+			datetime.date(2030, 3, 31) : (1, 150),
+		})
+
+	def test_range_clips_events(self):
+		self.store.upsert('primary', [
+			event('long', '2030-01-09T12:00:00+01:00', '2030-01-12T12:00:00+01:00'),
+		])
+		self.assertEqual(self.summary(datetime.date(2030, 1, 10), datetime.date(2030, 1, 10)), {
+			datetime.date(2030, 1, 10) : (1, 24 * 60),
+		})
+
+class RecurringEventTest(StoreTestCase):
+	def setUp(self):
+		super().setUp()
+		self.master = {
+			'id' : 'weekly',
+			'status' : 'confirmed',
+			'summary' : 'Report',
+			'start' : { 'dateTime' : '2030-01-07T09:30:00', 'timeZone' : 'Europe/Berlin' },
+			'end' : { 'dateTime' : '2030-01-07T11:30:00', 'timeZone' : 'Europe/Berlin' },
+			'recurrence' : [
+				'RRULE:FREQ=WEEKLY;INTERVAL=1;UNTIL=20300120T225959Z;BYDAY=MO,WE',
+				'EXDATE;TZID=Europe/Berlin:20300109T093000',
+			],
+			'extendedProperties' : task_properties('report'),
+		}
+		self.store.upsert('primary', [self.master])
+
+	def instance(self, day):
+		start = '2030-01-{:02d}T09:30:00+01:00'.format(day)
+		return dict(
+			event('weekly_203001{:02d}T083000Z'.format(day), start, start.replace('T09', 'T11')),
+			recurringEventId='weekly', extendedProperties=task_properties('report'),
+		)
+
+	def test_stored_without_times(self):
+		row = self.store.connection().execute(
+			'SELECT task_id, start, end FROM events WHERE event_id = ?', ('weekly',)
+		).fetchone()
+		self.assertEqual(row, ('report', None, None))
+		self.assertEqual(self.store.get('primary', 'weekly'), self.master)
+		self.assertEqual(self.store.task_events('report'), [('primary', self.master)])
+
+	def test_takes_no_time(self):
+		first, last = datetime.date(2030, 1, 1), datetime.date(2030, 1, 31)
+		self.assertEqual(self.store.day_summary('primary', first, last, BERLIN), {})
+		self.store.upsert('primary', [self.instance(7), self.instance(14)])
+		self.assertEqual(self.store.day_summary('primary', first, last, BERLIN), {
+			datetime.date(2030, 1, 7) : (1, 120),
+			datetime.date(2030, 1, 14) : (1, 120),
+		})
+
+	def test_task_intervals_expand_the_rule(self):
+		starts = [start for start, end in self.store.task_intervals('primary', 'report', 'weekly')]
+		# The 9th is left out by the EXDATE
+		self.assertEqual(starts, [
+			datetime.datetime(2030, 1, day, 8, 30, tzinfo=zones.UTC) for day in (7, 14, 16)
+		])
+
+	def test_task_intervals_prefer_instances(self):
+		self.store.upsert('primary', [self.instance(14)])
+		self.assertEqual(self.store.task_intervals('primary', 'report', 'weekly'), [
+			(datetime.datetime(2030, 1, 14, 8, 30, tzinfo=zones.UTC), datetime.datetime(2030, 1, 14, 10, 30, tzinfo=zones.UTC)),
+		])
+
+	def test_cancelled_removes(self):
+		self.store.upsert('primary', [dict(self.master, status='cancelled')])
+		self.assertIsNone(self.store.get('primary', 'weekly'))
+
+if __name__ == '__main__':
+	unittest.main()
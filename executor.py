@@ -0,0 +1,222 @@
+# Runs API requests within quota, retrying the ones Google turns away
+from apiclient.errors import HttpError
+
+import json, random
+import socket
+import threading, time
+import logging
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Default Calendar API quotas: 600 queries a minute for each user and
+# 10,000 a minute for the whole project. We aim slightly below both.
+USER_RATE = 9.0
+PROJECT_RATE = 160.0
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+class TokenBucket():
+	"""
+	A token bucket refilled at rate tokens a second that holds at
+	most capacity tokens. acquire() blocks until there are enough.
+	"""
+	def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+		self.rate = rate
+		self.capacity = capacity or rate
+		self.tokens = self.capacity
+		self.clock = clock
+		self.sleep = sleep
+
+		self.updated = clock()
+		self.__lock = threading.Lock()
+
+	def __refill(self):
+		now = self.clock()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self, tokens=1):
+		"""
+		Takes tokens from the bucket, waiting for them if needed.
+		Returns how long we waited, in seconds.
+		"""
+		# A request larger than the bucket goes once the bucket is
+		# full and leaves it in debt, so later requests pay for it
+		needed = min(tokens, self.capacity)
+		waited = 0.0
+		while True:
+			with self.__lock:
+				self.__refill()
+				if self.tokens >= needed:
+					self.tokens -= tokens
+					return waited
+				wait = (needed - self.tokens) / self.rate
+			self.sleep(wait)
+			waited += wait
+
+def error_reason(error):
+	"""
+	Returns the reason Google gave for an HttpError, ie.
+	'rateLimitExceeded', or None.
+	"""
+	try:
+		content = error.content
+		if isinstance(content, bytes):
+			content = content.decode('utf-8')
+		return json.loads(content)['error']['errors'][0]['reason']
+	except Exception:
+		return None
+
+def is_retryable(error):
+	if isinstance(error, HttpError):
+		status = error.resp.status
+		if status in RETRY_STATUSES:
+			return True
+		return status == 403 and error_reason(error) in RETRY_REASONS
+	# Dropped connections and timeouts
+	return isinstance(error, (socket.timeout, ConnectionError))
+
+def retry_after(error):
+	"""
+	Returns the seconds a Retry-After header asks us to wait, or None.
+	"""
+	if not isinstance(error, HttpError):
+		return None
+	try:
+		return max(0.0, float(error.resp.get('retry-after')))
+	except (TypeError, ValueError):
+		return None
+
+class RequestExecutor():
+	"""
+	Executes API requests for every part of the scheduler. Requests
+	first take a token from the project's bucket and from the bucket
+	of the user they're made for, so we stay under the quotas instead
+	of being throttled by Google. Requests that fail with a rate limit
+	or server error are retried with jittered exponential backoff,
+	waiting for Retry-After when Google sends it.
+
+	Keyword arguments:
+		user_rate -- requests a second allowed for each user
+		project_rate -- requests a second allowed for the project
+		max_retries -- retries before giving up on a request
+		base_delay -- the backoff before the first retry, in seconds
+		max_delay -- the longest backoff, in seconds
+		clock, sleep -- the time source and sleep of the buckets and
+			the backoff, ie. to test without waiting
+	"""
+	def __init__(self, user_rate=USER_RATE, project_rate=PROJECT_RATE,
+			max_retries=6, base_delay=1.0, max_delay=64.0, clock=time.monotonic, sleep=time.sleep):
+		self.user_rate = user_rate
+		self.max_retries = max_retries
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.clock = clock
+		self.sleep = sleep
+
+		self.project_bucket = TokenBucket(project_rate, clock=clock, sleep=sleep)
+		self.user_buckets = {}
+
+		self.__lock = threading.Lock()
+		self.counters = {
+			'calls' : 0,
+			'succeeded' : 0,
+			'failed' : 0,
+			'throttled' : 0,
+			'retried' : 0,
+			'throttled_seconds' : 0.0,
+			'backoff_seconds' : 0.0,
+		}
+
+	def set_rates(self, user_rate=None, project_rate=None):
+		"""
+		Changes the requests a second allowed for each user and for the
+		project, ie. for a project with a raised quota.
+		"""
+		with self.__lock:
+			if user_rate:
+				self.user_rate = user_rate
+				self.user_buckets = {}
+			if project_rate:
+				self.project_bucket = TokenBucket(project_rate, clock=self.clock, sleep=self.sleep)
+
+	def __count(self, name, amount=1):
+		with self.__lock:
+			self.counters[name] += amount
+
+	def stats(self):
+		"""
+		Returns a copy of the counters.
+		"""
+		with self.__lock:
+			return dict(self.counters)
+
+	def __user_bucket(self, user):
+		with self.__lock:
+			bucket = self.user_buckets.get(user)
+			if bucket is None:
+				bucket = self.user_buckets[user] = TokenBucket(self.user_rate, clock=self.clock, sleep=self.sleep)
+			return bucket
+
+	def throttle(self, user=None, cost=1):
+		"""
+		Takes cost tokens from the project's bucket and from the bucket
+		of user, waiting for them if needed. execute does this before
+		every attempt; clients that send requests themselves call it.
+		"""
+		waited = self.project_bucket.acquire(cost)
+		waited += self.__user_bucket(user).acquire(cost)
+		if waited:
+			self.__count('throttled')
+			self.__count('throttled_seconds', waited)
+			metrics.inc('api_throttled_total')
+
+	def backoff(self, attempt):
+		"""
+		Returns a random delay up to base_delay * 2 ** attempt, capped
+		at max_delay, so retrying clients don't all come back at once.
+		"""
+		return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+	def execute(self, request, user=None, cost=1):
+		"""
+		Executes an API request, or a BatchHttpRequest, and returns its
+		result.
+
+		Keyword arguments:
+			user -- the account the request counts against
+			cost -- the number of calls the request is, ie. the size
+				of a batch
+		"""
+		self.__count('calls')
+		# Batches have no method id of their own
+		method = getattr(request, 'methodId', None) or 'batch'
+		attempt = 0
+		while True:
+			self.throttle(user, cost)
+			try:
+				with metrics.span('api_call', method=method):
+					result = request.execute()
+			except Exception as e:
+				if attempt >= self.max_retries or not is_retryable(e):
+					self.__count('failed')
+					raise
+
+				delay = retry_after(e)
+				if delay is None:
+					delay = self.backoff(attempt)
+				self.__count('retried')
+				self.__count('backoff_seconds', delay)
+				metrics.inc('api_retried_total', method=method)
+				log.warning("%s failed (%s), retrying in %.1fs", method, e, delay)
+				self.sleep(delay)
+				attempt += 1
+			else:
+				self.__count('succeeded')
+				return result
+
+# Shared by every request the scheduler makes
+default_executor = RequestExecutor()
@@ -0,0 +1,208 @@
+# Tests of the token buckets and retries of RequestExecutor, on a fake
+# clock so nothing actually waits
+#
+#	> python -m unittest executor_test
+#
+import asyncio, json, socket
+import unittest
+from unittest import mock
+
+import httplib2
+from apiclient.errors import HttpError
+
+from asyncclient import AsyncCalendarClient
+from executor import RequestExecutor, TokenBucket, is_retryable, retry_after
+from fakecalendar import API_PREFIX, FakeCalendarServer
+
+class FakeClock():
+	"""
+	A clock that only moves when slept on.
+	"""
+	def __init__(self):
+		self.now = 100.0
+		self.sleeps = []
+
+	def __call__(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+
+def http_error(status, reason=None, retry_after=None):
+	headers = { 'status' : status }
+	if retry_after is not None:
+		headers['retry-after'] = retry_after
+	content = json.dumps({ 'error' : { 'errors' : [{ 'reason' : reason or 'backendError' }] } })
+	return HttpError(httplib2.Response(headers), content.encode('utf-8'))
+
+class FakeRequest():
+	"""
+	A request that raises the given errors in turn, then returns
+	'done'.
+	"""
+	methodId = 'calendar.events.insert'
+
+	def __init__(self, *errors):
+		self.errors = list(errors)
+		self.calls = 0
+
+	def execute(self):
+		self.calls += 1
+		if self.errors:
+			raise self.errors.pop(0)
+		return 'done'
+
+class TokenBucketTest(unittest.TestCase):
+	def setUp(self):
+		self.clock = FakeClock()
+		self.bucket = TokenBucket(2.0, clock=self.clock, sleep=self.clock.sleep)
+
+	def test_starts_full(self):
+		self.assertEqual(self.bucket.acquire(), 0.0)
+		self.assertEqual(self.bucket.acquire(), 0.0)
+		self.assertEqual(self.clock.sleeps, [])
+
+	def test_waits_for_a_token(self):
+		self.bucket.acquire(2)
+		self.assertEqual(self.bucket.acquire(), 0.5)
+		self.assertEqual(self.bucket.acquire(), 0.5)
+		self.assertEqual(self.clock.sleeps, [0.5, 0.5])
+
+	def test_refills_up_to_capacity(self):
+		self.bucket.acquire(2)
+		self.clock.now += 60
+		self.assertEqual(self.bucket.acquire(2), 0.0)
+		self.assertEqual(self.bucket.acquire(), 0.5)
+
+	def test_large_request_leaves_debt(self):
+		# Five tokens from a bucket of two go at once, and the three
+		# owed are paid by the next request
+		self.assertEqual(self.bucket.acquire(5), 0.0)
+		self.assertEqual(self.bucket.acquire(), 2.0)
+
+class ClassifyTest(unittest.TestCase):
+	def test_retryable(self):
+		for error in [
+			http_error(429), http_error(500), http_error(502), http_error(503), http_error(504),
+			http_error(403, 'rateLimitExceeded'), http_error(403, 'userRateLimitExceeded'),
+			socket.timeout(), ConnectionResetError(),
+		]:
+			self.assertTrue(is_retryable(error), error)
+
+	def test_not_retryable(self):
+		for error in [
+			http_error(400, 'badRequest'), http_error(403, 'forbidden'), http_error(404, 'notFound'),
+			http_error(409, 'duplicate'), http_error(410, 'deleted'), ValueError(),
+		]:
+			self.assertFalse(is_retryable(error), error)
+
+	def test_retry_after(self):
+		self.assertEqual(retry_after(http_error(503, retry_after='7')), 7.0)
+		self.assertEqual(retry_after(http_error(503, retry_after='-3')), 0.0)
+		self.assertIsNone(retry_after(http_error(503)))
+		self.assertIsNone(retry_after(http_error(503, retry_after='Wed, 21 Oct 2030 07:28:00 GMT')))
+		self.assertIsNone(retry_after(socket.timeout()))
+
+class RequestExecutorTest(unittest.TestCase):
+	def setUp(self):
+		self.clock = FakeClock()
+		# The longest backoff every time, so the delays are known
+		patcher = mock.patch('executor.random.uniform', side_effect=lambda low, high: high)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		# Retries are logged as warnings
+		patcher = mock.patch('executor.log')
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def executor(self, **kwargs):
+		kwargs.setdefault('user_rate', 1000.0)
+		kwargs.setdefault('project_rate', 1000.0)
+		return RequestExecutor(clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+	def test_success(self):
+		executor = self.executor()
+		self.assertEqual(executor.execute(FakeRequest()), 'done')
+		self.assertEqual(self.clock.sleeps, [])
+		self.assertEqual(executor.stats()['succeeded'], 1)
+
+	def test_honours_retry_after(self):
+		request = FakeRequest(http_error(429, retry_after='7'), http_error(503, retry_after='0'))
+		executor = self.executor()
+		self.assertEqual(executor.execute(request), 'done')
+		self.assertEqual(request.calls, 3)
+		self.assertEqual(self.clock.sleeps, [7.0, 0.0])
+		self.assertEqual(executor.stats()['backoff_seconds'], 7.0)
+
+	def test_exponential_backoff(self):
+		request = FakeRequest(*[http_error(500) for i in range(5)])
+		executor = self.executor(base_delay=1.0, max_delay=10.0)
+		self.assertEqual(executor.execute(request), 'done')
+		self.assertEqual(self.clock.sleeps, [1.0, 2.0, 4.0, 8.0, 10.0])
+		self.assertEqual(executor.stats()['retried'], 5)
+
+	def test_gives_up_after_max_retries(self):
+		error = http_error(503)
+		request = FakeRequest(*[error for i in range(4)])
+		executor = self.executor(max_retries=3)
+		with self.assertRaises(HttpError) as raised:
+			executor.execute(request)
+		self.assertIs(raised.exception, error)
+		self.assertEqual(request.calls, 4)
+		self.assertEqual(executor.stats()['failed'], 1)
+
+	def test_other_errors_are_not_retried(self):
+		request = FakeRequest(http_error(404, 'notFound'))
+		executor = self.executor()
+		with self.assertRaises(HttpError):
+			executor.execute(request)
+		self.assertEqual(request.calls, 1)
+		self.assertEqual(self.clock.sleeps, [])
+
+	def test_user_quota(self):
+		executor = self.executor(user_rate=2.0)
+		for i in range(4):
+			executor.execute(FakeRequest(), user='a')
+		# The first two fill the bucket, the rest wait half a second
+		self.assertEqual(self.clock.sleeps, [0.5, 0.5])
+		stats = executor.stats()
+		self.assertEqual(stats['throttled'], 2)
+		self.assertEqual(stats['throttled_seconds'], 1.0)
+
+		# Another user has a bucket of their own
+		executor.execute(FakeRequest(), user='b')
+		self.assertEqual(self.clock.sleeps, [0.5, 0.5])
+
+	def test_project_quota(self):
+		executor = self.executor(project_rate=2.0)
+		for user in 'abc':
+			executor.execute(FakeRequest(), user=user)
+		self.assertEqual(self.clock.sleeps, [0.5])
+
+	def test_batch_cost(self):
+		executor = self.executor(user_rate=10.0)
+		executor.execute(FakeRequest(), user='a', cost=10)
+		executor.execute(FakeRequest(), user='a', cost=5)
+		self.assertEqual(self.clock.sleeps, [0.5])
+
+class AsyncQuotaTest(unittest.TestCase):
+	def test_async_requests_take_tokens(self):
+		server = FakeCalendarServer().start()
+		self.addCleanup(server.stop)
+		clock = FakeClock()
+		executor = RequestExecutor(user_rate=2.0, project_rate=1000.0, clock=clock, sleep=clock.sleep)
+		patcher = mock.patch('asyncclient.default_executor', executor)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		async def run():
+			async with AsyncCalendarClient(base_uri=server.uri + API_PREFIX, user='a') as client:
+				for i in range(4):
+					await client.list('primary')
+		asyncio.run(run())
+		self.assertEqual(clock.sleeps, [0.5, 0.5])
+		self.assertEqual(list(executor.user_buckets), ['a'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,574 @@
+# A local stand-in of the Google Calendar API for load tests
+#
+#	> python fakecalendar.py --port 8080 --latency 0.05 --error-rate 0.01
+#
+# Serves events insert/get/list/patch/delete, batch, freebusy and an
+# OAuth token endpoint, with injected latency, errors and quota.
+# Partial responses (fields=) and gzip work like Google's.
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import argparse
+import datetime
+import gzip
+import itertools
+import json, random
+import re
+import threading, time
+import urllib.parse
+import uuid
+import logging
+
+import discoverycache
+import occurrences
+import zones
+from freebusy import parse_time, format_time, merge
+
+log = logging.getLogger(__name__)
+
+API_PREFIX = '/calendar/v3'
+BATCH_PATH = '/batch/calendar/v3'
+TOKEN_PATH = '/token'
+
+class FakeError(Exception):
+	"""
+	An error response in the format of the Google APIs.
+	"""
+	def __init__(self, status, reason, message=''):
+		super().__init__(message or reason)
+		self.status = status
+		self.reason = reason
+
+	def body(self):
+		return {
+			'error' : {
+				'code' : self.status,
+				'message' : str(self),
+				'errors' : [{ 'domain' : 'global', 'reason' : self.reason, 'message' : str(self) }],
+			}
+		}
+
+def _utc(when):
+	# The start or end of an event as an aware UTC datetime
+	if 'date' in when:
+		return datetime.datetime.strptime(when['date'], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+	dt = datetime.datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+	if dt.tzinfo is None:
+		return zones.to_utc(dt, when.get('timeZone'))
+	return dt.astimezone(datetime.timezone.utc)
+
+def instances(event):
+	"""
+	Returns the single events of an event, expanding the weekly
+	rules CalendarEvent makes. Other events are returned as they are.
+	"""
+	rules = event.get('recurrence')
+	if not rules or 'dateTime' not in event['start']:
+		return [event]
+
+	start = datetime.datetime.fromisoformat(event['start']['dateTime'])
+	length = datetime.datetime.fromisoformat(event['end']['dateTime']) - start
+	excluded = occurrences.parse_exdates(rules[1:])
+	result = []
+	for occurrence in occurrences.expand_rule(rules[0], start.replace(tzinfo=None), event['start'].get('timeZone')):
+		if occurrence in excluded:
+			continue
+		instance = dict(event)
+		del instance['recurrence']
+		instance['id'] = '{}_{}'.format(event['id'], occurrence.strftime('%Y%m%dT%H%M%S'))
+		instance['recurringEventId'] = event['id']
+		instance['start'] = dict(event['start'], dateTime=occurrence.isoformat('T'))
+		instance['end'] = dict(event['end'], dateTime=(occurrence + length).isoformat('T'))
+		result.append(instance)
+	return result
+
+def _instance_times(event):
+	# The aware (start, end) of every instance of an event, making
+	# the local times of an expanded rule aware all at once
+	expanded = instances(event)
+	if len(expanded) == 1 or 'dateTime' not in event['start']:
+		return [(_utc(i['start']), _utc(i['end'])) for i in expanded]
+
+	starts = [datetime.datetime.fromisoformat(i['start']['dateTime']) for i in expanded]
+	ends = [datetime.datetime.fromisoformat(i['end']['dateTime']) for i in expanded]
+	return list(zip(
+		zones.localize_many(starts, event['start'].get('timeZone')),
+		zones.localize_many(ends, event['end'].get('timeZone')),
+	))
+
+def parse_fields(mask):
+	"""
+	Parses a fields= partial response mask, ie.
+	'nextPageToken,items(id,start/dateTime)', into nested dictionaries
+	of the selected keys. None selects a whole value.
+	"""
+	def parse(position, closing):
+		selection = {}
+		name = ''
+		while position < len(mask):
+			char = mask[position]
+			position += 1
+			if char == '(':
+				selection[name.strip()], position = parse(position, True)
+				name = ''
+			elif char == ')' and closing:
+				break
+			elif char == ',':
+				if name.strip():
+					selection[name.strip()] = None
+				name = ''
+			else:
+				name += char
+		if name.strip():
+			selection[name.strip()] = None
+
+		# a/b selects b inside a
+		for path in [path for path in selection if '/' in path]:
+			inner = selection.pop(path)
+			outer, rest = path.split('/', 1)
+			nested = selection.setdefault(outer, {})
+			if nested is not None:
+				nested.update(parse_fields(rest) if inner is None else { rest : inner })
+		return selection, position
+
+	return parse(0, False)[0]
+
+def select_fields(value, selection):
+	"""
+	Returns the parts of a response value a parsed mask selects.
+	Masks apply to every element of a list.
+	"""
+	if selection is None:
+		return value
+	if isinstance(value, list):
+		return [select_fields(item, selection) for item in value]
+	if not isinstance(value, dict):
+		return value
+	return {
+		key : select_fields(value[key], inner)
+		for key, inner in selection.items() if key in value
+	}
+
+class _HTTPServer(ThreadingHTTPServer):
+	daemon_threads = True
+	# The default backlog of 5 drops connections when a load test
+	# opens many at once, and the client retries them a second later
+	request_queue_size = 128
+
+def fake_document(uri):
+	"""
+	Returns the calendar discovery document pointed at a fake server
+	running at uri, for discovery.build_from_document.
+	"""
+	# Never the network, so the stand-in runs anywhere
+	content = discoverycache.local_document('calendar', 'v3')
+	if content is None:
+		raise discoverycache.DiscoveryUnavailable("ERROR. No local calendar v3 discovery document.")
+	document = json.loads(content)
+	document['rootUrl'] = uri + '/'
+	document['baseUrl'] = uri + API_PREFIX + '/'
+	return json.dumps(document)
+
+class FakeCalendarServer():
+	"""
+	Keeps calendars in memory and serves them over HTTP like the
+	Calendar API would.
+
+	Keyword arguments:
+		host, port -- where to listen; port 0 picks a free one
+		latency -- seconds added to every HTTP request (default 0)
+		jitter -- up to this many seconds more, at random (default 0)
+		error_rate -- the fraction of calls failing with a 503
+			backendError (default 0)
+		quota -- the calls a second allowed for each access token;
+			more fail with a 403 rateLimitExceeded (default None, no
+			limit)
+		require_auth -- reject calls without a token issued by the
+			token endpoint with a 401 (default False)
+		token_lifetime -- seconds the issued access tokens last
+			(default 3600)
+		seed -- seeds the injected errors and jitter
+	"""
+	def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+			quota=None, require_auth=False, token_lifetime=3600, seed=None):
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.quota = quota
+		self.require_auth = require_auth
+		self.token_lifetime = token_lifetime
+		self.random = random.Random(seed)
+
+		# calendar id -> event id -> event, including cancelled ones
+		self.calendars = {}
+		# event versions increase with every change; sync tokens are
+		# the version a listing was made at
+		self.versions = itertools.count(1)
+		self.version = 0
+		# access token -> expiry (time.time())
+		self.tokens = {}
+		# (access token, second) -> calls
+		self.quota_windows = {}
+		self.stats = { 'requests' : 0, 'calls' : 0, 'errors' : 0, 'throttled' : 0, 'tokens' : 0 }
+		self.lock = threading.Lock()
+
+		server = self
+		class Handler(_Handler):
+			fake = server
+		self.httpd = _HTTPServer((host, port), Handler)
+		self.thread = None
+
+	@property
+	def uri(self):
+		host, port = self.httpd.server_address[:2]
+		return 'http://{}:{}'.format(host, port)
+
+	@property
+	def token_uri(self):
+		return self.uri + TOKEN_PATH
+
+	def start(self):
+		"""
+		Serves on a background thread and returns self.
+		"""
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def document(self):
+		return fake_document(self.uri)
+
+	def __count(self, name):
+		with self.lock:
+			self.stats[name] += 1
+
+	def delay(self):
+		if self.latency or self.jitter:
+			time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+	def issue_token(self):
+		token = uuid.uuid4().hex
+		with self.lock:
+			self.tokens[token] = time.time() + self.token_lifetime
+			self.stats['tokens'] += 1
+		return { 'access_token' : token, 'expires_in' : self.token_lifetime, 'token_type' : 'Bearer' }
+
+	def __check(self, headers):
+		# Authorization, quota and injected errors of a single call
+		self.__count('calls')
+		token = (headers.get('authorization') or '').replace('Bearer ', '')
+		if self.require_auth:
+			with self.lock:
+				expiry = self.tokens.get(token)
+			if not expiry or expiry < time.time():
+				raise FakeError(401, 'authError', 'Invalid Credentials')
+
+		if self.quota:
+			second = int(time.time())
+			with self.lock:
+				calls = self.quota_windows.get((token, second), 0) + 1
+				if len(self.quota_windows) > 10000:
+					self.quota_windows.clear()
+				self.quota_windows[(token, second)] = calls
+			if calls > self.quota:
+				self.__count('throttled')
+				raise FakeError(403, 'rateLimitExceeded', 'Rate Limit Exceeded')
+
+		with self.lock:
+			failed = self.random.random() < self.error_rate
+		if failed:
+			self.__count('errors')
+			raise FakeError(503, 'backendError', 'Backend Error')
+
+	def call(self, method, target, headers, body):
+		"""
+		Handles one API call and returns (status, extra headers,
+		response object or None).
+		"""
+		status, extra_headers, result = self.__call(method, target, headers, body)
+		mask = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(target).query)).get('fields')
+		if mask and result is not None and status < 400:
+			result = select_fields(result, parse_fields(mask))
+		return status, extra_headers, result
+
+	def __call(self, method, target, headers, body):
+		parts = urllib.parse.urlsplit(target)
+		query = dict(urllib.parse.parse_qsl(parts.query))
+		path = parts.path
+		try:
+			self.__check(headers)
+			if not path.startswith(API_PREFIX):
+				raise FakeError(404, 'notFound', 'Not Found')
+			path = path[len(API_PREFIX):]
+
+			if path == '/freeBusy' and method == 'POST':
+				return 200, {}, self.freebusy(body)
+
+			match = re.match(r'^/calendars/([^/]+)/events(?:/([^/]+))?$', path)
+			if not match:
+				raise FakeError(404, 'notFound', 'Not Found')
+			calendar_id = urllib.parse.unquote(match.group(1))
+			event_id = match.group(2) and urllib.parse.unquote(match.group(2))
+
+			if event_id is None and method == 'POST':
+				return 200, {}, self.insert(calendar_id, body)
+			if event_id is None and method == 'GET':
+				return 200, {}, self.list(calendar_id, query)
+			if event_id and method == 'GET':
+				event = self.get(calendar_id, event_id)
+				if headers.get('if-none-match') == event['etag']:
+					return 304, {}, None
+				return 200, {}, event
+			if event_id and method in ('PATCH', 'PUT'):
+				return 200, {}, self.patch(calendar_id, event_id, body, replace=method == 'PUT')
+			if event_id and method == 'DELETE':
+				self.delete(calendar_id, event_id)
+				return 204, {}, None
+			raise FakeError(405, 'methodNotAllowed', 'Method Not Allowed')
+		except (KeyError, ValueError) as e:
+			# A body or parameter lacking what the call reads, ie. an
+			# event without an end or a timeMin that isn't RFC3339
+			e = FakeError(400, 'badRequest', 'Bad Request: {!r}'.format(e))
+			return e.status, {}, e.body()
+		except FakeError as e:
+			return e.status, {}, e.body()
+
+	def __stamp(self, event):
+		# Called with the lock held
+		self.version = next(self.versions)
+		event['_version'] = self.version
+		event['etag'] = '"{}"'.format(self.version)
+		event['updated'] = format_time(datetime.datetime.now(datetime.timezone.utc))
+
+	@staticmethod
+	def __public(event):
+		return { key : value for key, value in event.items() if key != '_version' }
+
+	def insert(self, calendar_id, body):
+		event = dict(body or {})
+		# Events whose times can't be read are refused up front, so
+		# they never break a later listing
+		_utc(event['start']), _utc(event['end'])
+		event.setdefault('id', uuid.uuid4().hex)
+		event['status'] = 'confirmed'
+		event['htmlLink'] = '{}/event?eid={}'.format(self.uri, event['id'])
+		# The rest of what Google fills in, so full responses are as
+		# large as the real ones
+		owner = { 'email' : calendar_id if '@' in calendar_id else 'scheduler@example.com', 'self' : True }
+		event.update({
+			'kind' : 'calendar#event',
+			'created' : format_time(datetime.datetime.now(datetime.timezone.utc)),
+			'creator' : owner,
+			'organizer' : owner,
+			'iCalUID' : event['id'] + '@google.com',
+			'sequence' : 0,
+			'reminders' : { 'useDefault' : True },
+			'eventType' : 'default',
+		})
+		with self.lock:
+			events = self.calendars.setdefault(calendar_id, {})
+			# Google keeps the ids of deleted events too; they come back
+			# with a patch setting their status to confirmed
+			if event['id'] in events:
+				raise FakeError(409, 'duplicate', 'The requested identifier already exists.')
+			self.__stamp(event)
+			events[event['id']] = event
+		return self.__public(event)
+
+	def __find(self, calendar_id, event_id, deleted=False):
+		event = self.calendars.get(calendar_id, {}).get(event_id)
+		if not event:
+			raise FakeError(404, 'notFound', 'Not Found')
+		if event.get('status') == 'cancelled' and not deleted:
+			raise FakeError(410, 'deleted', 'Resource has been deleted')
+		return event
+
+	def get(self, calendar_id, event_id):
+		# Like Google, deleted events are still returned, cancelled
+		with self.lock:
+			return self.__public(self.__find(calendar_id, event_id, deleted=True))
+
+	def patch(self, calendar_id, event_id, body, replace=False):
+		with self.lock:
+			event = self.__find(calendar_id, event_id, deleted=True)
+			if replace:
+				kept = { key : event[key] for key in ('id', 'status', 'htmlLink') }
+				event.clear()
+				event.update(kept)
+			event.update({ key : value for key, value in (body or {}).items() if key != 'id' })
+			self.__stamp(event)
+			return self.__public(event)
+
+	def delete(self, calendar_id, event_id):
+		with self.lock:
+			event = self.__find(calendar_id, event_id)
+			event['status'] = 'cancelled'
+			self.__stamp(event)
+
+	def list(self, calendar_id, query):
+		with self.lock:
+			events = list(self.calendars.get(calendar_id, {}).values())
+			version = self.version
+
+		token = query.get('syncToken')
+		if token:
+			if not token.isdigit() or int(token) > version:
+				raise FakeError(410, 'fullSyncRequired', 'Sync token is no longer valid')
+			events = [e for e in events if e['_version'] > int(token)]
+		elif query.get('showDeleted') != 'true':
+			events = [e for e in events if e.get('status') != 'cancelled']
+
+		if query.get('singleEvents') == 'true':
+			events = [i for e in events for i in instances(e)]
+		if 'timeMin' in query:
+			time_min = parse_time(query['timeMin'])
+			events = [e for e in events if _utc(e['end']) > time_min]
+		if 'timeMax' in query:
+			time_max = parse_time(query['timeMax'])
+			events = [e for e in events if _utc(e['start']) < time_max]
+
+		start = int(query.get('pageToken') or 0)
+		size = int(query.get('maxResults') or 250)
+		response = { 'kind' : 'calendar#events', 'items' : [self.__public(e) for e in events[start:start + size]] }
+		if start + size < len(events):
+			response['nextPageToken'] = str(start + size)
+		else:
+			response['nextSyncToken'] = str(version)
+		return response
+
+	def freebusy(self, body):
+		time_min, time_max = parse_time(body['timeMin']), parse_time(body['timeMax'])
+		calendars = {}
+		for item in body.get('items', []):
+			with self.lock:
+				events = [
+					e for e in self.calendars.get(item['id'], {}).values()
+					if e.get('status') != 'cancelled' and e.get('transparency') != 'transparent'
+				]
+			busy = []
+			for event in events:
+				for start, end in _instance_times(event):
+					if start < time_max and end > time_min:
+						busy.append((max(start, time_min), min(end, time_max)))
+			calendars[item['id']] = {
+				'busy' : [{ 'start' : format_time(s), 'end' : format_time(e) } for s, e in merge(busy)]
+			}
+		return { 'kind' : 'calendar#freeBusy', 'timeMin' : body['timeMin'], 'timeMax' : body['timeMax'], 'calendars' : calendars }
+
+	def batch(self, content_type, body, headers):
+		"""
+		Answers a multipart/mixed batch request with a multipart/mixed
+		response holding the response of every part.
+		"""
+		boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1)
+		response_boundary = 'batch_' + uuid.uuid4().hex
+		parts = []
+		for part in body.split('--' + boundary)[1:]:
+			if part.startswith('--'):
+				break
+			part_headers, _, request = re.split(r'(\r?\n\r?\n)', part.lstrip('\r\n'), 1)
+			content_id = re.search(r'Content-ID:\s*<([^>]*)>', part_headers, re.I)
+
+			request_line, _, rest = request.partition('\n')
+			method, target = request_line.split()[:2]
+			inner_headers, _, inner_body = rest.partition('\r\n\r\n') if '\r\n\r\n' in rest else rest.partition('\n\n')
+			call_headers = dict(headers)
+			for line in inner_headers.splitlines():
+				name, _, value = line.partition(':')
+				if value:
+					call_headers[name.strip().lower()] = value.strip()
+			inner_body = inner_body.strip()
+
+			status, _, result = self.call(method, target, call_headers, json.loads(inner_body) if inner_body else None)
+			payload = '' if result is None else json.dumps(result)
+			parts.append(
+				'--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}>\r\n\r\n'
+				'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n{}\r\n'.format(
+					response_boundary, content_id.group(1) if content_id else '',
+					status, _Handler.responses.get(status, ('',))[0], len(payload), payload,
+				)
+			)
+		parts.append('--{}--\r\n'.format(response_boundary))
+		return 'multipart/mixed; boundary={}'.format(response_boundary), ''.join(parts)
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# Headers and body go out in separate writes; without this the
+	# delayed ACKs of keep-alive clients add ~40ms to every response
+	disable_nagle_algorithm = True
+	fake = None
+
+	def log_message(self, format, *args):
+		log.debug(format, *args)
+
+	def __send(self, status, content_type, content, headers=()):
+		# Google compresses for clients that accept gzip and say so in
+		# their user agent
+		if (content and 'gzip' in self.headers.get('Accept-Encoding', '')
+				and 'gzip' in self.headers.get('User-Agent', '')):
+			content = gzip.compress(content)
+			headers = list(headers) + [('Content-Encoding', 'gzip')]
+
+		self.send_response(status)
+		for name, value in headers:
+			self.send_header(name, value)
+		if content:
+			self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def __handle(self):
+		fake = self.fake
+		with fake.lock:
+			fake.stats['requests'] += 1
+		fake.delay()
+
+		length = int(self.headers.get('Content-Length') or 0)
+		raw = self.rfile.read(length) if length else b''
+		headers = { name.lower() : value for name, value in self.headers.items() }
+		path = urllib.parse.urlsplit(self.path).path
+
+		if path == TOKEN_PATH and self.command == 'POST':
+			content = json.dumps(fake.issue_token()).encode('utf-8')
+			return self.__send(200, 'application/json', content)
+
+		if path == BATCH_PATH and self.command == 'POST':
+			content_type, content = fake.batch(headers.get('content-type', ''), raw.decode('utf-8'), headers)
+			return self.__send(200, content_type, content.encode('utf-8'))
+
+		try:
+			body = json.loads(raw.decode('utf-8')) if raw else None
+		except ValueError:
+			error = FakeError(400, 'parseError', 'Parse Error')
+			return self.__send(400, 'application/json', json.dumps(error.body()).encode('utf-8'))
+
+		status, headers, result = fake.call(self.command, self.path, headers, body)
+		content = b'' if result is None else json.dumps(result).encode('utf-8')
+		self.__send(status, 'application/json', content, headers.items())
+
+	do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = __handle
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Serve a local stand-in of the Google Calendar API.")
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8080)
+	parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+	parser.add_argument('--jitter', type=float, default=0.0, help="up to this many random seconds more")
+	parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls failing with 503")
+	parser.add_argument('--quota', type=float, default=None, help="calls a second allowed per token")
+	parser.add_argument('--require-auth', action='store_true')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO, format='%(levelname)s %(name)s: %(message)s')
+	server = FakeCalendarServer(
+		args.host, args.port, args.latency, args.jitter, args.error_rate, args.quota, args.require_auth
+	)
+	log.info("Serving the Calendar API at %s%s and tokens at %s", server.uri, API_PREFIX, server.token_uri)
+	try:
+		server.httpd.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,57 @@
+# Tests that FakeCalendarServer answers bad requests like Google
+#
+#	> python -m unittest fakecalendar_test
+#
+import json
+import unittest
+
+import httplib2
+from apiclient.errors import HttpError
+
+from fakecalendar import FakeCalendarServer
+import wire
+
+def setUpModule():
+	global server, service
+	server = FakeCalendarServer().start()
+	service = wire.build(server.document(), httplib2.Http())
+
+def tearDownModule():
+	server.stop()
+
+class BadRequestTest(unittest.TestCase):
+	def assertBadRequest(self, request):
+		with self.assertRaises(HttpError) as raised:
+			request.execute()
+		self.assertEqual(raised.exception.resp.status, 400)
+		reason = json.loads(raised.exception.content.decode('utf-8'))['error']['errors'][0]['reason']
+		self.assertEqual(reason, 'badRequest')
+
+	def test_event_without_end(self):
+		body = { 'summary' : 'Work', 'start' : { 'dateTime' : '2030-01-07T09:30:00Z' } }
+		self.assertBadRequest(service.events().insert(calendarId=self.id(), body=body))
+		self.assertEqual(server.calendars.get(self.id(), {}), {})
+
+	def test_unreadable_time(self):
+		body = {
+			'summary' : 'Work',
+			'start' : { 'dateTime' : 'Monday morning' },
+			'end' : { 'dateTime' : '2030-01-07T10:30:00Z' },
+		}
+		self.assertBadRequest(service.events().insert(calendarId=self.id(), body=body))
+		# The calendar can still be listed
+		self.assertEqual(service.events().list(calendarId=self.id()).execute()['items'], [])
+
+	def test_unreadable_parameter(self):
+		self.assertBadRequest(service.events().list(calendarId=self.id(), timeMin='yesterday'))
+
+	def test_batch_part(self):
+		events = service.events()
+		responses = []
+		batch = service.new_batch_http_request(callback=lambda request_id, response, exception: responses.append(exception))
+		batch.add(events.insert(calendarId=self.id(), body={ 'summary' : 'No times' }))
+		batch.execute()
+		self.assertEqual(responses[0].resp.status, 400)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,221 @@
+# Busy times of calendars from the freebusy endpoint, cached locally
+import datetime, time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from executor import default_executor
+
+# Per request limits of the freebusy endpoint; larger queries are
+# split into several requests
+MAX_CALENDARS = 50
+WINDOW = datetime.timedelta(days=56)
+
+# Windows are counted from here so the same instant always falls
+# into the same window, whatever range it was queried with
+EPOCH = datetime.datetime(2000, 1, 3, tzinfo=datetime.timezone.utc)
+
+def parse_time(s):
+	"""
+	Turns an RFC3339 string from the API into an aware datetime.
+	"""
+	return datetime.datetime.fromisoformat(s.replace('Z', '+00:00'))
+
+def format_time(dt):
+	return dt.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _as_utc(dt):
+	# Naive datetimes and plain dates are taken to be UTC
+	if not isinstance(dt, datetime.datetime):
+		dt = datetime.datetime(dt.year, dt.month, dt.day)
+	if dt.tzinfo is None:
+		dt = dt.replace(tzinfo=datetime.timezone.utc)
+	return dt
+
+def window_index(dt):
+	return (dt - EPOCH) // WINDOW
+
+def window_bounds(index):
+	start = EPOCH + index * WINDOW
+	return start, start + WINDOW
+
+def merge(intervals):
+	"""
+	Sorts (start, end) intervals and joins the ones that overlap
+	or touch.
+	"""
+	merged = []
+	for start, end in sorted(intervals):
+		if merged and start <= merged[-1][1]:
+			if end > merged[-1][1]:
+				merged[-1] = (merged[-1][0], end)
+		else:
+			merged.append((start, end))
+	return merged
+
+def subtract(intervals, removed):
+	"""
+	Returns the merged (start, end) intervals with the parts the
+	removed intervals cover taken out.
+	"""
+	removed = merge(removed)
+	result = []
+	for start, end in merge(intervals):
+		for cut_start, cut_end in removed:
+			if cut_end <= start or cut_start >= end:
+				continue
+			if cut_start > start:
+				result.append((start, cut_start))
+			start = cut_end
+			if start >= end:
+				break
+		if start < end:
+			result.append((start, end))
+	return result
+
+class BusyCache():
+	"""
+	Keeps the busy intervals of calendars for fixed windows of time.
+	Each window remembers when it was fetched and is thrown away once
+	it's older than ttl seconds.
+
+	Keyword arguments:
+		ttl -- how long fetched busy intervals are trusted, in
+			seconds (default 300)
+	"""
+	def __init__(self, ttl=300):
+		self.ttl = ttl
+		# (calendar id, window index) -> (fetched at, intervals)
+		self.windows = {}
+		self.__lock = threading.Lock()
+
+	def missing(self, calendar_id, indexes):
+		"""
+		Returns the window indexes of calendar_id that are not cached
+		or have expired.
+		"""
+		now = time.monotonic()
+		with self.__lock:
+			return [
+				index for index in indexes
+				if (calendar_id, index) not in self.windows
+					or now - self.windows[(calendar_id, index)][0] > self.ttl
+			]
+
+	def put(self, calendar_id, index, intervals):
+		with self.__lock:
+			self.windows[(calendar_id, index)] = (time.monotonic(), intervals)
+
+	def get(self, calendar_id, time_min, time_max):
+		"""
+		Returns the merged busy intervals of calendar_id that overlap
+		time_min to time_max, clipped to that range. Windows that
+		aren't cached are treated as free.
+		"""
+		intervals = []
+		with self.__lock:
+			for index in range(window_index(time_min), window_index(time_max - datetime.timedelta.resolution) + 1):
+				entry = self.windows.get((calendar_id, index))
+				if entry:
+					intervals.extend(entry[1])
+
+		return [
+			(max(start, time_min), min(end, time_max))
+			for start, end in merge(intervals)
+			if start < time_max and end > time_min
+		]
+
+	def is_busy(self, calendar_id, start, end):
+		"""
+		Returns True if calendar_id has anything between start and end.
+		"""
+		start, end = _as_utc(start), _as_utc(end)
+		return len(self.get(calendar_id, start, end)) > 0
+
+	def clear(self):
+		with self.__lock:
+			self.windows.clear()
+
+def _query(service, calendar_ids, index):
+	time_min, time_max = window_bounds(index)
+	body = {
+		'timeMin' : format_time(time_min),
+		'timeMax' : format_time(time_max),
+		'items' : [{ 'id' : calendar_id } for calendar_id in calendar_ids],
+	}
+	response = default_executor.execute(service.freebusy().query(body=body))
+
+	busy = {}
+	for calendar_id in calendar_ids:
+		calendar = response.get('calendars', {}).get(calendar_id, {})
+		if calendar.get('errors'):
+			raise Exception("ERROR. Freebusy failed for '{}': {}".format(
+				calendar_id, calendar['errors'][0].get('reason')
+			))
+		busy[calendar_id] = merge(
+			(parse_time(b['start']), parse_time(b['end'])) for b in calendar.get('busy', [])
+		)
+	return index, busy
+
+def query_busy(service_factory, calendar_ids, time_min, time_max, cache, max_workers=4):
+	"""
+	Returns a dictionary of calendar id to the merged busy intervals
+	between time_min and time_max.
+
+	Only windows missing from the cache are fetched. They are split
+	into requests of at most MAX_CALENDARS calendars over one WINDOW
+	of time each, and the requests run max_workers at a time.
+
+	Required arguments:
+		service_factory -- a function returning the calendar service
+			for the calling thread, ie. Account.service
+		calendar_ids -- the calendars to look at
+		time_min, time_max -- the range to look at. Naive datetimes
+			and dates are taken to be UTC.
+		cache -- the BusyCache to read from and fill
+	"""
+	time_min, time_max = _as_utc(time_min), _as_utc(time_max)
+	indexes = range(window_index(time_min), window_index(time_max - datetime.timedelta.resolution) + 1)
+
+	# Group the calendars needing a window so each request
+	# covers one window and up to MAX_CALENDARS calendars
+	needed = {}
+	for calendar_id in calendar_ids:
+		for index in cache.missing(calendar_id, indexes):
+			needed.setdefault(index, []).append(calendar_id)
+
+	requests = []
+	for index, ids in needed.items():
+		for i in range(0, len(ids), MAX_CALENDARS):
+			requests.append((ids[i:i + MAX_CALENDARS], index))
+
+	if len(requests) == 1 or (requests and max_workers == 1):
+		# No threads, so a factory keeping a service per thread
+		# reuses the caller's
+		for ids, index in requests:
+			index, busy = _query(service_factory(), ids, index)
+			for calendar_id, intervals in busy.items():
+				cache.put(calendar_id, index, intervals)
+	elif requests:
+		with ThreadPoolExecutor(max_workers) as pool:
+			futures = [
+				pool.submit(lambda ids=ids, index=index: _query(service_factory(), ids, index))
+				for ids, index in requests
+			]
+			for future in futures:
+				index, busy = future.result()
+				for calendar_id, intervals in busy.items():
+					cache.put(calendar_id, index, intervals)
+
+	return { calendar_id : cache.get(calendar_id, time_min, time_max) for calendar_id in calendar_ids }
+
+def event_busy(event, service_factory, cache, max_workers=4):
+	"""
+	Returns the busy intervals on the calendar of a CalendarEvent from
+	the day its task starts through its end date, ie. for
+	CalendarEvent.avoid. The day before and after are included so
+	blocks of any time zone are covered.
+	"""
+	start_date = datetime.datetime.strptime(event.start_date[:10], '%Y-%m-%d').date()
+	time_min = start_date - datetime.timedelta(days=1)
+	time_max = event.end_date + datetime.timedelta(days=2)
+	return query_busy(service_factory, [event.calendar_id], time_min, time_max, cache, max_workers)[event.calendar_id]
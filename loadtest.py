@@ -0,0 +1,234 @@
+# Pushes CalendarEvent workloads through the real client code against
+# the fake Calendar server and reports latency and throughput
+#
+#	> python loadtest.py --events 2000 --mode batch --latency 0.05
+#	> python loadtest.py --uri http://127.0.0.1:8080 --mode single
+#	> python loadtest.py --lean          partial responses and gzip
+#
+import argparse
+import asyncio
+import datetime
+import json, random
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from oauth2client import client
+
+from scheduler import CalendarEvent
+from asyncclient import AsyncCalendarClient
+from credentialmanager import CredentialManager
+from executor import default_executor
+from fakecalendar import FakeCalendarServer, fake_document, API_PREFIX, TOKEN_PATH
+from metrics import metrics
+from occurrences import DAYS
+import wire
+
+MODES = ('single', 'batch', 'async')
+
+def percentile(values, p):
+	"""
+	Returns the p-th percentile (0-100) of values by nearest rank.
+	"""
+	if not values:
+		return 0.0
+	values = sorted(values)
+	rank = max(1, int(round(p / 100.0 * len(values))))
+	return values[min(rank, len(values)) - 1]
+
+def make_events(count, seed=None, label=''):
+	"""
+	Returns count CalendarEvents of random tasks, like a planning run
+	would make. The label goes into the summaries, so events made for
+	different runs get different ids.
+	"""
+	rng = random.Random(seed)
+	start = datetime.date.today() + datetime.timedelta(days=1)
+	events = []
+	for i in range(count):
+		first = start + datetime.timedelta(days=rng.randrange(60))
+		days = [day for day in DAYS if rng.random() < 0.5] or [rng.choice(DAYS)]
+		events.append(CalendarEvent(
+			summary='Load test {} {}'.format(label, i),
+			start={ 'dateTime' : first.isoformat(), 'timeZone' : 'UTC' },
+			end={ 'dateTime' : first.isoformat(), 'timeZone' : 'UTC' },
+			hoursNeeded=rng.randint(2, 40),
+			availableDays=days,
+			startTime=datetime.time(rng.randint(8, 16), rng.choice((0, 30))),
+			endDate=first + datetime.timedelta(days=rng.randint(7, 90)),
+		))
+	return events
+
+class LoadTest():
+	"""
+	Inserts events into a fake Calendar server the way the scheduler
+	does, authorizing with a refresh token against the server's token
+	endpoint, and records the latency of every API request.
+
+	Required arguments:
+		uri -- the root of the fake server, ie. FakeCalendarServer.uri
+
+	Keyword arguments:
+		concurrency -- threads or in flight requests (default 8)
+		batch_size -- inserts per batch in batch mode (default 50)
+	"""
+	def __init__(self, uri, concurrency=8, batch_size=CalendarEvent.BATCH_SIZE):
+		self.uri = uri
+		self.concurrency = concurrency
+		self.batch_size = batch_size
+
+		self.document = fake_document(uri)
+		credentials = client.OAuth2Credentials(
+			None, 'loadtest', 'loadtest', 'loadtest', None, uri + TOKEN_PATH, 'loadtest'
+		)
+		self.manager = CredentialManager(credentials).start()
+
+		self.latencies = []
+		self.parse_seconds = 0.0
+		self.failed = 0
+		self.__local = threading.local()
+		self.__lock = threading.Lock()
+		metrics.add_observer(self.__observe)
+
+	def __observe(self, name, seconds, labels, error):
+		if name == 'api_call':
+			with self.__lock:
+				self.latencies.append(seconds)
+		elif name == 'parse_response':
+			with self.__lock:
+				self.parse_seconds += seconds
+
+	def service(self):
+		# An Http can't be shared between threads
+		service = getattr(self.__local, 'service', None)
+		if service is None:
+			http = self.manager.authorize(wire.Http())
+			service = self.__local.service = wire.build(self.document, http)
+		return service
+
+	def __count_failure(self, *args):
+		with self.__lock:
+			self.failed += 1
+
+	def run_single(self, events):
+		def insert(event):
+			try:
+				event.create_event(self.service())
+			except Exception:
+				self.__count_failure()
+
+		with ThreadPoolExecutor(self.concurrency) as pool:
+			list(pool.map(insert, events))
+
+	def run_batch(self, events):
+		def insert(chunk):
+			CalendarEvent.create_many(
+				chunk,
+				batch_size=self.batch_size,
+				service=self.service(),
+				callback=lambda event, response, exception: exception and self.__count_failure(),
+			)
+
+		# Each thread sends whole batches of its own
+		step = self.batch_size
+		with ThreadPoolExecutor(self.concurrency) as pool:
+			list(pool.map(insert, [events[i:i + step] for i in range(0, len(events), step)]))
+
+	def run_async(self, events):
+		async def insert_all():
+			async with AsyncCalendarClient(
+					self.manager, self.uri + API_PREFIX, max_concurrency=self.concurrency) as calendar:
+				results = await asyncio.gather(
+					*(event.create_event_async(calendar) for event in events), return_exceptions=True
+				)
+			for result in results:
+				if isinstance(result, Exception):
+					self.__count_failure()
+
+		asyncio.run(insert_all())
+
+	def run(self, mode, events):
+		"""
+		Inserts events in mode ('single', 'batch' or 'async') and
+		returns the report.
+		"""
+		self.latencies, self.parse_seconds, self.failed = [], 0.0, 0
+		sent, received = wire.bytes_total()
+		start = time.perf_counter()
+		getattr(self, 'run_' + mode)(events)
+		elapsed = time.perf_counter() - start
+		sent, received = [after - before for before, after in zip((sent, received), wire.bytes_total())]
+
+		return {
+			'mode' : mode,
+			'events' : len(events),
+			'failed' : self.failed,
+			'seconds' : elapsed,
+			'events_per_second' : (len(events) - self.failed) / elapsed if elapsed else 0.0,
+			'requests' : len(self.latencies),
+			'p50_ms' : percentile(self.latencies, 50) * 1000,
+			'p99_ms' : percentile(self.latencies, 99) * 1000,
+			'bytes_sent' : sent,
+			'bytes_received' : received,
+			'bytes_per_event' : (sent + received) / len(events) if events else 0.0,
+			'parse_ms' : self.parse_seconds * 1000,
+		}
+
+def format_report(report):
+	return (
+		"{mode}: {events} events in {seconds:.2f}s ({events_per_second:.1f} events/s), {failed} failed\n"
+		"  {requests} requests, p50 {p50_ms:.1f}ms, p99 {p99_ms:.1f}ms\n"
+		"  {bytes_sent} bytes sent, {bytes_received} received ({bytes_per_event:.0f} per event), "
+		"{parse_ms:.1f}ms parsing"
+	).format(**report)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Load test the scheduler against a fake Calendar server.")
+	parser.add_argument('--uri', help="a running fakecalendar.py; by default one is started in process")
+	parser.add_argument('--mode', choices=MODES + ('all',), default='all')
+	parser.add_argument('--events', type=int, default=1000)
+	parser.add_argument('--concurrency', type=int, default=8)
+	parser.add_argument('--batch-size', type=int, default=CalendarEvent.BATCH_SIZE)
+	parser.add_argument('--latency', type=float, default=0.02, help="seconds the in process server adds")
+	parser.add_argument('--jitter', type=float, default=0.01)
+	parser.add_argument('--error-rate', type=float, default=0.0)
+	parser.add_argument('--quota', type=float, default=None, help="calls a second the server allows")
+	parser.add_argument('--user-rate', type=float, default=1e9, help="calls a second the executor allows")
+	parser.add_argument('--seed', type=int, default=None)
+	parser.add_argument('--lean', action='store_true', help="ask for partial responses and send compact bodies")
+	parser.add_argument('--json', action='store_true', help="print the reports as JSON")
+	args = parser.parse_args(argv)
+
+	server = None
+	uri = args.uri
+	if not uri:
+		server = FakeCalendarServer(
+			latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+			quota=args.quota, require_auth=True, seed=args.seed,
+		).start()
+		uri = server.uri
+
+	if args.lean:
+		wire.set_lean(True)
+	default_executor.set_rates(user_rate=args.user_rate, project_rate=max(args.user_rate, 1e9))
+	try:
+		load = LoadTest(uri, args.concurrency, args.batch_size)
+		reports = [
+			load.run(mode, make_events(args.events, args.seed, mode))
+			for mode in (MODES if args.mode == 'all' else (args.mode,))
+		]
+		load.manager.stop()
+	finally:
+		if server:
+			server.stop()
+
+	if args.json:
+		print(json.dumps(reports, indent=2))
+	else:
+		for report in reports:
+			print(format_report(report))
+		if server:
+			print("server: {}".format(server.stats))
+	return 0
+
+if __name__ == '__main__':
+	raise SystemExit(main())
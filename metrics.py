@@ -0,0 +1,184 @@
+# Timings and counters of the scheduler, exportable for monitoring
+import bisect
+import contextlib, functools
+import json, os
+import logging
+import threading, time
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+def _key(name, labels):
+	return (name, tuple(sorted(labels.items())))
+
+def _format_labels(labels, extra=()):
+	pairs = list(labels) + list(extra)
+	if not pairs:
+		return ''
+	return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs) + '}'
+
+class Histogram():
+	"""
+	Counts observed latencies into BUCKETS and keeps their sum.
+	"""
+	def __init__(self):
+		self.counts = [0] * len(BUCKETS)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, seconds):
+		self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+		self.sum += seconds
+		self.count += 1
+
+	def cumulative(self):
+		total, result = 0, []
+		for bound, count in zip(BUCKETS, self.counts):
+			total += count
+			result.append((bound, total))
+		return result
+
+class Metrics():
+	"""
+	Holds the counters and latency histograms of a process.
+
+	Spans time a block of code: its latency goes into the histogram
+	'<name>_seconds' and the counter '<name>_total' goes up with an
+	outcome label of 'success' or 'failure'. Observers added with
+	add_observer are called after every span, so other monitoring
+	can be plugged in.
+	"""
+	def __init__(self):
+		self.counters = {}
+		self.histograms = {}
+		self.observers = []
+		self.__lock = threading.Lock()
+
+	def inc(self, name, amount=1, **labels):
+		key = _key(name, labels)
+		with self.__lock:
+			self.counters[key] = self.counters.get(key, 0) + amount
+
+	def observe(self, name, seconds, **labels):
+		key = _key(name, labels)
+		with self.__lock:
+			histogram = self.histograms.get(key)
+			if histogram is None:
+				histogram = self.histograms[key] = Histogram()
+			histogram.observe(seconds)
+
+	def add_observer(self, observer):
+		"""
+		Calls observer(name, seconds, labels, error) after every span;
+		error is None when the span succeeded.
+		"""
+		self.observers.append(observer)
+
+	@contextlib.contextmanager
+	def span(self, name, **labels):
+		"""
+		Times the body of a with statement.
+		"""
+		start = time.perf_counter()
+		error = None
+		try:
+			yield
+		except BaseException as e:
+			error = e
+			raise
+		finally:
+			seconds = time.perf_counter() - start
+			self.observe(name + '_seconds', seconds, **labels)
+			self.inc(name + '_total', outcome='failure' if error else 'success', **labels)
+			log.debug("%s took %.3fms%s", name, seconds * 1000, ' (failed)' if error else '')
+			for observer in self.observers:
+				observer(name, seconds, labels, error)
+
+	def timed(self, name, **labels):
+		"""
+		A decorator that runs every call of a function in a span.
+		"""
+		def decorate(func):
+			@functools.wraps(func)
+			def wrapper(*args, **kwargs):
+				with self.span(name, **labels):
+					return func(*args, **kwargs)
+			return wrapper
+		return decorate
+
+	def reset(self):
+		with self.__lock:
+			self.counters.clear()
+			self.histograms.clear()
+
+	def snapshot(self):
+		"""
+		Returns every counter and histogram as a dictionary that can be
+		dumped to JSON.
+		"""
+		with self.__lock:
+			counters = [
+				{ 'name' : name, 'labels' : dict(labels), 'value' : value }
+				for (name, labels), value in sorted(self.counters.items())
+			]
+			histograms = [
+				{
+					'name' : name,
+					'labels' : dict(labels),
+					'count' : histogram.count,
+					'sum' : histogram.sum,
+					'buckets' : [
+						{ 'le' : 'inf' if bound == float('inf') else bound, 'count' : count }
+						for bound, count in histogram.cumulative()
+					],
+				}
+				for (name, labels), histogram in sorted(self.histograms.items())
+			]
+		return { 'time' : time.time(), 'counters' : counters, 'histograms' : histograms }
+
+	def prometheus(self):
+		"""
+		Returns every counter and histogram in the Prometheus text
+		exposition format.
+		"""
+		lines = []
+		with self.__lock:
+			typed = set()
+			for (name, labels), value in sorted(self.counters.items()):
+				if name not in typed:
+					lines.append('# TYPE scheduler_{} counter'.format(name))
+					typed.add(name)
+				lines.append('scheduler_{}{} {}'.format(name, _format_labels(labels), value))
+
+			for (name, labels), histogram in sorted(self.histograms.items()):
+				if name not in typed:
+					lines.append('# TYPE scheduler_{} histogram'.format(name))
+					typed.add(name)
+				for bound, count in histogram.cumulative():
+					le = '+Inf' if bound == float('inf') else repr(bound)
+					lines.append('scheduler_{}_bucket{} {}'.format(name, _format_labels(labels, [('le', le)]), count))
+				lines.append('scheduler_{}_sum{} {}'.format(name, _format_labels(labels), histogram.sum))
+				lines.append('scheduler_{}_count{} {}'.format(name, _format_labels(labels), histogram.count))
+		return '\n'.join(lines) + '\n'
+
+	def export(self, path):
+		"""
+		Writes the metrics to path: a JSON snapshot if it ends with
+		.json, otherwise a Prometheus text file (ie. for the node
+		exporter's textfile collector). The file is replaced in one
+		step so a scraper never reads half of it.
+		"""
+		if path.endswith('.json'):
+			content = json.dumps(self.snapshot(), indent=2)
+		else:
+			content = self.prometheus()
+
+		tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+		with open(tmp_path, 'w') as f:
+			f.write(content)
+		os.replace(tmp_path, path)
+
+# Shared by every module of the scheduler
+metrics = Metrics()
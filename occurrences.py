@@ -0,0 +1,127 @@
+# Exact occurrences of the weekly rules set_recurrence emits
+import datetime, re
+import heapq
+
+import zones
+
+# Day names in RFC 5545 format, in the order of date.weekday()
+DAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+DAY_VALUE = { day : value for value, day in enumerate(DAYS) }
+
+def weekdays(days):
+	"""
+	Turns a list of RFC 5545 day names into a sorted tuple of
+	date.weekday() values without duplicates.
+	"""
+	try:
+		return tuple(sorted(set(DAY_VALUE[day] for day in days)))
+	except KeyError as e:
+		raise ValueError("ERROR. Invalid day '{}'.".format(e.args[0]))
+
+def normalize_days(days):
+	"""
+	Returns RFC 5545 day names in week order without duplicates, so
+	the same days always make the same rule and event id.
+	"""
+	return [DAYS[weekday] for weekday in weekdays(days)]
+
+def _first_on(start_date, weekday):
+	return start_date + datetime.timedelta(days=(weekday - start_date.weekday()) % 7)
+
+def count(start_date, end_date, days):
+	"""
+	Returns the exact number of dates from start_date through
+	end_date (inclusive) falling on one of days. Runs in constant
+	time whatever the length of the range.
+	"""
+	total = 0
+	for weekday in weekdays(days):
+		first = _first_on(start_date, weekday)
+		if first <= end_date:
+			total += (end_date - first).days // 7 + 1
+	return total
+
+def first(start_date, end_date, days):
+	"""
+	Returns the first date from start_date through end_date falling
+	on one of days, or None if there is none.
+	"""
+	dates = [_first_on(start_date, weekday) for weekday in weekdays(days)]
+	dates = [d for d in dates if d <= end_date]
+	return min(dates) if dates else None
+
+def expand(start_date, end_date, days):
+	"""
+	Returns every date from start_date through end_date (inclusive)
+	falling on one of days, in order.
+	"""
+	step = datetime.timedelta(days=7)
+	runs = []
+	for weekday in weekdays(days):
+		d = _first_on(start_date, weekday)
+		run = []
+		while d <= end_date:
+			run.append(d)
+			d += step
+		runs.append(run)
+	# Each run is already sorted, so merging keeps this linear
+	return list(heapq.merge(*runs))
+
+RULE_PATTERN = re.compile(r'^RRULE:FREQ=WEEKLY;INTERVAL=1;UNTIL=(\d{8}T\d{6})Z;BYDAY=([A-Z,]+)$')
+
+def parse_rule(rule):
+	"""
+	Returns the (until, days) of a rule made by set_recurrence, where
+	until is a naive datetime and days a list of day names.
+	"""
+	match = RULE_PATTERN.match(rule)
+	if not match:
+		raise ValueError("ERROR. Unsupported recurrence rule '{}'.".format(rule))
+	until = datetime.datetime.strptime(match.group(1), '%Y%m%dT%H%M%S')
+	return until, match.group(2).split(',')
+
+def exdate(dates, start_time, time_zone=None):
+	"""
+	Returns the EXDATE line leaving dates out of a rule whose
+	occurrences start at start_time in time_zone.
+	"""
+	values = ','.join(
+		datetime.datetime.combine(d, start_time).strftime('%Y%m%dT%H%M%S') for d in sorted(dates)
+	)
+	if time_zone:
+		return 'EXDATE;TZID={}:{}'.format(time_zone, values)
+	return 'EXDATE:{}'.format(values)
+
+EXDATE_PATTERN = re.compile(r'^EXDATE(?:;TZID=[^:]+)?:([0-9T,]+)$')
+
+def parse_exdates(lines):
+	"""
+	Returns the naive local datetimes the EXDATE lines among the
+	recurrence lines of an event leave out.
+	"""
+	dates = set()
+	for line in lines:
+		match = EXDATE_PATTERN.match(line)
+		if match:
+			dates.update(
+				datetime.datetime.strptime(value, '%Y%m%dT%H%M%S') for value in match.group(1).split(',')
+			)
+	return dates
+
+def expand_rule(rule, dtstart, time_zone=None):
+	"""
+	Returns the datetimes a rule made by set_recurrence repeats at,
+	starting from the naive local datetime dtstart in time_zone. UNTIL
+	is in UTC and inclusive, so an occurrence exactly at UNTIL is kept.
+	"""
+	until, days = parse_rule(rule)
+	# Compare in local time; the offset at UNTIL is the one that
+	# matters for the last occurrence
+	until = until.replace(tzinfo=zones.UTC).astimezone(zones.get_zone(time_zone)).replace(tzinfo=None)
+	last = until.date()
+	if dtstart.time() > until.time():
+		last -= datetime.timedelta(days=1)
+	return [
+		datetime.datetime.combine(d, dtstart.time())
+		for d in expand(dtstart.date(), last, days)
+	]
@@ -0,0 +1,50 @@
+# Tests of the constant time occurrence count
+#
+#	> python -m unittest occurrences_test
+#
+import datetime, itertools
+import unittest
+
+import occurrences
+
+def brute_count(start_date, end_date, days):
+	weekdays = occurrences.weekdays(days)
+	count = 0
+	day = start_date
+	while day <= end_date:
+		count += day.weekday() in weekdays
+		day += datetime.timedelta(days=1)
+	return count
+
+class CountTest(unittest.TestCase):
+	def test_matches_counting_every_day(self):
+		start = datetime.date(2030, 1, 1)
+		day_sets = [['MO'], ['SU'], ['MO', 'WE', 'FR'], ['SA', 'SU'], list(occurrences.DAYS)]
+		for offset, length, days in itertools.product(range(7), range(-1, 30), day_sets):
+			start_date = start + datetime.timedelta(days=offset)
+			end_date = start_date + datetime.timedelta(days=length)
+			self.assertEqual(
+				occurrences.count(start_date, end_date, days), brute_count(start_date, end_date, days),
+				(start_date, end_date, days),
+			)
+
+	def test_long_range(self):
+		start_date, end_date = datetime.date(2030, 1, 1), datetime.date(2130, 12, 31)
+		self.assertEqual(occurrences.count(start_date, end_date, ['TU', 'TH']), brute_count(start_date, end_date, ['TU', 'TH']))
+
+	def test_end_before_start(self):
+		self.assertEqual(occurrences.count(datetime.date(2030, 1, 8), datetime.date(2030, 1, 7), ['MO', 'TU']), 0)
+
+	def test_duplicate_days_count_once(self):
+		start_date, end_date = datetime.date(2030, 1, 7), datetime.date(2030, 1, 20)
+		self.assertEqual(occurrences.count(start_date, end_date, ['MO', 'MO', 'WE']), 4)
+
+	def test_no_days(self):
+		self.assertEqual(occurrences.count(datetime.date(2030, 1, 1), datetime.date(2030, 12, 31), []), 0)
+
+	def test_invalid_day(self):
+		with self.assertRaises(ValueError):
+			occurrences.count(datetime.date(2030, 1, 1), datetime.date(2030, 12, 31), ['XX'])
+
+if __name__ == '__main__':
+	unittest.main()
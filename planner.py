@@ -0,0 +1,491 @@
+# Packs many tasks into shared daily time, earliest deadline first
+import datetime
+import heapq
+import bisect, hashlib
+import os, json
+
+from discoverycache import CACHE_DIR
+import occurrences
+import zones
+
+DEFAULT_PATH = os.path.join(CACHE_DIR, 'tasks.json')
+
+class Task():
+	"""
+	A piece of work to fit into the calendar.
+
+	Required arguments:
+		task_id -- a string identifying the task
+		hours_needed -- the total hours of work
+		available_days -- the RFC 5545 day names the task may use
+		start_date -- the first day work may be done
+		deadline -- the last day work may be done (inclusive)
+
+	Keyword arguments:
+		summary, location, description -- copied into the events
+	"""
+	def __init__(self, task_id, hours_needed, available_days, start_date, deadline,
+			summary='', location='', description=''):
+		if start_date > deadline:
+			raise ValueError("ERROR. Task '{}' has a deadline before its start date.".format(task_id))
+
+		self.task_id = task_id
+		self.minutes_needed = int(round(hours_needed * 60))
+		self.weekdays = occurrences.weekdays(available_days)
+		self.start_date = start_date
+		self.deadline = deadline
+
+		self.summary = summary
+		self.location = location
+		self.description = description
+
+	@classmethod
+	def from_form(cls, task_id, d):
+		"""
+		Makes a Task from the dictionary EventForm.get_form_data returns.
+		"""
+		return cls(
+			task_id,
+			int(d['hoursNeeded']),
+			d['availableDays'],
+			datetime.datetime.strptime(d['start']['dateTime'][:10], '%Y-%m-%d').date(),
+			d['endDate'],
+			summary=d.get('summary', ''),
+			location=d.get('location', ''),
+			description=d.get('description', ''),
+		)
+
+class Block():
+	"""
+	Time given to a task on one day, from start to end.
+	"""
+	__slots__ = ('task', 'start', 'end')
+
+	def __init__(self, task, start, end):
+		self.task = task
+		self.start = start
+		self.end = end
+
+	@property
+	def minutes(self):
+		return int((self.end - self.start).total_seconds()) // 60
+
+	def body(self, time_zone):
+		"""
+		Returns the block as a single CalendarEvent body.
+		"""
+		return {
+			'summary' : self.task.summary,
+			'location' : self.task.location,
+			'description' : self.task.description,
+			'start' : { 'dateTime' : self.start.isoformat('T'), 'timeZone' : time_zone },
+			'end' : { 'dateTime' : self.end.isoformat('T'), 'timeZone' : time_zone },
+			# Lets us find the events of a task again later
+			'extendedProperties' : { 'private' : { 'schedulerTaskId' : self.task.task_id } },
+		}
+
+class Plan():
+	"""
+	The result of Planner.plan: the blocks given out, in date order,
+	and the minutes of each task that couldn't be fit before its
+	deadline.
+	"""
+	def __init__(self):
+		self.blocks = []
+		self.unfit = {}
+
+	def bodies(self, time_zone):
+		for block in self.blocks:
+			yield block.body(time_zone)
+
+class Planner():
+	"""
+	Plans many tasks into the same daily window so no two of them
+	overlap. Every day, the task with the earliest deadline that may
+	use the day gets as much of the window as it still needs, then the
+	next earliest, until the window is full.
+
+	Keyword arguments:
+		day_start -- when the daily window opens (default 9:00)
+		day_end -- when the daily window closes (default 17:00)
+	"""
+	def __init__(self, day_start=datetime.time(9), day_end=datetime.time(17)):
+		self.day_start = day_start
+		self.day_end = day_end
+		self.capacity = (
+			(day_end.hour * 60 + day_end.minute) - (day_start.hour * 60 + day_start.minute)
+		)
+		if self.capacity <= 0:
+			raise ValueError("ERROR. 'day_end' must be after 'day_start'.")
+
+	def plan(self, tasks):
+		"""
+		Returns the Plan of tasks.
+		"""
+		plan = Plan()
+		tasks = sorted(tasks, key=lambda task: task.start_date)
+		if not tasks:
+			return plan
+
+		remaining = [task.minutes_needed for task in tasks]
+		for day, blocks, unfit in self.simulate(tasks, tasks[0].start_date, remaining):
+			plan.blocks.extend(blocks)
+			plan.unfit.update(unfit)
+		return plan
+
+	def simulate(self, tasks, day, remaining, next_task=0, heaps=None):
+		"""
+		Gives out the daily window day by day from day on, yielding
+		the (day, blocks, unfit) of every day it looks at. unfit maps
+		the ids of the tasks whose deadline was that day to the minutes
+		they still needed. Days nothing can happen on are skipped.
+
+		Required arguments:
+			tasks -- the tasks, sorted by start date
+			day -- the first day to plan
+			remaining -- the minutes each task still needs, by index
+				in tasks; updated as the days go by
+
+		Keyword arguments:
+			next_task -- the index of the first task that hasn't
+				started by day (default 0)
+			heaps -- the started tasks, as built by a previous run
+		"""
+		# One heap of (deadline, index) per weekday, holding the
+		# started tasks that may use that weekday. Finished and
+		# expired tasks are dropped when they come to the top.
+		if heaps is None:
+			heaps = [[] for _ in range(7)]
+		active = len(set(index for heap in heaps for deadline, index in heap if remaining[index] > 0))
+
+		one_day = datetime.timedelta(days=1)
+		while next_task < len(tasks) or active:
+			# Jump over days with nothing to do
+			if not active and tasks[next_task].start_date > day:
+				day = tasks[next_task].start_date
+
+			while next_task < len(tasks) and tasks[next_task].start_date <= day:
+				task = tasks[next_task]
+				if remaining[next_task] > 0:
+					for weekday in task.weekdays:
+						heapq.heappush(heaps[weekday], (task.deadline, next_task))
+					active += 1
+				next_task += 1
+
+			heap = heaps[day.weekday()]
+			opening = datetime.datetime.combine(day, self.day_start)
+			blocks = []
+			used = 0
+			while heap and used < self.capacity:
+				deadline, index = heap[0]
+				if remaining[index] == 0:
+					heapq.heappop(heap)
+					continue
+
+				minutes = min(remaining[index], self.capacity - used)
+				start = opening + datetime.timedelta(minutes=used)
+				blocks.append(Block(tasks[index], start, start + datetime.timedelta(minutes=minutes)))
+				used += minutes
+				remaining[index] -= minutes
+				if remaining[index] == 0:
+					heapq.heappop(heap)
+					active -= 1
+
+			# Retire the tasks whose deadline was today and report
+			# whatever they still needed
+			unfit = {}
+			if active:
+				active -= self.__expire(heaps, remaining, tasks, day + one_day, unfit)
+			yield day, blocks, unfit
+			day += one_day
+
+	def __expire(self, heaps, remaining, tasks, day, unfit):
+		expired = 0
+		for heap in heaps:
+			while heap and heap[0][0] < day:
+				deadline, index = heapq.heappop(heap)
+				if remaining[index] > 0:
+					unfit[tasks[index].task_id] = remaining[index]
+					remaining[index] = 0
+					expired += 1
+		return expired
+
+def block_id(task_id, day):
+	"""
+	Returns the event id of the block of task_id on day. It stays the
+	same when the block moves within the day, so the event can be
+	patched instead of replaced. Hex digits are a subset of the
+	base32hex alphabet Google allows and much quicker to make.
+	"""
+	key = '{}/{}'.format(task_id, day.isoformat())
+	return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class TaskGraph():
+	"""
+	Keeps the tasks, the blocks they were given on each day and the
+	events made from them between changes, and replans only the days a
+	change reaches.
+
+	A change to a task can only move blocks from the day it starts
+	(before or after the change) on. From there the days are planned
+	again until the change's deadline has passed and every other task
+	has been given exactly the minutes it had before. From then on the
+	old plan holds as it is. Every change returns the operations that
+	bring the calendar in line: ('create', event_id, body),
+	('patch', event_id, fields) and ('delete', event_id, None).
+
+	Keyword arguments:
+		planner -- the Planner giving out the days (default Planner())
+		time_zone -- the zone of the event bodies (default the
+			machine's)
+	"""
+	def __init__(self, planner=None, time_zone=None):
+		self.planner = planner or Planner()
+		self.time_zone = time_zone or zones.local_zone_name()
+		# task id -> Task
+		self.tasks = {}
+		# task id -> day -> Block
+		self.slots = {}
+		# task id -> minutes left over at its deadline
+		self.unfit = {}
+		# The tasks sorted by start date and their sort keys
+		self.__order = []
+		self.__keys = []
+		# day -> the blocks of the day in window order, and the days
+		# with blocks in order
+		self.__blocks = {}
+		self.__days = []
+
+	def __len__(self):
+		return len(self.tasks)
+
+	def blocks(self):
+		"""
+		Yields every block in date order.
+		"""
+		for day in self.__days:
+			for block in self.__blocks[day]:
+				yield block
+
+	def bodies(self):
+		"""
+		Yields the (event_id, body) of every block in date order.
+		"""
+		for block in self.blocks():
+			yield block_id(block.task.task_id, block.start.date()), block.body(self.time_zone)
+
+	def used_minutes(self, day):
+		"""
+		Returns the minutes of the daily window given out on day.
+		"""
+		return sum(block.minutes for block in self.__blocks.get(day, ()))
+
+	def add(self, task):
+		return self.update([task])
+
+	def remove(self, task_id):
+		return self.update(removed=[task_id])
+
+	def update(self, tasks=(), removed=()):
+		"""
+		Adds tasks, replacing the ones with the same id, and removes
+		the tasks with the ids in removed. Returns the operations the
+		calendar needs.
+		"""
+		changes = {}
+		for task_id in removed:
+			if task_id not in self.tasks:
+				raise KeyError("ERROR. No task '{}'.".format(task_id))
+			changes[task_id] = None
+		for task in tasks:
+			changes[task.task_id] = task
+		if not changes:
+			return []
+
+		first = last = None
+		for task_id, task in changes.items():
+			for version in (self.tasks.get(task_id), task):
+				if version is None:
+					continue
+				if first is None or version.start_date < first:
+					first = version.start_date
+				if last is None or version.deadline > last:
+					last = version.deadline
+
+			old = self.tasks.pop(task_id, None)
+			if old:
+				index = bisect.bisect_left(self.__keys, (old.start_date, task_id))
+				del self.__order[index], self.__keys[index]
+			if task:
+				self.tasks[task_id] = task
+				key = (task.start_date, task_id)
+				index = bisect.bisect_left(self.__keys, key)
+				self.__order.insert(index, task)
+				self.__keys.insert(index, key)
+
+		return self.__replan(first, last, set(changes))
+
+	def __replan(self, first, last, changed):
+		order = self.__order
+		one_day = datetime.timedelta(days=1)
+
+		# The state of the old plan when first begins: what every
+		# task started before then still needs
+		next_task = bisect.bisect_left(self.__keys, (first,))
+		remaining = [task.minutes_needed for task in order]
+		heaps = [[] for _ in range(7)]
+		for index in range(next_task):
+			task = order[index]
+			if task.deadline < first:
+				remaining[index] = 0
+				continue
+			remaining[index] -= sum(
+				block.minutes for day, block in self.slots.get(task.task_id, {}).items() if day < first
+			)
+			if remaining[index] > 0:
+				for weekday in task.weekdays:
+					heapq.heappush(heaps[weekday], (task.deadline, index))
+
+		operations = []
+		# task id -> minutes given in the new plan minus the old one,
+		# for the tasks that weren't changed
+		drift = {}
+		new_days = []
+		unfit = {}
+		lo = cursor = bisect.bisect_left(self.__days, first)
+		for day, blocks, expired in self.planner.simulate(order, first, remaining, next_task, heaps):
+			# Days of the old plan the new one had nothing for
+			while cursor < len(self.__days) and self.__days[cursor] < day:
+				self.__compare(self.__days[cursor], self.__blocks[self.__days[cursor]], [], changed, drift, operations)
+				cursor += 1
+			old = []
+			if cursor < len(self.__days) and self.__days[cursor] == day:
+				old = self.__blocks[day]
+				cursor += 1
+			self.__compare(day, old, blocks, changed, drift, operations)
+			if blocks:
+				new_days.append((day, blocks))
+			unfit.update(expired)
+
+			# Once the changes are over and every task stands where it
+			# did, the rest of the old plan holds
+			next_day = day + one_day
+			if next_day > last:
+				for task_id in [task_id for task_id in drift if self.tasks[task_id].deadline < next_day]:
+					del drift[task_id]
+				if not drift:
+					break
+		else:
+			while cursor < len(self.__days):
+				self.__compare(self.__days[cursor], self.__blocks[self.__days[cursor]], [], changed, drift, operations)
+				cursor += 1
+			next_day = None
+
+		for day in self.__days[lo:cursor]:
+			for block in self.__blocks.pop(day):
+				slots = self.slots[block.task.task_id]
+				if slots.get(day) is block:
+					del slots[day]
+		for day, blocks in new_days:
+			self.__blocks[day] = blocks
+			for block in blocks:
+				self.slots.setdefault(block.task.task_id, {})[day] = block
+		self.__days[lo:cursor] = [day for day, blocks in new_days]
+
+		for task_id in changed:
+			self.unfit.pop(task_id, None)
+			if task_id not in self.tasks:
+				self.slots.pop(task_id, None)
+		for task_id in [
+				task_id for task_id in self.unfit
+				if self.tasks[task_id].deadline >= first and (next_day is None or self.tasks[task_id].deadline < next_day)]:
+			del self.unfit[task_id]
+		self.unfit.update(unfit)
+
+		return operations
+
+	def __compare(self, day, old, new, changed, drift, operations):
+		# Adds the operations that turn the old blocks of day into the
+		# new ones and keeps track of the drift
+		old = { block.task.task_id : block for block in old }
+		for block in new:
+			task_id = block.task.task_id
+			before = old.pop(task_id, None)
+			if task_id not in changed:
+				self.__drift(drift, task_id, block.minutes - (before.minutes if before else 0))
+
+			if before is None:
+				operations.append(('create', block_id(task_id, day), block.body(self.time_zone)))
+			elif before.task is not block.task or before.start != block.start or before.end != block.end:
+				body, previous = block.body(self.time_zone), before.body(self.time_zone)
+				fields = { field : value for field, value in body.items() if previous.get(field) != value }
+				if fields:
+					operations.append(('patch', block_id(task_id, day), fields))
+
+		for task_id, before in old.items():
+			if task_id not in changed:
+				self.__drift(drift, task_id, -before.minutes)
+			operations.append(('delete', block_id(task_id, day), None))
+
+	def __drift(self, drift, task_id, minutes):
+		if minutes:
+			minutes += drift.get(task_id, 0)
+			if minutes:
+				drift[task_id] = minutes
+			else:
+				del drift[task_id]
+
+	def save(self, path=DEFAULT_PATH):
+		"""
+		Writes the tasks and the planner's window to path. Plans are
+		the same for the same tasks, so that's all load needs.
+		"""
+		state = {
+			'day_start' : self.planner.day_start.strftime('%H:%M'),
+			'day_end' : self.planner.day_end.strftime('%H:%M'),
+			'time_zone' : self.time_zone,
+			'tasks' : [{
+				'task_id' : task.task_id,
+				'minutes_needed' : task.minutes_needed,
+				'available_days' : [occurrences.DAYS[weekday] for weekday in task.weekdays],
+				'start_date' : task.start_date.isoformat(),
+				'deadline' : task.deadline.isoformat(),
+				'summary' : task.summary,
+				'location' : task.location,
+				'description' : task.description,
+			} for task in self.__order],
+		}
+
+		directory = os.path.dirname(os.path.abspath(path))
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		# Written next to the file and moved over it, so a crash never
+		# leaves half a graph behind
+		temporary = path + '.tmp'
+		with open(temporary, 'w') as f:
+			json.dump(state, f)
+		os.replace(temporary, path)
+
+	@classmethod
+	def load(cls, path=DEFAULT_PATH):
+		"""
+		Returns the graph saved at path, or an empty one if there is
+		none.
+		"""
+		if not os.path.exists(path):
+			return cls()
+		with open(path) as f:
+			state = json.load(f)
+
+		parse_time = lambda value: datetime.datetime.strptime(value, '%H:%M').time()
+		parse_date = lambda value: datetime.datetime.strptime(value, '%Y-%m-%d').date()
+		graph = cls(Planner(parse_time(state['day_start']), parse_time(state['day_end'])), state['time_zone'])
+		graph.update([
+			Task(
+				d['task_id'], d['minutes_needed'] / 60.0, d['available_days'],
+				parse_date(d['start_date']), parse_date(d['deadline']),
+				summary=d['summary'], location=d['location'], description=d['description'],
+			)
+			for d in state['tasks']
+		])
+		return graph
@@ -0,0 +1,119 @@
+# Tests that TaskGraph's incremental replanning matches planning from
+# scratch, and that its operations keep a FakeCalendarServer in line
+#
+#	> python -m unittest planner_test
+#
+import datetime, random
+import unittest
+from unittest import mock
+
+import httplib2
+
+from executor import RequestExecutor
+from fakecalendar import FakeCalendarServer
+from planner import Planner, Task, TaskGraph
+from scheduler import apply_operations
+import occurrences
+import wire
+
+BASE = datetime.date(2030, 1, 7)
+
+def random_task(rng, task_id, span=120):
+	start = BASE + datetime.timedelta(days=rng.randrange(span))
+	return Task(
+		task_id,
+		rng.randint(1, 20),
+		rng.sample(occurrences.DAYS, rng.randint(1, 7)),
+		start,
+		start + datetime.timedelta(days=rng.randint(0, 30)),
+		summary='Task {}'.format(task_id),
+	)
+
+def random_change(rng, graph, step):
+	# Moves a deadline, changes the hours, adds or removes a task
+	choice = rng.random()
+	task_ids = sorted(graph.tasks)
+	if choice < 0.25:
+		return graph.add(random_task(rng, 'new{}'.format(step)))
+	if choice < 0.45:
+		return graph.remove(rng.choice(task_ids))
+	old = graph.tasks[rng.choice(task_ids)]
+	days = [occurrences.DAYS[weekday] for weekday in old.weekdays]
+	if choice < 0.75:
+		deadline = max(old.start_date, old.deadline + datetime.timedelta(days=rng.randint(-5, 10)))
+		task = Task(old.task_id, old.minutes_needed / 60, days, old.start_date, deadline, summary=old.summary)
+	else:
+		task = Task(old.task_id, rng.randint(1, 20), days, old.start_date, old.deadline, summary='Changed')
+	return graph.update([task])
+
+def apply(calendar, operations):
+	# What the operations do to a calendar of event id -> body
+	for kind, event_id, body in operations:
+		if kind == 'create':
+			assert event_id not in calendar
+			calendar[event_id] = body
+		elif kind == 'patch':
+			calendar[event_id] = dict(calendar[event_id], **body)
+		else:
+			del calendar[event_id]
+
+class TaskGraphTest(unittest.TestCase):
+	def assertMatchesFullPlan(self, graph):
+		tasks = sorted(graph.tasks.values(), key=lambda task: (task.start_date, task.task_id))
+		plan = Planner().plan(tasks)
+		self.assertEqual(
+			[(block.task.task_id, block.start, block.end) for block in graph.blocks()],
+			[(block.task.task_id, block.start, block.end) for block in plan.blocks],
+		)
+		self.assertEqual(graph.unfit, plan.unfit)
+
+	def test_incremental_replans_match_full_plan(self):
+		rng = random.Random(1)
+		graph = TaskGraph(time_zone='UTC')
+		calendar = {}
+		apply(calendar, graph.update([random_task(rng, str(i)) for i in range(200)]))
+		self.assertMatchesFullPlan(graph)
+
+		for step in range(150):
+			apply(calendar, random_change(rng, graph, step))
+			self.assertMatchesFullPlan(graph)
+			self.assertEqual(calendar, dict(graph.bodies()))
+
+	def test_unchanged_task_needs_no_operations(self):
+		rng = random.Random(2)
+		graph = TaskGraph(time_zone='UTC')
+		tasks = [random_task(rng, str(i)) for i in range(50)]
+		graph.update(tasks)
+		self.assertEqual(graph.update([tasks[10]]), [])
+
+	def test_operations_keep_calendar_in_line(self):
+		server = FakeCalendarServer().start()
+		self.addCleanup(server.stop)
+		service = wire.build(server.document(), httplib2.Http())
+		# The fake has no quota to stay under
+		patcher = mock.patch('scheduler.default_executor', RequestExecutor(user_rate=1000.0, project_rate=1000.0))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		rng = random.Random(3)
+		graph = TaskGraph(time_zone='Europe/Berlin')
+		operations = graph.update([random_task(rng, str(i), span=30) for i in range(30)])
+		for step in range(10):
+			results = apply_operations(service, 'primary', operations)
+			self.assertEqual([exception for operation, response, exception in results], [None] * len(operations))
+			operations = random_change(rng, graph, step)
+		apply_operations(service, 'primary', operations)
+
+		live = {
+			event_id : event for event_id, event in server.calendars['primary'].items()
+			if event['status'] != 'cancelled'
+		}
+		bodies = dict(graph.bodies())
+		self.assertEqual(set(live), set(bodies))
+		for event_id, body in bodies.items():
+			self.assertEqual(live[event_id]['start'], body['start'])
+			self.assertEqual(live[event_id]['end'], body['end'])
+			self.assertEqual(live[event_id]['summary'], body['summary'])
+
+if __name__ == '__main__':
+	unittest.main()
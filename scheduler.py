@@ -1,29 +1,377 @@
 # tk widget for displaying our event form
 from eventform import EventForm
+from worker import BackgroundWorker
+from eventstore import EventStore, busy_hours_info, event_time, task_id_of
+from sync import SyncEngine
 from tkinter import *
 
-import httplib2
 import os
+import base64, bisect, hashlib, json
 
-from apiclient import discovery
+from apiclient.http import BatchHttpRequest
+from apiclient.errors import HttpError
 from oauth2client import client
 from oauth2client import tools
-from oauth2client.file import Storage
+from credentialmanager import AtomicStorage, CredentialManager
+
+import discoverycache
+import wire
+from metrics import metrics
+from executor import default_executor, is_retryable
+from freebusy import BusyCache, event_busy, merge, subtract
+import occurrences
+import zones
 
 import datetime, calendar
+import functools
 
 import argparse
 
-import re
-import math
+import logging
+
+log = logging.getLogger(__name__)
 
 class Unimplemented(Exception):
 	pass
 
+def task_end(start_date, start_time, hours_a_day):
+	"""
+	Returns the date a block of hours_a_day starting at start_time on
+	start_date ends on. If we, for example, start an event at 11PM and
+	it takes 2 hours a day, then the block ends the next day.
+	"""
+	additional_day = 1 if (start_time.hour + hours_a_day > 23) else 0
+
+	log.debug("start_time.hour + hours_a_day: %s, additional_day: %s", start_time.hour + hours_a_day, additional_day)
+
+	return start_date + datetime.timedelta(days=additional_day)
+
+def recurrence_times(start_date, end_date, available_days, start_time, hours_needed, skipped=frozenset()):
+	"""
+	Spreads hours_needed over the available days from start_date
+	through end_date, leaving out the dates in skipped. Returns the
+	start and end datetime of the first occurrence and the last date
+	the weekly rule repeats on.
+	"""
+	# The exact number of days the rule repeats on. The first
+	# occurrence is moved to the first available day so the
+	# event doesn't also land on the start date when that day
+	# isn't available.
+	days = occurrences.count(start_date, end_date, available_days) - len(skipped)
+	if days <= 0:
+		raise ValueError("ERROR. No available days between the start and end date.")
+	start_date = occurrences.first(start_date, end_date, available_days)
+	while start_date in skipped:
+		start_date = occurrences.first(start_date + datetime.timedelta(days=1), end_date, available_days)
+
+	hours_a_day, leftover = divmod(hours_needed, days)
+	minutes_a_day = 0 if leftover == 0 else (leftover * 60 // days)
+
+	# If the user, for example, has a task tarting at 10:30 and we
+	# need 50 minutes a day ... this will rollover the hour.
+	minutes_overlap = 1 if start_time.minute + minutes_a_day > 60 else 0
+
+	end_time = datetime.time(
+		(start_time.hour + hours_a_day + minutes_overlap) % 24, 
+		(start_time.minute + minutes_a_day) % 60,
+	)
+
+	start_datetime = datetime.datetime.combine(start_date, start_time)
+	end_datetime = datetime.datetime.combine(task_end(start_date, start_time, hours_a_day), end_time)
+
+	return start_datetime, end_datetime, end_date
+
+def busy_dates(start_date, end_date, available_days, start_time, hours_needed, time_zone, busy):
+	"""
+	Returns the available days from start_date through end_date whose
+	block would overlap one of the busy (start, end) intervals, given
+	as aware datetimes. Every day left out makes the blocks of the
+	others longer, so the rest are checked again until no more
+	overlap.
+	"""
+	if not busy:
+		return frozenset()
+	busy = merge(busy)
+	busy_starts = [start for start, end in busy]
+
+	dates = occurrences.expand(start_date, end_date, available_days)
+	skipped = set()
+	while True:
+		free = [d for d in dates if d not in skipped]
+		if not free:
+			raise ValueError("ERROR. Every available day between the start and end date is busy.")
+		length = datetime.timedelta(minutes=hours_needed * 60 // len(free))
+		starts = zones.localize_many([datetime.datetime.combine(d, start_time) for d in free], time_zone)
+
+		overlapping = set()
+		for d, start in zip(free, starts):
+			# The last busy interval starting before the block ends is
+			# the only one that can overlap it
+			i = bisect.bisect_left(busy_starts, start + length)
+			if i and busy[i - 1][1] > start:
+				overlapping.add(d)
+		if not overlapping:
+			return frozenset(skipped)
+		skipped |= overlapping
+
+def recurrence_rule(last_date, available_days, time_zone=None):
+	"""
+	Returns the rule repeating an event weekly on available_days
+	through last_date in time_zone.
+	"""
+	# UNTIL must be in UTC when the event has a zone. Using the end of
+	# the local day makes sure time gets allocated for the last day
+	# whatever the offset, including across DST changes.
+	return 'RRULE:FREQ=WEEKLY;INTERVAL=1;UNTIL={};BYDAY={}'.format(
+		zones.until_utc(last_date, time_zone), ','.join(available_days), 
+	)
+
+# The fields of an event body that identify it when it has no task
+ID_FIELDS = ('summary', 'location', 'description', 'start', 'end', 'recurrence', 'extendedProperties')
+
+def _digest(key):
+	# The SHA-256 of a JSON key in base32hex, the alphabet Google
+	# allows for client supplied ids
+	key = json.dumps(key, sort_keys=True, separators=(',', ':'))
+	digest = hashlib.sha256(key.encode('utf-8')).digest()
+	return base64.b32hexencode(digest).decode('ascii').rstrip('=').lower()
+
+def task_event_id(task_id, calendar_id):
+	"""
+	Returns the event id of the scheduler task task_id on
+	calendar_id. It doesn't depend on when the task's blocks are, so
+	a task keeps its event through change, reschedule and planning
+	around busy days, and running it again can't make a second copy.
+	"""
+	return _digest([calendar_id, task_id])
+
+def event_id(body, calendar_id):
+	"""
+	Returns a deterministic event id for an event body on calendar_id:
+	task_event_id for the body of a scheduler task, otherwise the
+	SHA-256 of its fields and calendar in base32hex, the alphabet
+	Google allows for client supplied ids.
+	"""
+	task_id = task_id_of(body)
+	if task_id:
+		return task_event_id(task_id, calendar_id)
+	return _digest([calendar_id, { field : body[field] for field in ID_FIELDS if field in body }])
+
+def default_task_id(summary, location, description, start_date, time_zone):
+	"""
+	Returns the task id of a task made without one, so the same task
+	always gets the same id whether it becomes a CalendarEvent or an
+	EventRecord. It is made from the fields change() can't change, so
+	the task keeps it when its hours, days or times change. No event
+	body is built for it, and being no event id it can be hex, which
+	is much quicker to make than base32hex.
+	"""
+	key = json.dumps([summary, location, description, str(start_date), time_zone], separators=(',', ':'))
+	return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def task_properties(task_id):
+	# Where the scheduler marks the task an event was made for; see
+	# eventstore.task_id_of
+	return { 'private' : { 'schedulerTaskId' : task_id } }
+
+# Google keeps the ids of deleted events, so an insert can fail with
+# 409 because the event was deleted rather than because it exists.
+# Only callers that ask for it get a deleted event back, by patching
+# its status; the user may have deleted it on purpose.
+RESTORE = { 'status' : 'confirmed' }
+
+def is_duplicate(error):
+	"""
+	Returns True if an insert failed because an event with its id
+	already exists.
+	"""
+	return isinstance(error, HttpError) and error.resp.status == 409
+
+def _same_time(old, new):
+	# The API returns times with an offset; we send local times with
+	# a zone. They're the same if they're the same instant in the same
+	# zone.
+	if not old or not new:
+		return old == new
+	if old.get('timeZone', new.get('timeZone')) != new.get('timeZone'):
+		return False
+	return event_time(old) == event_time(new)
+
+def body_delta(existing, body):
+	"""
+	Returns the fields of an event body that differ from the stored
+	event resource existing, ready to send as a patch. An empty
+	dictionary means the event is up to date.
+	"""
+	delta = {}
+	for field, value in body.items():
+		old = existing.get(field)
+		if field in ('start', 'end'):
+			if not _same_time(old, value):
+				delta[field] = value
+		# The API leaves out empty strings and lists
+		elif (old or None) != (value or None):
+			delta[field] = value
+	return delta
+
+def send_batch(service, requests, batch_uri=None):
+	"""
+	Executes API requests as one batch request and returns their
+	(response, exception) pairs in order. Exactly one of each pair is
+	None. Requests that fail on their own with a retryable error are
+	sent again through the executor.
+
+	Required arguments:
+		service -- the calendar service the requests belong to
+		requests -- functions that each make one API request; a
+			request is made again when it's retried
+	"""
+	if not requests:
+		return []
+
+	# Responses of a batch can come back in any order, so keep them
+	# by request id and hand them out in submission order
+	responses = {}
+	def batch_callback(request_id, response, exception):
+		responses[request_id] = (response, exception)
+
+	if batch_uri:
+		batch = BatchHttpRequest(callback=batch_callback, batch_uri=batch_uri)
+	else:
+		batch = service.new_batch_http_request(callback=batch_callback)
+
+	for position, request in enumerate(requests):
+		request = request()
+		if wire.is_lean():
+			# The outer request's headers apply to every part
+			for name in wire.BATCH_SHARED_HEADERS:
+				request.headers.pop(name, None)
+		batch.add(request, request_id=str(position))
+
+	try:
+		default_executor.execute(batch, cost=len(requests))
+	except Exception as e:
+		# The whole round trip failed; every request in it failed
+		for position in range(len(requests)):
+			responses.setdefault(str(position), (None, e))
+
+	results = []
+	for position, request in enumerate(requests):
+		response, exception = responses.get(
+			str(position), (None, Exception("ERROR. No response for request in batch."))
+		)
+		# Single requests of a batch can be throttled on their own;
+		# send those again through the executor so they're retried
+		if exception and is_retryable(exception):
+			try:
+				response, exception = default_executor.execute(request()), None
+			except Exception as e:
+				exception = e
+		results.append((response, exception))
+	return results
+
+def apply_operations(service, calendar_id, operations, batch_size=None, batch_uri=None, store=None):
+	"""
+	Sends the ('create', 'patch' or 'delete', event_id, body)
+	operations a TaskGraph change returns, in batches. Returns their
+	(operation, response, exception) tuples in order.
+
+	Required arguments:
+		service -- the calendar service to send them through
+		calendar_id -- the calendar the graph's events are on
+		operations -- the operations, as returned by TaskGraph.update
+
+	Keyword arguments:
+		batch_size -- operations per batch request (default
+			CalendarEvent.BATCH_SIZE)
+		batch_uri -- as for CalendarEvent.create_many
+		store -- an EventStore to keep in line with the calendar
+	"""
+	# Stored events need the fields the store reads
+	fields = wire.fields('store' if store else 'insert')
+	events = service.events()
+	def request(kind, event_id, body):
+		if kind == 'create':
+			return lambda: events.insert(calendarId=calendar_id, body=dict(body, id=event_id), fields=fields)
+		if kind == 'patch':
+			return lambda: events.patch(calendarId=calendar_id, eventId=event_id, body=body, fields=fields)
+		return lambda: events.delete(calendarId=calendar_id, eventId=event_id)
+
+	batch_size = batch_size or CalendarEvent.BATCH_SIZE
+	results = []
+	for i in range(0, len(operations), batch_size):
+		chunk = operations[i:i + batch_size]
+		responses = send_batch(service, [request(*operation) for operation in chunk], batch_uri)
+
+		# Google keeps the ids of deleted events, so a block that comes
+		# back to a day it left is restored rather than inserted
+		restored = [
+			position for position, (operation, (response, exception)) in enumerate(zip(chunk, responses))
+			if operation[0] == 'create' and exception and is_duplicate(exception)
+		]
+		if restored:
+			retried = send_batch(service, [
+				request('patch', chunk[position][1], dict(chunk[position][2], status='confirmed'))
+				for position in restored
+			], batch_uri)
+			for position, response in zip(restored, retried):
+				responses[position] = response
+
+		changed = []
+		for operation, (response, exception) in zip(chunk, responses):
+			kind, event_id, body = operation
+			metrics.inc('operations_total', kind=kind, outcome='failure' if exception else 'success')
+			if store and not exception:
+				if kind == 'delete':
+					store.delete(calendar_id, event_id)
+				else:
+					changed.append(response)
+			results.append((operation, response, exception))
+		if changed:
+			store.upsert(calendar_id, changed)
+	return results
+
+def _instance_error(existing):
+	# Instances of a recurring event have ids of their own; patching
+	# the rule onto one would split it off the series
+	if existing.get('recurringEventId'):
+		return ValueError("ERROR. Reschedule the recurring event '{}', not one of its instances.".format(
+			existing['recurringEventId']
+		))
+	return None
+
+def _skipped(calendar_id, body, store):
+	# The stored copy of an event the index says exists has its link
+	return (store and store.get(calendar_id, body['id'])) or body
+
+def _existing(calendar_id, body, index, store):
+	# An insert found the event's id taken: the task was sent before,
+	# ie. by an insert that timed out but did land
+	if index:
+		index.record_inserted(calendar_id, [body['id']])
+	return _skipped(calendar_id, body, store)
+
+def insert_fields(store):
+	# What an insert asks for: enough to store the event when it is
+	# kept, otherwise just where it is
+	return wire.fields('store' if store else 'insert')
+
+def _inserted(calendar_id, event, index, store=None):
+	if index:
+		index.record_inserted(calendar_id, [event['id']])
+	if store:
+		store.upsert(calendar_id, [event])
+	log.info("Event created: %s", event.get('htmlLink'))
+	return event
+
 class CalendarEvent():
 	"""
 	Creates a JSON event from passed in parameters. 
 	"""
+	# The most calls Google accepts in a single batch request
+	BATCH_SIZE = 50
+
+	@metrics.timed('build_event')
 	def __init__(self, **kwargs):
 		self.calendar_id = 'primary'
 
@@ -54,22 +402,39 @@ class CalendarEvent():
 			self.start_time = kwargs['startTime']
 			del kwargs['startTime']
 
+		# Busy intervals to plan around, and the days left out for them
+		self.busy = ()
+		self.skipped = frozenset()
+
 		self.available_days = None
 		if kwargs.get('availableDays'):
 			assert isinstance(kwargs['availableDays'], list), (
 				"ERROR. 'availableDays' must be of type list."
 			)
-			self.available_days = kwargs['availableDays']
+			self.available_days = occurrences.normalize_days(kwargs['availableDays'])
 			del kwargs['availableDays']
 
+		# The task the event is made for, kept through changes so
+		# EventStore.task_events finds the event again
+		self.task_id = kwargs.pop('taskId', None)
+
 		for key, value in kwargs.items():
 			if key not in self.options:
-				print("ERROR. Unsupported or invalid option '{}'.".format(key))
+				log.error("Unsupported or invalid option '%s'.", key)
 			else:
 				self.options[key] = value
 
+		# Kept so the event can be planned again after a change
+		self.start_date = self.options['start']['dateTime']
 		self.set_recurrence(self.hours_needed)
 
+		if not self.task_id:
+			self.task_id = default_task_id(
+				self.options['summary'], self.options['location'], self.options['description'],
+				self.start_date, self.options['start']['timeZone'],
+			)
+		self.options['extendedProperties'] = task_properties(self.task_id)
+
 	def __setup_options(self):
 		self.options = {
 			'summary' : '',
@@ -82,7 +447,7 @@ class CalendarEvent():
 
 	def __set_str(self, option, s):
 		if not isinstance(s, str):
-			print("ERROR. '{}' must be of type str.".format(option))
+			log.error("'%s' must be of type str.", option)
 		else:
 			self.options[option] = s
 
@@ -107,10 +472,10 @@ class CalendarEvent():
 	def __valid_date(self, date_time, time_zone):
 		valid = True
 		if not isinstance(date_time, datetime.date):
-			print("ERROR. 'date_time' must be of type datetime.date.")
+			log.error("'date_time' must be of type datetime.date.")
 			valid = False
 		if not isinstance(time_zone, datetime.date):
-			print("ERROR. 'time_zone' must be of type datetime.timzeone.")
+			log.error("'time_zone' must be of type datetime.timzeone.")
 			valid = False
 
 		return valid
@@ -126,43 +491,7 @@ class CalendarEvent():
 	def set_end(self, date_time, time_zone):
 		self.__set_date('end', date_time, time_zone)
 
-	def __get_task_end(self, start_date, start_time, hours_a_day):
-		# If we, for example, start an event at 11PM and it takes 2 hours a 
-		# day, then the end date for the task is an additional day
-		additional_day = 1 if (start_time.hour + hours_a_day > 23) else 0
-
-		print("start_time.hour + hours_a_day: ", start_time.hour + hours_a_day)
-		print("additional_day: ", additional_day)
-
-		end_date = None
-		# Three special (but unlikely) cases:
-		#	1 -- the end date is the next day
-		try:
-			end_date = datetime.date(
-				start_date.year, 
-				start_date.month, 
-				start_date.day + additional_day
-			)
-		#	2 -- the end date is the start of the next month
-		except:
-			try:
-				end_date = datetime.date(
-					start_date.year,
-					start_date.month + 1,
-					1
-				)
-		# 	3 -- the end date is the start of the next year
-			except:
-				end_date = datetime.date(
-					start_date.year + 1,
-					1,
-					1
-				)
-
-		print(end_date)
-
-		return end_date
-
+	@metrics.timed('set_recurrence')
 	def set_recurrence(self, hours_needed):
 		"""
 		Based off our current date and end date, set_recurrence 
@@ -181,100 +510,599 @@ class CalendarEvent():
 		except:
 			raise Exception("ERROR. Invalid date format.")
 
+		time_zone = self.options['start']['timeZone']
+		self.skipped = busy_dates(
+			start_date, self.end_date, self.available_days, self.start_time, hours_needed, time_zone, self.busy
+		)
+		start_datetime, end_datetime, last_date = recurrence_times(
+			start_date, self.end_date, self.available_days, self.start_time, hours_needed, self.skipped
+		)
+
+		self.options['start']['dateTime'] = start_datetime.isoformat('T')
+		self.options['end']['dateTime'] = end_datetime.isoformat('T')
+		self.options['recurrence'] = [recurrence_rule(last_date, self.available_days, time_zone)]
+
+		later = [d for d in self.skipped if d > start_datetime.date()]
+		if later:
+			self.options['recurrence'].append(occurrences.exdate(later, self.start_time, time_zone))
+
+	def avoid(self, busy):
+		"""
+		Plans the event again around busy, the (start, end) intervals
+		the user is already busy in, ie. from freebusy.event_busy.
+		Available days whose block overlaps one are left out and the
+		hours spread over the rest. Returns the dates left out.
+		"""
+		self.busy = list(busy)
+		self.options['start']['dateTime'] = self.start_date
+		self.set_recurrence(self.hours_needed)
+		return self.skipped
 
+	def event_id(self, calendar_id=None):
+		"""
+		Returns the id this event gets on calendar_id. It only depends
+		on the task and the calendar, so sending the same event again
+		can't make a second copy.
+		"""
+		calendar_id = calendar_id or self.calendar_id
+		if self.task_id:
+			return task_event_id(self.task_id, calendar_id)
+		return event_id(self.options, calendar_id)
+
+	def insert_body(self, calendar_id=None):
+		# EventRecord builds its options on every access, so they are
+		# built once here for both the body and its id
+		body = self.options
+		return dict(body, id=event_id(body, calendar_id or self.calendar_id))
+
+	def create_event(self, service=None, calendar_id=None, user=None, index=None, store=None, restore=False,
+			busy=None):
+		"""
+		From the data inside the class, this method creates an event
+		on the passed in calendar id and returns the created event.
+
+		The event is inserted with its deterministic id. If the id is
+		taken, ie. a timed out insert did land, the event already
+		exists and its stored copy, or the body, is returned without
+		another request.
+
+		Keyword arguments:
+			service -- the calendar service to insert with. Pass one
+				in to use an account other than the logged in user.
+				(default CalendarCredentials.service)
+			calendar_id -- the calendar to insert into
+				(default self.calendar_id)
+			user -- the account the request counts against in the
+				quota of the request executor
+			index -- an EventStore whose idempotency index is checked
+				before inserting and updated after. Events found in it
+				are not sent again.
+			store -- an EventStore to keep the created event in, so
+				it can be rescheduled later
+			restore -- bring the event back if the id is taken by an
+				event that was deleted (default False)
+			busy -- a function of this event returning the busy
+				intervals to plan it around, ie. freebusy.event_busy.
+				It is only called for an event not found in index, and
+				the times the task's own events in store take are left
+				out of what it returns.
+		"""
+		if not service:
+			if not CalendarCredentials.logged_in():
+				raise Exception("ERROR. User must be logged in to create an event.")
+			service = CalendarCredentials.service
+
+		calendar_id = calendar_id or self.calendar_id
+		body = self.insert_body(calendar_id)
+		if index and index.inserted_ids(calendar_id, [body['id']]):
+			metrics.inc('events_total', outcome='skipped')
+			return _skipped(calendar_id, body, store)
+		if busy:
+			# The id doesn't depend on the plan, so only the body changes
+			own = store.task_intervals(calendar_id, self.task_id, body['id']) if store else []
+			self.avoid(subtract(busy(self), own))
+			body = self.insert_body(calendar_id)
+
+		events = service.events()
+		outcome = 'success'
+		try:
+			try:
+				event = default_executor.execute(
+					events.insert(calendarId=calendar_id, body=body, fields=insert_fields(store)),
+					user=user,
+				)
+			except Exception as e:
+				if not is_duplicate(e):
+					raise
+				outcome = 'duplicate'
+				if not restore:
+					metrics.inc('events_total', outcome=outcome)
+					return _existing(calendar_id, body, index, store)
+				event = default_executor.execute(
+					events.get(calendarId=calendar_id, eventId=body['id'], fields=wire.fields('store')),
+					user=user,
+				)
+				if event.get('status') == 'cancelled':
+					outcome = 'restored'
+					event = default_executor.execute(
+						events.patch(calendarId=calendar_id, eventId=body['id'], body=RESTORE, fields=insert_fields(store)),
+						user=user,
+					)
+		except Exception:
+			metrics.inc('events_total', outcome='failure')
+			raise
+		metrics.inc('events_total', outcome=outcome)
+		return _inserted(calendar_id, event, index, store)
+
+	async def create_event_async(self, client, calendar_id=None, index=None, store=None, restore=False):
+		"""
+		Like create_event, but inserts through an AsyncCalendarClient
+		without blocking the event loop. create_event itself stays
+		blocking for the tkinter and bulk import callers.
+
+		Required arguments:
+			client -- the AsyncCalendarClient to insert with
+
+		Keyword arguments:
+			calendar_id -- the calendar to insert into
+				(default self.calendar_id)
+			index -- an EventStore used as the idempotency index
+			store -- an EventStore to keep the created event in
+			restore -- as for create_event
 		"""
-		The idea of the algorithm:
+		calendar_id = calendar_id or self.calendar_id
+		body = self.insert_body(calendar_id)
+		if index and index.inserted_ids(calendar_id, [body['id']]):
+			metrics.inc('events_total', outcome='skipped')
+			return _skipped(calendar_id, body, store)
 
-		Mon 	Tue 	Wed 	Thu 	Fri 	Sat 	Sun
-		 X 		  		 X 		 X
+		outcome = 'success'
+		try:
+			try:
+				event = await client.insert(calendar_id, body, fields=insert_fields(store))
+			except Exception as e:
+				if not is_duplicate(e):
+					raise
+				outcome = 'duplicate'
+				if not restore:
+					metrics.inc('events_total', outcome=outcome)
+					return _existing(calendar_id, body, index, store)
+				event = await client.get(calendar_id, body['id'], fields=wire.fields('store'))
+				if event.get('status') == 'cancelled':
+					outcome = 'restored'
+					event = await client.patch(calendar_id, body['id'], RESTORE, fields=insert_fields(store))
+		except Exception:
+			metrics.inc('events_total', outcome='failure')
+			raise
+		metrics.inc('events_total', outcome=outcome)
+		return _inserted(calendar_id, event, index, store)
 
-		days between: 10
-		
-		# NOTE: This doesn't take into account the day we
-		# start our task, nor does it respect the end day
-		# ceiling(10 / 7) represents the number of weeks
-		max work days: 3 * ceiling(10 / 7)
-		max work days == 6
-
-		From the start day, subtract how many days come 
-		before that in available days ... ie. if we 
-		start on a Thursday and our available days are
-		Monday, Wednesday, and Thursday, subtract 2
-		from max work days
-
-		Next, do the same process for the end date--
-		subtract the number of avaiable days after
-		our end date. ie. if we end on Tuesday, 
-		subtract 1 from our max work days	
-		"""
-
-		# Number of days between start and end date
-		days_between = (self.end_date - start_date).days
-		weeks = math.ceil(days_between / 7)
-		# Number of days available a week to work
-		max_work_days = len(self.available_days) * (int(days_between / 7) + 1)
-		days = max_work_days
-
-		day_value = {}
-		for day, value in zip(('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU'), range(7)):
-			day_value[day] = value
-
-		for day in self.available_days:
-			if day_value[day] < start_date.weekday():
-				days -= 1
-
-		for day in self.available_days:
-			if day_value[day] > self.end_date.weekday():
-				days -= 1
-
-		hours_a_day, leftover = divmod(hours_needed, days)
-		minutes_a_day = 0 if leftover == 0 else (leftover * 60 // days)
-
-		# If the user, for example, has a task tarting at 10:30 and we
-		# need 50 minutes a day ... this will rollover the hour.
-		minutes_overlap = 1 if self.start_time.minute + minutes_a_day > 60 else 0
-
-		end_time = datetime.time(
-			(self.start_time.hour + hours_a_day + minutes_overlap) % 24, 
-			(self.start_time.minute + minutes_a_day) % 60,
-		)
+	@classmethod
+	def create_many(cls, events, batch_size=BATCH_SIZE, callback=None, batch_uri=None, service=None, index=None,
+			store=None, restore=False):
+		"""
+		Inserts every CalendarEvent in events using Google batch HTTP
+		requests, sending at most batch_size inserts per round trip.
+		Events whose id is taken already exist, as in create_event.
+
+		Keyword arguments:
+			batch_size -- the number of inserts grouped into one
+				batch request (default BATCH_SIZE, Google's limit)
+			callback -- a function called as callback(event, response,
+				exception) for every event once its batch returns.
+				Exactly one of response and exception is None.
+			batch_uri -- the batch endpoint to post to. Used to point
+				the batch at a local fake of the endpoint.
+			service -- the calendar service to insert with
+				(default CalendarCredentials.service)
+			index -- an EventStore used as the idempotency index.
+				Events found in it are passed to callback without
+				being sent.
+			store -- an EventStore to keep the created events in
+			restore -- as for create_event; the deleted events are
+				found and restored in two more batches
 
-		task_end = self.__get_task_end(start_date, self.start_time, hours_a_day)
+		Returns:
+			A list of (event, response, exception) tuples in the order
+			the events were passed in. When a callback is given the
+			results are only passed to it and an empty list is returned
+			so long streams of events do not accumulate.
+		"""
+		if not service:
+			if not CalendarCredentials.logged_in():
+				raise Exception("ERROR. User must be logged in to create an event.")
+			service = CalendarCredentials.service
+		if batch_size < 1 or batch_size > cls.BATCH_SIZE:
+			raise ValueError("ERROR. 'batch_size' must be between 1 and {}.".format(cls.BATCH_SIZE))
+
+		results = []
+		def handle_result(event, response, exception, outcome):
+			metrics.inc('events_total', outcome=outcome)
+			if callback:
+				callback(event, response, exception)
+			else:
+				results.append((event, response, exception))
 
-		start_datetime = datetime.datetime.combine(start_date, self.start_time)
-		end_datetime = datetime.datetime.combine(task_end, end_time)
+		chunk = []
+		for event in events:
+			chunk.append(event)
+			if len(chunk) == batch_size:
+				cls.__insert_batch(service, chunk, handle_result, batch_uri, index, store, restore)
+				chunk = []
+		if chunk:
+			cls.__insert_batch(service, chunk, handle_result, batch_uri, index, store, restore)
 
-		# Inclusive_date ensures that time gets allocated for the
-		# last day; without, we will only allocated time up to the
-		# last day
-		inclusive_date = self.__get_task_end(self.end_date, datetime.time(23), 2)
-		# Repeat our event weekly until our last day; this string
-		# is in RFC3339 format without punctuation
-		until_s = datetime.datetime.combine(inclusive_date, datetime.time(0)).isoformat('T')
-		until_s = re.sub('[-:]', '', until_s) + 'Z'
+		return results
 
-		recurrence_s = 'RRULE:FREQ=WEEKLY;INTERVAL=1;UNTIL={};BYDAY={}'.format(
-			until_s, ','.join(self.available_days), 
-		)
+	@classmethod
+	def __insert_batch(cls, service, chunk, handle_result, batch_uri, index, store, restore):
+		bodies = [event.insert_body(event.calendar_id) for event in chunk]
+
+		# Skip what the index says was inserted before
+		done = set()
+		if index:
+			ids = {}
+			for event, body in zip(chunk, bodies):
+				ids.setdefault(event.calendar_id, []).append(body['id'])
+			for calendar_id, event_ids in ids.items():
+				done.update((calendar_id, i) for i in index.inserted_ids(calendar_id, event_ids))
+
+		pending = [
+			(event, body) for event, body in zip(chunk, bodies)
+			if (event.calendar_id, body['id']) not in done
+		]
+		# Building the events resource builds all its methods, so it is
+		# done once per batch rather than once per request
+		events = service.events()
+		results = send_batch(service, [
+			lambda event=event, body=body: events.insert(
+				calendarId=event.calendar_id, body=body, fields=insert_fields(store)
+			)
+			for event, body in pending
+		], batch_uri)
+
+		# Events whose id is taken already exist, unless they were
+		# deleted and restore asks for them back, see RESTORE
+		duplicates = [
+			position for position, (response, exception) in enumerate(results)
+			if exception and is_duplicate(exception)
+		]
+		existing, restored = set(), []
+		if duplicates and restore:
+			found = send_batch(service, [
+				lambda event=pending[position][0], body=pending[position][1]: events.get(
+					calendarId=event.calendar_id, eventId=body['id'], fields=wire.fields('store')
+				)
+				for position in duplicates
+			], batch_uri)
+			for position, result in zip(duplicates, found):
+				results[position] = result
+			restored = [
+				position for position, (response, exception) in zip(duplicates, found)
+				if response and response.get('status') == 'cancelled'
+			]
+			patched = send_batch(service, [
+				lambda event=pending[position][0], body=pending[position][1]: events.patch(
+					calendarId=event.calendar_id, eventId=body['id'], body=RESTORE, fields=insert_fields(store)
+				)
+				for position in restored
+			], batch_uri)
+			for position, result in zip(restored, patched):
+				results[position] = result
+		elif duplicates:
+			existing = set(duplicates)
+		duplicates, restored = set(duplicates), set(restored)
+
+		results = iter(enumerate(results))
+		inserted, responses = {}, {}
+		for event, body in zip(chunk, bodies):
+			if (event.calendar_id, body['id']) in done:
+				handle_result(event, _skipped(event.calendar_id, body, store), None, 'skipped')
+				continue
+
+			position, (response, exception) = next(results)
+			if position in existing:
+				inserted.setdefault(event.calendar_id, []).append(body['id'])
+				handle_result(event, _skipped(event.calendar_id, body, store), None, 'duplicate')
+				continue
+			if exception:
+				outcome = 'failure'
+			else:
+				outcome = 'restored' if position in restored else 'duplicate' if position in duplicates else 'success'
+				inserted.setdefault(event.calendar_id, []).append(body['id'])
+				responses.setdefault(event.calendar_id, []).append(response)
+			handle_result(event, response, exception, outcome)
+
+		if index:
+			for calendar_id, event_ids in inserted.items():
+				index.record_inserted(calendar_id, event_ids)
+		if store:
+			for calendar_id, stored in responses.items():
+				store.upsert(calendar_id, stored)
+
+	def change(self, hoursNeeded=None, endDate=None, availableDays=None, startTime=None):
+		"""
+		Changes the task the event was made from and runs
+		set_recurrence again. Use reschedule to bring an event made
+		before the change up to date.
+		"""
+		if hoursNeeded is not None:
+			self.hours_needed = int(hoursNeeded)
+		if endDate is not None:
+			assert isinstance(endDate, datetime.date), (
+				"ERROR. 'endDate' must be of type date."
+			)
+			self.end_date = endDate
+		if availableDays is not None:
+			assert isinstance(availableDays, list), (
+				"ERROR. 'availableDays' must be of type list."
+			)
+			self.available_days = occurrences.normalize_days(availableDays)
+		if startTime is not None:
+			assert isinstance(startTime, datetime.time), (
+				"ERROR. 'startTime' must be of type time."
+			)
+			self.start_time = startTime
 
-		self.options['start']['dateTime'] = start_datetime.isoformat('T')
-		self.options['end']['dateTime'] = end_datetime.isoformat('T')
-		self.options['recurrence'] = [recurrence_s]
+		# set_recurrence moved the start to the first available day;
+		# plan again from the day the task starts
+		self.options['start']['dateTime'] = self.start_date
+		self.set_recurrence(self.hours_needed)
 
-	def create_event(self):
+	def reschedule(self, existing, service=None, calendar_id=None, user=None, store=None):
 		"""
-		From the data inside the class, this method creates an event
-		on the passed in calendar id
+		Brings the stored event existing up to date with this event,
+		sending only the fields that differ through events().patch.
+		Returns the patched event, or existing when nothing changed
+		and no request was sent.
+
+		Required arguments:
+			existing -- the recurring event as stored, ie.
+				store.get(calendar_id, event.event_id(calendar_id))
+				after create_event(store=store), or from
+				SyncEngine.get_event. Stores synced from Google keep
+				the single instances of recurring events too; those
+				are refused.
+
+		Keyword arguments:
+			service, calendar_id, user -- as for create_event
+			store -- an EventStore to update with the patched event
+		"""
+		if not service:
+			if not CalendarCredentials.logged_in():
+				raise Exception("ERROR. User must be logged in to reschedule an event.")
+			service = CalendarCredentials.service
+
+		error = _instance_error(existing)
+		if error:
+			raise error
+		delta = body_delta(existing, self.options)
+		if not delta:
+			metrics.inc('reschedules_total', outcome='unchanged')
+			return existing
+
+		calendar_id = calendar_id or self.calendar_id
+		try:
+			event = default_executor.execute(
+				service.events().patch(
+					calendarId=calendar_id, eventId=existing['id'], body=delta, fields=wire.fields('store')
+				),
+				user=user,
+			)
+		except Exception:
+			metrics.inc('reschedules_total', outcome='failure')
+			raise
+		metrics.inc('reschedules_total', outcome='patched')
+		metrics.inc('reschedule_bytes_total', len(json.dumps(delta)))
+		if store:
+			store.upsert(calendar_id, [event])
+		return event
+
+	@classmethod
+	def reschedule_many(cls, pairs, batch_size=BATCH_SIZE, callback=None, batch_uri=None, service=None, store=None):
 		"""
-		if not CalendarCredentials.logged_in():
-			raise Exception("ERROR. User must be logged in to create an event.")
+		Reschedules many events, batching the patches of the ones that
+		changed. Events that didn't change send nothing.
+
+		Required arguments:
+			pairs -- (event, existing) pairs of a rescheduled event
+				and its stored resource
+
+		Keyword arguments:
+			batch_size, batch_uri, service -- as for create_many
+			callback -- called as callback(event, response, exception)
+				for every pair. response is the existing resource for
+				events that didn't change.
+			store -- an EventStore to update with the patched events
 
-		event = CalendarCredentials.service.events().insert(calendarId=self.calendar_id, body=self.options).execute()
-		print("Event created: {}".format(event.get('htmlLink')))
+		Returns:
+			The (event, response, exception) tuples in order, or an
+			empty list when a callback is given.
+		"""
+		if not service:
+			if not CalendarCredentials.logged_in():
+				raise Exception("ERROR. User must be logged in to reschedule an event.")
+			service = CalendarCredentials.service
+		if batch_size < 1 or batch_size > cls.BATCH_SIZE:
+			raise ValueError("ERROR. 'batch_size' must be between 1 and {}.".format(cls.BATCH_SIZE))
+
+		# Unchanged events are done before the patches ahead of them are
+		# sent, so results are kept by position
+		results = []
+		def handle_result(position, event, response, exception, outcome):
+			metrics.inc('reschedules_total', outcome=outcome)
+			if callback:
+				callback(event, response, exception)
+			else:
+				results[position] = (event, response, exception)
+
+		# (position, event, existing, delta) of the changed events not
+		# sent yet
+		chunk = []
+		resource = service.events()
+		def flush():
+			responses = send_batch(service, [
+				lambda event=event, existing=existing, delta=delta: resource.patch(
+					calendarId=event.calendar_id, eventId=existing['id'], body=delta, fields=wire.fields('store')
+				)
+				for position, event, existing, delta in chunk
+			], batch_uri)
+
+			patched = {}
+			for (position, event, existing, delta), (response, exception) in zip(chunk, responses):
+				if not exception:
+					metrics.inc('reschedule_bytes_total', len(json.dumps(delta)))
+					patched.setdefault(event.calendar_id, []).append(response)
+				handle_result(position, event, response, exception, 'failure' if exception else 'patched')
+			if store:
+				for calendar_id, events in patched.items():
+					store.upsert(calendar_id, events)
+			del chunk[:]
+
+		for position, (event, existing) in enumerate(pairs):
+			if not callback:
+				results.append(None)
+			error = _instance_error(existing)
+			if error:
+				handle_result(position, event, None, error, 'failure')
+				continue
+			delta = body_delta(existing, event.options)
+			if not delta:
+				handle_result(position, event, existing, None, 'unchanged')
+				continue
+			chunk.append((position, event, existing, delta))
+			if len(chunk) == batch_size:
+				flush()
+		if chunk:
+			flush()
+
+		return results
 
 	def __str__():
 		return str(self.options)
 
+class EventRecord():
+	"""
+	A compact CalendarEvent for planning runs that make very many
+	events. Dates and times are kept as date objects and the available
+	days as a bit mask; the JSON body is only built when the event is
+	submitted. Records can be passed anywhere a CalendarEvent is
+	inserted, ie. CalendarEvent.create_many.
+
+	Required arguments:
+		summary, location, description -- the text of the event
+		start -- the datetime the first occurrence starts
+		end -- the datetime the first occurrence ends
+		time_zone -- the name of the zone start and end are in
+		until -- the last date the event repeats weekly on
+		days -- a bit mask of the date.weekday() values it repeats on
+
+	Keyword arguments:
+		task_id -- the task the event is made for, as on CalendarEvent
+	"""
+	__slots__ = (
+		'calendar_id', 'summary', 'location', 'description',
+		'start', 'end', 'time_zone', 'until', 'days', 'task_id', 'line',
+	)
+
+	def __init__(self, summary, location, description, start, end, time_zone, until, days, task_id=None):
+		self.calendar_id = 'primary'
+		self.summary = summary
+		self.location = location
+		self.description = description
+		self.start = start
+		self.end = end
+		self.time_zone = time_zone
+		self.until = until
+		self.days = days
+		self.task_id = task_id
+		# Set by bulk imports to report the row of a failed event
+		self.line = None
+
+	@classmethod
+	@metrics.timed('build_record')
+	def from_task(cls, **kwargs):
+		"""
+		Makes a record from the same keyword arguments as a
+		CalendarEvent.
+		"""
+		# Read like CalendarEvent reads it, so the form's strings work
+		hours_needed = kwargs.get('hoursNeeded')
+		if hours_needed:
+			hours_needed = int(hours_needed)
+		if not isinstance(hours_needed, int):
+			raise TypeError("ERROR. 'hours_needed' needs to be of type int, not {}.".format(type(hours_needed)))
+		assert isinstance(kwargs.get('endDate'), datetime.date), (
+			"ERROR. 'endDate' must be of type date."
+		)
+		assert isinstance(kwargs.get('startTime'), datetime.time), (
+			"ERROR. 'startTime' must be of type time."
+		)
+		assert isinstance(kwargs.get('availableDays'), list), (
+			"ERROR. 'availableDays' must be of type list."
+		)
+
+		start = kwargs.get('start', {})
+		try:
+			start_date = datetime.datetime.strptime(start['dateTime'], '%Y-%m-%d').date()
+		except:
+			raise Exception("ERROR. Invalid date format.")
+
+		days = 0
+		for weekday in occurrences.weekdays(kwargs['availableDays']):
+			days |= 1 << weekday
+
+		start_datetime, end_datetime, until = recurrence_times(
+			start_date, kwargs['endDate'], kwargs['availableDays'], kwargs['startTime'], hours_needed
+		)
+		record = cls(
+			kwargs.get('summary', ''),
+			kwargs.get('location', ''),
+			kwargs.get('description', ''),
+			start_datetime,
+			end_datetime,
+			start.get('timeZone', ''),
+			until,
+			days,
+			kwargs.get('taskId'),
+		)
+		if not record.task_id:
+			record.task_id = default_task_id(
+				record.summary, record.location, record.description, start_date, record.time_zone,
+			)
+		return record
+
+	@property
+	def available_days(self):
+		return [day for value, day in enumerate(occurrences.DAYS) if self.days >> value & 1]
+
+	@property
+	def options(self):
+		"""
+		The event body sent to Google, built on every access.
+		"""
+		body = {
+			'summary' : self.summary,
+			'location' : self.location,
+			'description' : self.description,
+			'start' : { 'dateTime' : self.start.isoformat('T'), 'timeZone' : self.time_zone },
+			'end' : { 'dateTime' : self.end.isoformat('T'), 'timeZone' : self.time_zone },
+			'recurrence' : [recurrence_rule(self.until, self.available_days, self.time_zone)],
+		}
+		if self.task_id:
+			body['extendedProperties'] = task_properties(self.task_id)
+		return body
+
+	# Inserting only needs calendar_id and options
+	event_id = CalendarEvent.event_id
+	insert_body = CalendarEvent.insert_body
+	create_event = CalendarEvent.create_event
+	create_event_async = CalendarEvent.create_event_async
+	reschedule = CalendarEvent.reschedule
+
+	def __str__(self):
+		return str(self.options)
+
 class CalendarCredentials():
 	class __InitStatic():
 		@classmethod
@@ -285,17 +1113,29 @@ class CalendarCredentials():
 			return os.path.join(credential_dir, 'calendar-python-scheduler.json')
 
 		@classmethod
-		def get_http(cls, credentials):
-			return credentials.authorize(httplib2.Http()) if credentials else None
+		def get_manager(cls, credentials):
+			# Refreshes the token in the background before it expires
+			if not credentials or credentials.invalid:
+				return None
+			return CredentialManager(credentials).start()
+
+		@classmethod
+		def get_http(cls, manager):
+			return manager.authorize(wire.Http()) if manager else None
 
 		@classmethod
 		def get_service(cls, http):
 			if not http:
 				return None
-			return discovery.build('calendar', 'v3', http=http) if http else None
+			# Building from the cached document avoids fetching and
+			# parsing it over the network every time we start
+			with metrics.span('discovery_build'):
+				document = discoverycache.load_document('calendar', 'v3')
+				return wire.build(document, http)
 
-	# Static variables for our CalendarCredentials
-	flags = argparse.ArgumentParser(parents=[tools.argparser]).parse_args()
+	# Static variables for our CalendarCredentials. Only the OAuth flags
+	# are parsed here so other entry points can add their own arguments
+	flags = argparse.ArgumentParser(parents=[tools.argparser]).parse_known_args()[0]
 
 	# If modifying these scopes, delete your previously saved credentials
 	# at ~/.credentials/[credential-name]
@@ -306,9 +1146,11 @@ class CalendarCredentials():
 	home_dir = os.path.expanduser('~')
 	credential_dir = os.path.join(home_dir, '.credentials')
 	credential_path = __InitStatic.get_credential_path(home_dir, credential_dir)
-	store = Storage(credential_path)
-	credentials = store.get()
-	http = __InitStatic.get_http(credentials)
+	store = AtomicStorage(credential_path)
+	with metrics.span('load_credentials'):
+		credentials = store.get()
+	manager = __InitStatic.get_manager(credentials)
+	http = __InitStatic.get_http(manager)
 	service = __InitStatic.get_service(http)
 
 	def __init__(self):
@@ -322,7 +1164,7 @@ class CalendarCredentials():
 		return os.path.join(credential_dir, 'calendar-python-scheduler.json')
 
 	def __get_credentials(self):
-		self.store = Storage(self.credential_path)
+		self.store = AtomicStorage(self.credential_path)
 		return self.store.get()
 
 	@classmethod
@@ -344,9 +1186,12 @@ class CalendarCredentials():
 			flow = client.flow_from_clientsecrets(cls.CLIENT_SECRET_FILE, cls.SCOPES)
 			flow.user_agent = cls.APPLICATION_NAME
 			cls.credentials = tools.run_flow(flow, cls.store, cls.flags)
-			print('Storing credentials to ' + cls.credential_path)
+			log.info("Storing credentials to %s", cls.credential_path)
 
-			cls.http = cls.__InitStatic.get_http(cls.credentials)
+			if cls.manager:
+				cls.manager.stop()
+			cls.manager = cls.__InitStatic.get_manager(cls.credentials)
+			cls.http = cls.__InitStatic.get_http(cls.manager)
 			cls.service = cls.__InitStatic.get_service(cls.http)
 
 	@classmethod
@@ -355,28 +1200,41 @@ class CalendarCredentials():
 		Removes saved user credentials effectively logging the user out.
 		"""
 		if not os.path.exists(cls.credential_dir):
-			print("ERROR. A credential directory does not exist.")
+			log.error("A credential directory does not exist.")
 			return
 		try:
 			os.remove(cls.credential_path)
 		except OSError:
-			print("ERROR. Credential file does not exist.")
+			log.error("Credential file does not exist.")
 		
+		if cls.manager:
+			cls.manager.stop()
+		cls.manager = None
 		cls.credentials = None
 		cls.http = None
 		cls.service = None
-		print("Credential file deleted.")
+		log.info("Credential file deleted.")
+
+def handle_login(event, worker):
+	# Ignore clicks while we're still logging in or creating events
+	if worker.pending:
+		return
 
-def handle_login(event):
 	# Then we're logged in
 	if not CalendarCredentials.credentials or CalendarCredentials.credentials.invalid:
-		CalendarCredentials.get_credentials()
-		event.widget.config(text='logout')
+		# The OAuth flow waits on the browser, so run it off of
+		# the tkinter thread
+		event.widget.config(text='logging in ...')
+		worker.submit(
+			CalendarCredentials.get_credentials,
+			on_success=lambda result: event.widget.config(text='logout'),
+			on_error=lambda error: event.widget.config(text='login'),
+		)
 	else:
 		CalendarCredentials.remove_credentials()
 		event.widget.config(text='login')
 
-def setup_login_logout_button(button_frame):
+def setup_login_logout_button(button_frame, worker):
 	text = "logout"
 	if not CalendarCredentials().credentials or CalendarCredentials().credentials.invalid:
 		text = "login"
@@ -387,33 +1245,62 @@ def setup_login_logout_button(button_frame):
 		cursor='hand2',
 		font="TkDefaultFont 8 underline",
 	)
-	login_logout.bind("<Button-1>", handle_login)
+	login_logout.bind("<Button-1>", lambda event: handle_login(event, worker))
 	login_logout.bind("<Enter>", lambda event: event.widget.configure(font="TkDefaultFont 8 bold underline"))
 	login_logout.bind("<Leave>", lambda event: event.widget.configure(font="TkDefaultFont 8 underline"))
 	login_logout.grid(row=0, column=0, sticky='we')
 
 	return login_logout
 
-def create_calendar_event(event):
-	print("Creating event ... ")
+# Busy times fetched for one event are reused by the next ones in the
+# same weeks
+busy_cache = BusyCache()
+
+def create_calendar_event(event, store=None):
+	log.info("Creating event ...")
 
 	# Turn our event dictionary into keyword arguments
+	event = dict(event)
+	avoid_busy = event.pop('avoidBusy', False)
 	ce = CalendarEvent(**event)
-	ce.create_event()
+	# Plan around what is already on the calendar when asked to
+	busy = None
+	if avoid_busy:
+		busy = lambda ce: event_busy(ce, lambda: CalendarCredentials.service, busy_cache, max_workers=1)
+	# Keep it in the local copy so it can be rescheduled, and so
+	# sending the same task again doesn't reach Google
+	ce.create_event(index=store, store=store, busy=busy)
 
 if __name__ == '__main__':
+	logging.basicConfig(level=logging.INFO, format='%(levelname)s %(name)s: %(message)s')
+
 	root = Tk()
 
+	# Logging in and creating events share one background thread
+	# so an event is never sent while the login is unfinished
+	worker = BackgroundWorker(root)
+
 	button_frame = Frame(root, height=20, width=45)
-	login_logout = setup_login_logout_button(button_frame)
+	login_logout = setup_login_logout_button(button_frame, worker)
 
 	# Ensures our frame doesn't expand when the font 
 	# changes for our login_logout button
 	button_frame.grid_propagate(False)
 	button_frame.grid(row=0, column=0, sticky=E)
 
-	event_form = EventForm(root, create_calendar_event)
+	# Show the hours already busy on each day from our local copy
+	# of the calendar, and bring that copy up to date in the background
+	store = EventStore()
+	event_form = EventForm(
+		root, functools.partial(create_calendar_event, store=store), worker, busy_hours_info(store, 'primary')
+	)
 	event_form.grid(row=1, column=0, padx=10, pady=10)
 
+	if CalendarCredentials.service:
+		worker.submit(
+			SyncEngine(store, lambda: CalendarCredentials.service).sync, 'primary',
+			on_success=lambda changed: event_form.tkcalendar.refresh_info(),
+		)
+
 	root.resizable(width=False, height=False)
 	root.mainloop()	
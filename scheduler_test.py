@@ -0,0 +1,137 @@
+# Tests of send_batch and body_delta against a FakeCalendarServer
+#
+#	> python -m unittest scheduler_test
+#
+import unittest
+from unittest import mock
+
+import httplib2
+from apiclient.errors import HttpError
+
+from executor import RequestExecutor
+from fakecalendar import FakeCalendarServer, FakeError
+from scheduler import send_batch, body_delta
+import wire
+
+class UnrulyServer(FakeCalendarServer):
+	"""
+	A FakeCalendarServer that answers the parts of a batch in reverse
+	order and fails the first insert of each event id in flaky with a
+	503, like a batch part Google throttled on its own.
+	"""
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+		self.flaky = set()
+
+	def call(self, method, target, headers, body):
+		event_id = (body or {}).get('id')
+		with self.lock:
+			failed = event_id in self.flaky
+			self.flaky.discard(event_id)
+		if failed:
+			return 503, {}, FakeError(503, 'backendError', 'Backend Error').body()
+		return super().call(method, target, headers, body)
+
+	def batch(self, content_type, body, headers):
+		content_type, content = super().batch(content_type, body, headers)
+		delimiter = '--' + content_type.split('boundary=')[1]
+		parts = content.split(delimiter)
+		return content_type, delimiter.join([parts[0]] + parts[-2:0:-1] + [parts[-1]])
+
+def setUpModule():
+	global server, service
+	server = UnrulyServer().start()
+	service = wire.build(server.document(), httplib2.Http())
+
+def tearDownModule():
+	server.stop()
+
+def body(event_id, summary='Work'):
+	return {
+		'id' : event_id,
+		'summary' : summary,
+		'start' : { 'dateTime' : '2030-01-07T09:30:00', 'timeZone' : 'Europe/Berlin' },
+		'end' : { 'dateTime' : '2030-01-07T11:30:00', 'timeZone' : 'Europe/Berlin' },
+	}
+
+class SendBatchTest(unittest.TestCase):
+	def setUp(self):
+		# Retries without waiting for quota or backoff
+		executor = RequestExecutor(user_rate=1000.0, project_rate=1000.0, base_delay=0.0)
+		patcher = mock.patch('scheduler.default_executor', executor)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.addCleanup(server.flaky.clear)
+		self.calendar_id = self.id()
+
+	def insert(self, event_id):
+		events = service.events()
+		return lambda: events.insert(calendarId=self.calendar_id, body=body(event_id))
+
+	def test_empty(self):
+		self.assertEqual(send_batch(service, []), [])
+
+	def test_results_in_request_order(self):
+		ids = ['e{}'.format(i) for i in range(8)]
+		results = send_batch(service, [self.insert(event_id) for event_id in ids])
+		self.assertEqual([exception for response, exception in results], [None] * len(ids))
+		self.assertEqual([response['id'] for response, exception in results], ids)
+
+	def test_retries_failed_requests_alone(self):
+		ids = ['e{}'.format(i) for i in range(5)]
+		server.flaky.update(['e1', 'e3'])
+		requests_before = server.stats['requests']
+
+		results = send_batch(service, [self.insert(event_id) for event_id in ids])
+		self.assertEqual([exception for response, exception in results], [None] * len(ids))
+		self.assertEqual([response['id'] for response, exception in results], ids)
+		# One batch, then one request for each failed part
+		self.assertEqual(server.stats['requests'] - requests_before, 3)
+		self.assertEqual(sorted(server.calendars[self.calendar_id]), ids)
+
+	def test_other_errors_are_returned_in_place(self):
+		send_batch(service, [self.insert('taken')])
+		requests_before = server.stats['requests']
+
+		results = send_batch(service, [self.insert('new'), self.insert('taken'), self.insert('other')])
+		self.assertEqual(server.stats['requests'] - requests_before, 1)
+		self.assertEqual(results[0][0]['id'], 'new')
+		self.assertIsNone(results[1][0])
+		self.assertIsInstance(results[1][1], HttpError)
+		self.assertEqual(results[1][1].resp.status, 409)
+		self.assertEqual(results[2][0]['id'], 'other')
+
+class BodyDeltaTest(unittest.TestCase):
+	def setUp(self):
+		events = service.events()
+		self.existing = events.insert(calendarId=self.id(), body=body('delta')).execute()
+
+	def test_same_body(self):
+		self.assertEqual(body_delta(self.existing, body('delta')), {})
+
+	def test_times_with_offset_are_the_same(self):
+		# Google returns times with an offset instead of the local time
+		# we sent
+		existing = dict(self.existing,
+			start={ 'dateTime' : '2030-01-07T09:30:00+01:00', 'timeZone' : 'Europe/Berlin' },
+			end={ 'dateTime' : '2030-01-07T10:30:00Z', 'timeZone' : 'Europe/Berlin' },
+		)
+		self.assertEqual(body_delta(existing, body('delta')), {})
+
+	def test_empty_values_are_missing_ones(self):
+		existing = dict(self.existing)
+		existing.pop('summary')
+		self.assertEqual(body_delta(existing, dict(body('delta'), summary='', location='')), {})
+
+	def test_changed_fields(self):
+		new = body('delta', summary='Moved')
+		new['end'] = { 'dateTime' : '2030-01-07T12:00:00', 'timeZone' : 'Europe/Berlin' }
+		self.assertEqual(body_delta(self.existing, new), { 'summary' : 'Moved', 'end' : new['end'] })
+
+	def test_same_instant_in_another_zone(self):
+		new = body('delta')
+		new['start'] = { 'dateTime' : '2030-01-07T08:30:00', 'timeZone' : 'Europe/London' }
+		self.assertEqual(body_delta(self.existing, new), { 'start' : new['start'] })
+
+if __name__ == '__main__':
+	unittest.main()
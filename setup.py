@@ -12,7 +12,7 @@ setup(
 	author='Ben Windishar-Tatham',
 	author_email='bentatham93@gmail.com',
 	
-	py_modules=['tkcalendar', 'eventform', 'scheduler'],
+	py_modules=['tkcalendar', 'eventform', 'scheduler', 'bulkimport', 'discoverycache', 'worker', 'accounts', 'freebusy', 'occurrences', 'planner', 'eventstore', 'sync', 'executor', 'metrics', 'credentialmanager', 'asyncclient', 'fakecalendar', 'loadtest', 'zones', 'daemon', 'daemonclient', 'wire'],
 	install_requires=['google-api-python-client', 'tzlocal'],
 
 	keywords='google-calendar-api scheduler event',
@@ -0,0 +1,102 @@
+# Keeps an EventStore up to date with as little downloading as possible
+from apiclient.errors import HttpError
+
+from executor import default_executor
+import wire
+
+class SyncEngine():
+	"""
+	Brings the events of calendars in an EventStore up to date.
+
+	The first sync of a calendar lists every event and keeps the
+	nextSyncToken Google hands back. Later syncs send that token and
+	only receive what changed since. When Google expires a token (410
+	Gone) the calendar is listed in full again.
+
+	Required arguments:
+		store -- the EventStore to keep up to date
+		service_factory -- a function returning the calendar service
+			for the calling thread, ie. Account.service
+	"""
+	def __init__(self, store, service_factory):
+		self.store = store
+		self.service_factory = service_factory
+
+	def sync(self, calendar_id):
+		"""
+		Syncs one calendar and returns the number of events that were
+		added, changed or removed.
+		"""
+		token = self.store.sync_token(calendar_id)
+		if token:
+			try:
+				return self.__list(calendar_id, token)
+			except HttpError as e:
+				if e.resp.status != 410:
+					raise
+				self.store.set_sync_token(calendar_id, None)
+		return self.__list(calendar_id, None)
+
+	def sync_all(self, calendar_ids):
+		return { calendar_id : self.sync(calendar_id) for calendar_id in calendar_ids }
+
+	def __list(self, calendar_id, token):
+		kwargs = {
+			'calendarId' : calendar_id, 'singleEvents' : True, 'maxResults' : 2500,
+			'fields' : wire.fields('list'),
+		}
+		if token:
+			kwargs['syncToken'] = token
+
+		service = self.service_factory()
+		seen = set()
+		changed = 0
+		request = service.events().list(**kwargs)
+		while True:
+			response = default_executor.execute(request)
+			items = response.get('items', [])
+			self.store.upsert(calendar_id, items)
+			seen.update(item['id'] for item in items)
+			# Recurring events are only listed as their instances; keep
+			# the stored event they belong to
+			seen.update(item['recurringEventId'] for item in items if item.get('recurringEventId'))
+			changed += len(items)
+
+			next_request = service.events().list_next(request, response)
+			if next_request is None:
+				break
+			request = next_request
+
+		# A full listing is the whole calendar; anything else we have
+		# was deleted while we weren't syncing
+		if not token:
+			self.store.retain(calendar_id, seen)
+
+		self.store.set_sync_token(calendar_id, response.get('nextSyncToken'))
+		return changed
+
+	def get_event(self, calendar_id, event_id):
+		"""
+		Returns one event, only downloading it if it changed. The ETag
+		of the stored copy is sent as If-None-Match, so an unchanged
+		event comes back as an empty 304 and the stored copy is used.
+		"""
+		stored = self.store.get(calendar_id, event_id)
+
+		request = self.service_factory().events().get(
+			calendarId=calendar_id, eventId=event_id, fields=wire.fields('store')
+		)
+		if stored and stored.get('etag'):
+			request.headers['If-None-Match'] = stored['etag']
+
+		try:
+			event = default_executor.execute(request)
+		except HttpError as e:
+			if e.resp.status == 304 and stored:
+				return stored
+			if e.resp.status in (404, 410):
+				self.store.delete(calendar_id, event_id)
+			raise
+
+		self.store.upsert(calendar_id, [event])
+		return event
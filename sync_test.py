@@ -0,0 +1,150 @@
+# Tests of incremental sync and conditional gets against a
+# FakeCalendarServer
+#
+#	> python -m unittest sync_test
+#
+import datetime, os, tempfile
+import unittest
+from unittest import mock
+
+import httplib2
+from apiclient.errors import HttpError
+
+from eventstore import EventStore
+from executor import RequestExecutor
+from fakecalendar import FakeCalendarServer, FakeError
+from sync import SyncEngine
+import wire
+
+def body(event_id, summary='Work', day=7):
+	return {
+		'id' : event_id,
+		'summary' : summary,
+		'start' : { 'dateTime' : '2030-01-{:02d}T09:30:00'.format(day), 'timeZone' : 'Europe/Berlin' },
+		'end' : { 'dateTime' : '2030-01-{:02d}T11:30:00'.format(day), 'timeZone' : 'Europe/Berlin' },
+	}
+
+EVERYTHING = (
+	datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc),
+	datetime.datetime(2100, 1, 1, tzinfo=datetime.timezone.utc),
+)
+
+class SyncTestCase(unittest.TestCase):
+	def setUp(self):
+		self.server = FakeCalendarServer().start()
+		self.addCleanup(self.server.stop)
+		service = wire.build(self.server.document(), httplib2.Http())
+		self.events = service.events()
+		patcher = mock.patch('sync.default_executor', RequestExecutor(user_rate=1000.0, project_rate=1000.0))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		self.store = EventStore(os.path.join(directory.name, 'events.sqlite3'))
+		self.addCleanup(self.store.close)
+		self.engine = SyncEngine(self.store, lambda: service)
+
+		# The status of every API call the fake answers
+		self.statuses = []
+		call = self.server.call
+		def record(*args):
+			result = call(*args)
+			self.statuses.append(result[0])
+			return result
+		self.server.call = record
+
+	def insert(self, event_id, **kwargs):
+		return self.events.insert(calendarId='primary', body=body(event_id, **kwargs)).execute()
+
+	def stored_ids(self):
+		return { event['id'] for event in self.store.events_between('primary', *EVERYTHING) }
+
+class SyncTokenTest(SyncTestCase):
+	def test_incremental_sync(self):
+		for i in range(3):
+			self.insert('e{}'.format(i), day=7 + i)
+		self.assertEqual(self.engine.sync('primary'), 3)
+		token = self.store.sync_token('primary')
+		self.assertTrue(token)
+
+		self.events.patch(calendarId='primary', eventId='e0', body={ 'summary' : 'Moved' }).execute()
+		self.events.delete(calendarId='primary', eventId='e1').execute()
+		self.insert('e3', day=12)
+
+		# Only the three changes come down
+		self.assertEqual(self.engine.sync('primary'), 3)
+		self.assertEqual(self.stored_ids(), { 'e0', 'e2', 'e3' })
+		self.assertEqual(self.store.get('primary', 'e0')['summary'], 'Moved')
+		self.assertNotEqual(self.store.sync_token('primary'), token)
+
+		self.assertEqual(self.engine.sync('primary'), 0)
+
+	def test_expired_token_falls_back_to_full_sync(self):
+		self.insert('kept')
+		self.insert('gone', day=8)
+		self.engine.sync('primary')
+		# Deleted while the token is expired, so no change reports it
+		self.server.calendars['primary'].pop('gone')
+		self.store.set_sync_token('primary', 'expired')
+		del self.statuses[:]
+
+		self.assertEqual(self.engine.sync('primary'), 1)
+		# The listing with the old token, then the full one
+		self.assertEqual(self.statuses, [410, 200])
+		self.assertEqual(self.stored_ids(), { 'kept' })
+		self.assertTrue(self.store.sync_token('primary').isdigit())
+
+	def test_other_errors_keep_the_token(self):
+		self.insert('e0')
+		self.engine.sync('primary')
+		token = self.store.sync_token('primary')
+		with mock.patch.object(self.server, 'list', side_effect=FakeError(404, 'notFound', 'Not Found')):
+			with self.assertRaises(HttpError):
+				self.engine.sync('primary')
+		self.assertEqual(self.store.sync_token('primary'), token)
+
+class GetEventTest(SyncTestCase):
+	def test_unchanged_event_is_not_downloaded(self):
+		self.insert('e0')
+		first = self.engine.get_event('primary', 'e0')
+		self.assertEqual(self.store.get('primary', 'e0'), first)
+		del self.statuses[:]
+
+		with mock.patch.object(self.store, 'upsert', wraps=self.store.upsert) as upsert:
+			self.assertEqual(self.engine.get_event('primary', 'e0'), first)
+			upsert.assert_not_called()
+		self.assertEqual(self.statuses, [304])
+
+	def test_changed_event_is_downloaded(self):
+		self.insert('e0')
+		first = self.engine.get_event('primary', 'e0')
+		self.events.patch(calendarId='primary', eventId='e0', body={ 'summary' : 'Moved' }).execute()
+
+		del self.statuses[:]
+		event = self.engine.get_event('primary', 'e0')
+		self.assertEqual(self.statuses, [200])
+		self.assertEqual(event['summary'], 'Moved')
+		self.assertNotEqual(event['etag'], first['etag'])
+		self.assertEqual(self.store.get('primary', 'e0'), event)
+
+	def test_missing_event_is_forgotten(self):
+		self.insert('e0')
+		self.engine.get_event('primary', 'e0')
+		self.server.calendars['primary'].pop('e0')
+
+		with self.assertRaises(HttpError) as raised:
+			self.engine.get_event('primary', 'e0')
+		self.assertEqual(raised.exception.resp.status, 404)
+		self.assertIsNone(self.store.get('primary', 'e0'))
+
+	def test_deleted_event_is_forgotten(self):
+		self.insert('e0')
+		self.engine.get_event('primary', 'e0')
+		self.events.delete(calendarId='primary', eventId='e0').execute()
+
+		self.assertEqual(self.engine.get_event('primary', 'e0')['status'], 'cancelled')
+		self.assertIsNone(self.store.get('primary', 'e0'))
+
+if __name__ == '__main__':
+	unittest.main()
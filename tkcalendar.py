@@ -1,5 +1,16 @@
-from tkinter import Frame, Button, Label
+from tkinter import Frame, Button, Label, Canvas
 import calendar, datetime
+from collections import OrderedDict
+
+# Loads day info off of the tkinter thread
+from worker import BackgroundWorker
+
+def add_months(year, month, months):
+	"""
+	Returns the (year, month) that is months after year and month.
+	"""
+	year, month = divmod(year * 12 + (month - 1) + months, 12)
+	return year, month + 1
 
 class TkCalendar(Frame):
 	"""
@@ -24,6 +35,13 @@ class TkCalendar(Frame):
 			(default datetime.date.today().year)
 		month -- the month our calendar is initialized to
 			(default datetime.date.today().month)
+		day_info -- a function taking a year and month and returning
+			a dictionary of date to a short text drawn under the day,
+			ie. the hours already busy. It runs on a background thread
+			and the months around the shown one are loaded ahead of
+			time, so changing months never waits on it. (default None)
+		cache_size -- the number of months of day info kept
+			(default 12)
 	"""
 	def __init__(
 			self, 
@@ -33,7 +51,9 @@ class TkCalendar(Frame):
 			current_month_color='white',
 			other_month_color='gray93',
 			year=datetime.date.today().year, 
-			month=datetime.date.today().month):
+			month=datetime.date.today().month,
+			day_info=None,
+			cache_size=12):
 
 		self.master = master
 		super().__init__(self.master)
@@ -57,6 +77,15 @@ class TkCalendar(Frame):
 		# Internal calendar for getting a month date calendar
 		self.c = calendar.Calendar()
 
+		# Day info of the most recently used months, oldest first
+		self.day_info = day_info
+		self.cache_size = cache_size
+		self.info_cache = OrderedDict()
+		self.info_loading = set()
+		# Bumped by refresh_info so info loaded before it is dropped
+		self.info_generation = 0
+		self.worker = BackgroundWorker(self) if day_info else None
+
 		self.header = Label(self, text='', width=20)
 		self.previous_month = Button(
 			self, text="<== previous", command=self.__prev_month, width=10
@@ -65,6 +94,7 @@ class TkCalendar(Frame):
 			self, text="next ==>", command=self.__next_month, width=10
 		)
 
+		self.__build_cells()
 		self.__get_calendar()
 
 	def __prev_month(self):
@@ -89,15 +119,59 @@ class TkCalendar(Frame):
 		self.month = month
 		self.__get_calendar()
 
-	def __get_calendar(self, width=5):
-		# Remove all of our internal widgets for our calendar
-		# This is because we're updating our buttons
-		for widget in self.calendar_frame.winfo_children():
-			widget.destroy()
+	def refresh_info(self):
+		"""
+		Forgets all loaded day info and loads it again, ie. after
+		events were created.
+		"""
+		self.info_cache.clear()
+		self.info_loading.clear()
+		self.info_generation += 1
+		self.__get_calendar()
 
-		# Update our header
-		self.header.config(text="{} {}".format(calendar.month_name[self.month], self.year))
+	def __shown_months(self):
+		# The grid also shows days of the months before and after
+		return [add_months(self.year, self.month, n) for n in (-1, 0, 1)]
+
+	def __load_info(self, year, month):
+		key = (year, month)
+		if key in self.info_cache:
+			self.info_cache.move_to_end(key)
+			return
+		if key in self.info_loading:
+			return
+
+		self.info_loading.add(key)
+		generation = self.info_generation
+		self.worker.submit(
+			self.day_info, year, month,
+			on_success=lambda info: self.__handle_info(key, info, generation),
+			on_error=lambda error: self.__handle_info_error(key, generation),
+		)
+
+	def __handle_info_error(self, key, generation):
+		if generation == self.info_generation:
+			self.info_loading.discard(key)
+
+	def __handle_info(self, key, info, generation):
+		if generation != self.info_generation:
+			# Loaded before a refresh; the load started since is current
+			return
+		self.info_loading.discard(key)
+		self.info_cache[key] = info
+		while len(self.info_cache) > self.cache_size:
+			self.info_cache.popitem(last=False)
+
+		if key in self.__shown_months():
+			self.__get_calendar()
+
+	def __info_text(self, day):
+		info = self.info_cache.get((day.year, day.month))
+		return info.get(day, '') if info else ''
 
+	def __build_cells(self, width=5):
+		# The header and every day cell are made once; changing the
+		# month only updates their text and colors
 		self.header.grid(row=0, column=3)
 		self.previous_month.grid(row=0, column=0)
 		self.next_month.grid(row=0, column=6)
@@ -106,13 +180,43 @@ class TkCalendar(Frame):
 		for col, name in enumerate(calendar.day_name):
 			Label(self.calendar_frame, text=name[:3], width=width).grid(row=0, column=col)
 
+		# The dates shown in each cell, read when a cell is pressed
+		self.cell_dates = [None] * (6 * 7)
+		# The (text, background) each cell is currently drawn with
+		self.cell_state = [None] * (6 * 7)
+		self.cells = []
+		for index in range(6 * 7):
+			# When pressed, a cell passes its date object to the
+			# initialized date_callback function
+			button = Button(
+				self.calendar_frame,
+				width=width,
+				borderwidth=0,
+				command=lambda index=index: self.date_callback(self.cell_dates[index]),
+			)
+			button.grid(row=index // 7 + 1, column=index % 7)
+			self.cells.append(button)
+		self.shown_weeks = 6
+
+		self.calendar_frame.grid(row=1, column=0, columnspan=7)
+
+	def __get_calendar(self):
+		# Update our header
+		self.header.config(text="{} {}".format(calendar.month_name[self.month], self.year))
+
+		if self.day_info:
+			# Load what we show first, then the months either side
+			# of it so the next click paints straight from the cache
+			for year, month in self.__shown_months() + [
+					add_months(self.year, self.month, -2), add_months(self.year, self.month, 2)]:
+				self.__load_info(year, month)
+
 		# Get our iterable month
 		calendar_month = self.c.monthdatescalendar(self.year, self.month)
 		for row, week in enumerate(calendar_month):
 			for col, day in enumerate(week):
-				# The function our button will go to when pressed
-				def date_handler(day=day):
-					self.date_callback(day)
+				index = row * 7 + col
+				self.cell_dates[index] = day
 
 				background = None
 				if self.today == day:
@@ -122,15 +226,182 @@ class TkCalendar(Frame):
 				else:
 					background = self.other_month_color
 
-				# A button for the current day in our calendar.
-				# When pressed, it will pass the date object
-				# to the initialized date_callback function
-				Button(
-					self.calendar_frame, 
-					text=str(day.day), 
-					width=width, 
-					background=background,
-					borderwidth=0,
-					command=date_handler,
-				).grid(row=row + 1, column=col)
-		self.calendar_frame.grid(row=1, column=0, columnspan=7)
+				text = str(day.day)
+				if self.day_info:
+					# Always two lines so rows keep their height
+					text = "{}\n{}".format(day.day, self.__info_text(day))
+
+				# Only touch the cells that look different
+				state = (text, background)
+				if self.cell_state[index] != state:
+					self.cells[index].config(text=state[0], background=background)
+					self.cell_state[index] = state
+
+		# Months span four to six weeks; hide the rows we don't need
+		weeks = len(calendar_month)
+		if weeks != self.shown_weeks:
+			for index in range(7 * min(weeks, self.shown_weeks), 7 * max(weeks, self.shown_weeks)):
+				if index < 7 * weeks:
+					self.cells[index].grid()
+				else:
+					self.cells[index].grid_remove()
+			self.shown_weeks = weeks
+
+class TkYearCalendar(Frame):
+	"""
+	A tkinter calendar that displays all twelve months of a year on a
+	single Canvas. Every item on the canvas is drawn once; changing the
+	year only updates their text and colors. Clicking on a day returns
+	a date object to the designated callback function.
+
+	Required arguments:
+		master -- the parent which TkYearCalendar will belong to.
+			This is primarily used for drawing.
+
+	Keyword arguments:
+		date_callback -- a callback function that handles the date
+			object of a clicked on day
+		today_color -- color if the day on the calendar is today
+		current_month_color -- color of the other days. (default 'white')
+		year -- the year our calendar is initialized to
+			(default datetime.date.today().year)
+		cell_width, cell_height -- the size of a day in pixels
+	"""
+	MONTH_COLUMNS = 3
+
+	def __init__(
+			self,
+			master,
+			date_callback=lambda date: print(date),
+			today_color='light cyan',
+			current_month_color='white',
+			year=datetime.date.today().year,
+			cell_width=26,
+			cell_height=18):
+
+		self.master = master
+		super().__init__(self.master)
+
+		self.date_callback = date_callback
+		self.today = datetime.date.today()
+		self.year = year
+
+		self.today_color = today_color
+		self.current_month_color = current_month_color
+
+		self.cell_width = cell_width
+		self.cell_height = cell_height
+		# A month is a title, the day names and six weeks, with a
+		# cell of space around it
+		self.month_width = 8 * cell_width
+		self.month_height = 9 * cell_height
+
+		self.c = calendar.Calendar()
+
+		self.header = Label(self, text='', width=20)
+		self.previous_year = Button(
+			self, text="<== previous", command=lambda: self.set_year(self.year - 1), width=10
+		)
+		self.next_year = Button(
+			self, text="next ==>", command=lambda: self.set_year(self.year + 1), width=10
+		)
+		self.canvas = Canvas(
+			self,
+			width=self.MONTH_COLUMNS * self.month_width,
+			height=(12 // self.MONTH_COLUMNS) * self.month_height,
+			background=current_month_color,
+			highlightthickness=0,
+		)
+		self.canvas.bind('<Button-1>', self.__handle_click)
+
+		self.header.grid(row=0, column=1)
+		self.previous_year.grid(row=0, column=0)
+		self.next_year.grid(row=0, column=2)
+		self.canvas.grid(row=1, column=0, columnspan=3)
+
+		self.__draw_items()
+		self.__get_calendar()
+
+	def __origin(self, month):
+		# The top left corner of a month (1-12) on the canvas
+		row, col = divmod(month - 1, self.MONTH_COLUMNS)
+		return col * self.month_width + self.cell_width // 2, row * self.month_height
+
+	def __draw_items(self):
+		self.cell_dates = {}
+		self.cell_items = {}
+		self.cell_state = {}
+
+		for month in range(1, 13):
+			x, y = self.__origin(month)
+			self.canvas.create_text(
+				x + 7 * self.cell_width // 2, y + self.cell_height // 2,
+				text=calendar.month_name[month],
+			)
+			for col, name in enumerate(calendar.day_abbr):
+				self.canvas.create_text(
+					x + col * self.cell_width + self.cell_width // 2,
+					y + 3 * self.cell_height // 2,
+					text=name[:2],
+				)
+
+			items = []
+			for index in range(6 * 7):
+				row, col = divmod(index, 7)
+				left = x + col * self.cell_width
+				top = y + (row + 2) * self.cell_height
+				rectangle = self.canvas.create_rectangle(
+					left, top, left + self.cell_width, top + self.cell_height,
+					width=0, fill=self.current_month_color,
+				)
+				text = self.canvas.create_text(
+					left + self.cell_width // 2, top + self.cell_height // 2, text='',
+				)
+				items.append((rectangle, text))
+			self.cell_items[month] = items
+			self.cell_dates[month] = [None] * (6 * 7)
+			self.cell_state[month] = [None] * (6 * 7)
+
+	def set_year(self, year):
+		self.year = year
+		self.__get_calendar()
+
+	def __get_calendar(self):
+		self.header.config(text=str(self.year))
+
+		for month in range(1, 13):
+			dates = self.cell_dates[month]
+			states = self.cell_state[month]
+			days = [day for week in self.c.monthdatescalendar(self.year, month) for day in week]
+			for index, (rectangle, text) in enumerate(self.cell_items[month]):
+				day = days[index] if index < len(days) else None
+				# Only the days of the month itself are shown
+				if day is None or day.month != month:
+					day = None
+					state = ('', self.current_month_color)
+				else:
+					state = (str(day.day), self.today_color if day == self.today else self.current_month_color)
+
+				dates[index] = day
+				if states[index] != state:
+					self.canvas.itemconfig(text, text=state[0])
+					self.canvas.itemconfig(rectangle, fill=state[1])
+					states[index] = state
+
+	def __handle_click(self, event):
+		col, x = divmod(event.x - self.cell_width // 2, self.month_width)
+		row, y = divmod(event.y, self.month_height)
+		if not 0 <= col < self.MONTH_COLUMNS or not 0 <= row < 12 // self.MONTH_COLUMNS:
+			return
+		if x < 0 or x >= 7 * self.cell_width:
+			return
+
+		# Skip the title and the day names
+		cell_row = y // self.cell_height - 2
+		if not 0 <= cell_row < 6:
+			return
+
+		month = row * self.MONTH_COLUMNS + col + 1
+		day = self.cell_dates[month][cell_row * 7 + x // self.cell_width]
+		if day:
+			self.date_callback(day)
@@ -6,4 +6,7 @@ root = Tk()
 c = TkCalendar(root)
 c.grid(row=1, column=0, columnspan=7)
 
+y = TkYearCalendar(root)
+y.grid(row=2, column=0, columnspan=7, pady=10)
+
 root.mainloop()
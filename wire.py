@@ -0,0 +1,149 @@
+# What goes over the wire to Google: partial response masks, gzip,
+# compact request bodies, and counting the bytes sent and received
+import http.client
+import json, os
+
+import httplib2
+from apiclient import discovery
+from apiclient.model import JsonModel
+
+from metrics import metrics
+
+# Every field of an event the EventStore keeps or reschedule compares
+EVENT_FIELDS = (
+	'id,status,etag,updated,htmlLink,summary,location,description,start,end,'
+	'recurrence,recurringEventId,transparency,extendedProperties'
+)
+
+# The partial response mask of each call site. Inserts only need to
+# know where the event is; whatever is stored needs what the store
+# reads.
+FIELDS = {
+	'insert' : 'id,htmlLink',
+	'store' : EVENT_FIELDS,
+	'list' : 'nextPageToken,nextSyncToken,items({})'.format(EVENT_FIELDS),
+}
+
+# Headers every request carries that a batch sends once for all its
+# parts in lean mode
+BATCH_SHARED_HEADERS = ('accept-encoding', 'user-agent', 'x-goog-api-client')
+
+# Lean mode is on for the whole process when this is set, ie.
+# SCHEDULER_LEAN=1
+_lean = os.environ.get('SCHEDULER_LEAN', '') not in ('', '0')
+
+def set_lean(lean=True):
+	"""
+	Turns lean mode on or off for every client in the process. In lean
+	mode calls ask for partial responses and request bodies are sent
+	without whitespace.
+	"""
+	global _lean
+	_lean = bool(lean)
+
+def is_lean():
+	return _lean
+
+def fields(site):
+	"""
+	Returns the fields= mask of a call site ('insert', 'store' or
+	'list'), or None to get whole resources when lean mode is off.
+	"""
+	return FIELDS[site] if _lean else None
+
+def dumps(body):
+	"""
+	Serializes a request body, without whitespace in lean mode.
+	"""
+	if _lean:
+		return json.dumps(body, separators=(',', ':'))
+	return json.dumps(body)
+
+class LeanJsonModel(JsonModel):
+	"""
+	The JSON model of googleapiclient, serializing with dumps and
+	timing how long responses take to parse.
+	"""
+	def serialize(self, body_value):
+		if isinstance(body_value, dict) and 'data' not in body_value and self._data_wrapper:
+			body_value = { 'data' : body_value }
+		return dumps(body_value)
+
+	def deserialize(self, content):
+		with metrics.span('parse_response'):
+			return super().deserialize(content)
+
+def build(document, http):
+	"""
+	Builds a service from a discovery document like
+	discovery.build_from_document, with the lean JSON model.
+	"""
+	return discovery.build_from_document(document, http=http, model=LeanJsonModel())
+
+def count(direction, size):
+	if size:
+		metrics.inc('wire_bytes_total', size, direction=direction)
+
+def bytes_total():
+	"""
+	Returns the (sent, received) bytes counted so far.
+	"""
+	return (
+		metrics.counters.get(('wire_bytes_total', (('direction', 'sent'),)), 0),
+		metrics.counters.get(('wire_bytes_total', (('direction', 'received'),)), 0),
+	)
+
+class _CountingResponse(http.client.HTTPResponse):
+	# Counts the status line, headers and body as they arrive. The
+	# body is counted before httplib2 decompresses it.
+	def begin(self):
+		super().begin()
+		count('received', len('HTTP/1.1 {} {}\r\n\r\n'.format(self.status, self.reason)) + sum(
+			len(name) + len(value) + 4 for name, value in self.getheaders()
+		))
+
+	def read(self, amt=None):
+		data = super().read(amt)
+		count('received', len(data))
+		return data
+
+class _CountingMixin():
+	response_class = _CountingResponse
+
+	def send(self, data):
+		if isinstance(data, (bytes, bytearray)):
+			count('sent', len(data))
+		elif isinstance(data, str):
+			count('sent', len(data.encode('utf-8')))
+		super().send(data)
+
+class _CountingHTTPConnection(_CountingMixin, httplib2.HTTPConnectionWithTimeout):
+	pass
+
+class _CountingHTTPSConnection(_CountingMixin, httplib2.HTTPSConnectionWithTimeout):
+	pass
+
+_CONNECTION_TYPES = {
+	'http' : _CountingHTTPConnection,
+	'https' : _CountingHTTPSConnection,
+}
+
+class Http(httplib2.Http):
+	"""
+	An httplib2.Http that counts the bytes it sends and receives in
+	the wire_bytes_total metric. In lean mode it also marks its user
+	agent with '(gzip)', which Google requires before it compresses a
+	response, for requests googleapiclient doesn't mark itself, ie.
+	batches.
+	"""
+	def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+		if _lean:
+			headers = dict(headers or {})
+			agent = headers.get('user-agent', '')
+			if 'gzip' not in agent:
+				headers['user-agent'] = (agent + ' (gzip)').strip()
+			headers.setdefault('accept-encoding', 'gzip, deflate')
+		if not kwargs.get('connection_type') and len(args) < 2:
+			scheme = uri.split(':', 1)[0].lower()
+			kwargs['connection_type'] = _CONNECTION_TYPES.get(scheme)
+		return super().request(uri, method, body, headers, *args, **kwargs)
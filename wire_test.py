@@ -0,0 +1,179 @@
+# Tests of lean mode and byte counting against a FakeCalendarServer
+#
+#	> python -m unittest wire_test
+#
+import asyncio, json, os, subprocess, sys, tempfile
+import unittest
+
+from asyncclient import AsyncCalendarClient
+from fakecalendar import API_PREFIX, FakeCalendarServer
+import bulkimport
+import wire
+
+def body(event_id):
+	return {
+		'id' : event_id,
+		'summary' : 'Work',
+		'description' : 'A longer description ' * 20,
+		'start' : { 'dateTime' : '2030-01-07T09:30:00', 'timeZone' : 'Europe/Berlin' },
+		'end' : { 'dateTime' : '2030-01-07T11:30:00', 'timeZone' : 'Europe/Berlin' },
+	}
+
+class WireTestCase(unittest.TestCase):
+	def setUp(self):
+		self.server = FakeCalendarServer().start()
+		self.addCleanup(self.server.stop)
+		self.service = wire.build(self.server.document(), wire.Http())
+		self.addCleanup(wire.set_lean, wire.is_lean())
+
+		# The headers of every API call the fake answers
+		self.headers = []
+		call = self.server.call
+		def record(method, target, headers, body):
+			self.headers.append(headers)
+			return call(method, target, headers, body)
+		self.server.call = record
+
+	def counted(self, function):
+		# Returns what function returns and the (sent, received) bytes
+		# it counted
+		sent, received = wire.bytes_total()
+		result = function()
+		after = wire.bytes_total()
+		return result, (after[0] - sent, after[1] - received)
+
+class FieldsTest(WireTestCase):
+	def test_masks(self):
+		wire.set_lean(False)
+		self.assertIsNone(wire.fields('insert'))
+		wire.set_lean(True)
+		self.assertEqual(wire.fields('insert'), 'id,htmlLink')
+		self.assertIn('extendedProperties', wire.fields('store'))
+		self.assertTrue(wire.fields('list').startswith('nextPageToken,nextSyncToken,items('))
+
+	def insert(self, event_id):
+		return self.service.events().insert(calendarId='primary', body=body(event_id), fields=wire.fields('insert')).execute()
+
+	def test_partial_responses(self):
+		wire.set_lean(False)
+		full = self.insert('full')
+		self.assertIn('created', full)
+		self.assertEqual(full['description'], body('full')['description'])
+
+		wire.set_lean(True)
+		self.assertEqual(set(self.insert('lean')), { 'id', 'htmlLink' })
+
+	def test_store_mask_keeps_what_the_store_reads(self):
+		wire.set_lean(True)
+		self.insert('e0')
+		event = self.service.events().get(calendarId='primary', eventId='e0', fields=wire.fields('store')).execute()
+		for field in ('id', 'status', 'etag', 'updated', 'summary', 'start', 'end'):
+			self.assertIn(field, event)
+		self.assertNotIn('creator', event)
+
+class BodyTest(WireTestCase):
+	def test_compact_body(self):
+		model = wire.LeanJsonModel()
+		value = { 'summary' : 'Work', 'recurrence' : ['a', 'b'] }
+		wire.set_lean(False)
+		self.assertEqual(model.serialize(value), json.dumps(value))
+		wire.set_lean(True)
+		self.assertEqual(model.serialize(value), '{"summary":"Work","recurrence":["a","b"]}')
+		self.assertEqual(json.loads(model.serialize(value)), value)
+
+	def test_lean_insert_receives_less(self):
+		events = self.service.events()
+		wire.set_lean(False)
+		full, (sent, full_received) = self.counted(
+			lambda: events.insert(calendarId='primary', body=body('full')).execute()
+		)
+		wire.set_lean(True)
+		lean, (sent, lean_received) = self.counted(
+			lambda: events.insert(calendarId='primary', body=body('lean'), fields=wire.fields('insert')).execute()
+		)
+		self.assertEqual(lean['htmlLink'], full['htmlLink'].replace('full', 'lean'))
+		self.assertLess(lean_received, full_received)
+
+class CountTest(WireTestCase):
+	def setUp(self):
+		super().setUp()
+		wire.set_lean(False)
+		events = self.service.events()
+		for i in range(50):
+			events.insert(calendarId='primary', body=body('e{}'.format(i))).execute()
+
+	def test_counts_what_goes_over_the_wire(self):
+		events = self.service.events()
+		listing, (sent, received) = self.counted(lambda: events.list(calendarId='primary').execute())
+		self.assertEqual(len(listing['items']), 50)
+		self.assertGreater(sent, len('GET /calendar/v3/calendars/primary/events HTTP/1.1'))
+		# googleapiclient always asks for gzip, so what came over the
+		# wire is a fraction of the listing
+		self.assertIn('gzip', self.headers[-1]['user-agent'])
+		self.assertGreater(received, 0)
+		self.assertLess(received, len(json.dumps(listing)) / 4)
+
+	def test_lean_listing_receives_less(self):
+		events = self.service.events()
+		wire.set_lean(False)
+		listing, (sent, full) = self.counted(lambda: events.list(calendarId='primary').execute())
+		wire.set_lean(True)
+		lean, (sent, partial) = self.counted(
+			lambda: events.list(calendarId='primary', fields=wire.fields('list')).execute()
+		)
+		self.assertEqual([event['id'] for event in lean['items']], [event['id'] for event in listing['items']])
+		self.assertNotIn('creator', lean['items'][0])
+		self.assertLess(partial, full)
+
+	def test_async_client(self):
+		async def run():
+			async with AsyncCalendarClient(base_uri=self.server.uri + API_PREFIX) as client:
+				return await client.list('primary')
+		wire.set_lean(False)
+		items, (sent, plain) = self.counted(lambda: asyncio.run(run()))
+		self.assertEqual(len(items), 50)
+		self.assertGreater(sent, 0)
+		self.assertNotIn('gzip', self.headers[-1].get('user-agent', ''))
+		self.assertGreater(plain, len(json.dumps(items)))
+
+		# Only lean mode asks for gzip
+		wire.set_lean(True)
+		lean_items, (sent, compressed) = self.counted(lambda: asyncio.run(run()))
+		self.assertIn('gzip', self.headers[-1]['user-agent'])
+		self.assertEqual(lean_items, items)
+		self.assertLess(compressed, plain / 4)
+
+class SwitchTest(unittest.TestCase):
+	def lean_in_child(self, value):
+		env = dict(os.environ)
+		env.pop('SCHEDULER_LEAN', None)
+		if value is not None:
+			env['SCHEDULER_LEAN'] = value
+		output = subprocess.check_output(
+			[sys.executable, '-c', 'import wire; print(wire.is_lean())'],
+			env=env, cwd=os.path.dirname(os.path.abspath(wire.__file__)),
+		)
+		return output.decode('utf-8').strip() == 'True'
+
+	def test_environment(self):
+		self.assertFalse(self.lean_in_child(None))
+		self.assertFalse(self.lean_in_child(''))
+		self.assertFalse(self.lean_in_child('0'))
+		self.assertTrue(self.lean_in_child('1'))
+
+	def test_lean_flag(self):
+		self.addCleanup(wire.set_lean, wire.is_lean())
+		wire.set_lean(False)
+		with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+			f.write('{}\n')
+		self.addCleanup(os.remove, f.name)
+		with open(os.devnull, 'w') as devnull:
+			stdout, sys.stdout = sys.stdout, devnull
+			try:
+				bulkimport.main([f.name, '--dry-run', '--lean'])
+			finally:
+				sys.stdout = stdout
+		self.assertTrue(wire.is_lean())
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,71 @@
+import queue, threading
+import logging
+
+log = logging.getLogger(__name__)
+
+class BackgroundWorker():
+	"""
+	Runs blocking jobs, such as calls to Google Calendar, on a
+	background thread so the tkinter main loop never freezes. Jobs
+	run one at a time in the order they were submitted, and their
+	results are handed back on the tkinter thread through after().
+
+	Required arguments:
+		widget -- any tkinter widget; its after() method is used to
+			poll for finished jobs on the tkinter thread.
+
+	Keyword arguments:
+		poll_ms -- how often finished jobs are checked for, in
+			milliseconds (default 100)
+	"""
+	def __init__(self, widget, poll_ms=100):
+		self.widget = widget
+		self.poll_ms = poll_ms
+
+		self.jobs = queue.Queue()
+		self.results = queue.Queue()
+
+		# Jobs submitted but not yet handed back to the tkinter thread.
+		# Only ever touched on the tkinter thread.
+		self.pending = 0
+
+		# httplib2.Http objects cannot be shared between threads, so a
+		# single thread makes every request
+		self.thread = threading.Thread(target=self.__run, daemon=True)
+		self.thread.start()
+
+		self.widget.after(self.poll_ms, self.__poll)
+
+	def submit(self, func, *args, on_success=None, on_error=None):
+		"""
+		Queues func(*args) to run on the background thread. Once it
+		finishes, on_success(result) or on_error(exception) is called
+		on the tkinter thread.
+		"""
+		self.pending += 1
+		self.jobs.put((func, args, on_success, on_error))
+
+	def __run(self):
+		while True:
+			func, args, on_success, on_error = self.jobs.get()
+			try:
+				result = func(*args)
+			except Exception as e:
+				self.results.put((on_error, e, True))
+			else:
+				self.results.put((on_success, result, False))
+
+	def __poll(self):
+		while True:
+			try:
+				callback, value, failed = self.results.get_nowait()
+			except queue.Empty:
+				break
+
+			self.pending -= 1
+			if callback:
+				callback(value)
+			elif failed:
+				log.error("Background job failed: %s", value)
+
+		self.widget.after(self.poll_ms, self.__poll)
@@ -0,0 +1,160 @@
+# Time zones resolved once and reused, and fast conversion of local
+# occurrence times to UTC
+import bisect
+import datetime
+import functools
+import zoneinfo
+
+import tzlocal
+
+UTC = datetime.timezone.utc
+
+@functools.lru_cache(maxsize=1)
+def local_zone_name():
+	"""
+	Returns the IANA name of the machine's time zone, ie.
+	'Europe/Berlin'. Looked up once per process.
+	"""
+	zone = tzlocal.get_localzone()
+	# tzlocal returns zoneinfo zones, older versions pytz ones
+	return getattr(zone, 'key', None) or getattr(zone, 'zone', None) or str(zone)
+
+@functools.lru_cache(maxsize=None)
+def get_zone(name):
+	"""
+	Returns the tzinfo of an IANA zone name. Empty names are UTC.
+	"""
+	if not name or name == 'UTC':
+		return UTC
+	try:
+		return zoneinfo.ZoneInfo(name)
+	except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+		raise ValueError("ERROR. Unknown time zone '{}'.".format(name))
+
+def to_utc(local, zone_name):
+	"""
+	Returns the aware UTC datetime of a naive local datetime in the
+	zone zone_name, with the offset in effect at that moment.
+	"""
+	return local.replace(tzinfo=get_zone(zone_name)).astimezone(UTC)
+
+@functools.lru_cache(maxsize=None)
+def fixed_zone(offset):
+	return datetime.timezone(offset)
+
+# No zone changes its UTC offset twice within four weeks, so probing
+# a week apart can't step over a whole period of one offset
+PROBE = datetime.timedelta(days=7)
+# How many probes a period is searched for on either side
+REACH = 53
+
+def _aware(local, tzinfo):
+	# The same as local.replace(tzinfo=tzinfo), but a fraction of the
+	# cost: replace() parses keyword arguments on every call
+	return datetime.datetime.combine(local, local.time(), tzinfo)
+
+def _offset(local, zone):
+	return _aware(local, zone).utcoffset()
+
+def _edge(start, step, offset, zone):
+	# Walks from start by step while the offset stays the same and
+	# returns the datetime where it changes, or None if the search
+	# ran out, with the last datetime known to have it. Offsets change
+	# on whole seconds, so start must be one
+	inside = start
+	for _ in range(REACH):
+		try:
+			outside = inside + step
+		except OverflowError:
+			return None, inside
+		if _offset(outside, zone) != offset:
+			break
+		inside = outside
+	else:
+		return None, inside
+
+	span = int((outside - inside).total_seconds())
+	while abs(span) > 1:
+		middle = inside + datetime.timedelta(seconds=span // 2)
+		if _offset(middle, zone) == offset:
+			inside = middle
+		else:
+			outside = middle
+		span = int((outside - inside).total_seconds())
+	return outside, inside
+
+def offset_period(local, zone_name, first=None):
+	"""
+	Returns (first, end, tzinfo, exact): every naive local datetime
+	from first up to, but not including, end has the fixed UTC offset
+	tzinfo in the zone zone_name, and local is one of them. If exact,
+	the offset changes at end.
+
+	Keyword arguments:
+	first -- where the offset of local is known to start, to only
+		search forward
+	"""
+	zone = get_zone(zone_name)
+	offset = _offset(local, zone)
+	start = local.replace(microsecond=0)
+	end, inside = _edge(start, PROBE, offset, zone)
+	exact = end is not None
+	if not exact:
+		end = inside + datetime.timedelta(seconds=1)
+	if first is None:
+		_, first = _edge(start, -PROBE, offset, zone)
+	return first, end, fixed_zone(offset), exact
+
+def localize_many(datetimes, zone_name):
+	"""
+	Makes many naive local datetimes of one zone aware, ie. every
+	occurrence of a planning run. Each result keeps its local time
+	and carries the fixed UTC offset in effect at its own moment, so
+	it is the same instant as to_utc returns and compares and
+	subtracts correctly across a DST change. Unlike to_utc's, its
+	tzinfo isn't UTC; call astimezone(UTC) where that matters.
+
+	Offsets only change at DST transitions, so the zone is only
+	looked up to find the period of one offset around a datetime.
+	Every datetime inside a known period is two comparisons and
+	attaching the offset.
+	"""
+	zone = get_zone(zone_name)
+	if zone is UTC:
+		return [_aware(local, UTC) for local in datetimes]
+
+	# Periods found so far, sorted by where they start
+	starts, periods = [], []
+	first = end = tzinfo = None
+	exact = False
+	combine = datetime.datetime.combine
+	result = []
+	for local in datetimes:
+		if first is None or not first <= local < end:
+			i = bisect.bisect_right(starts, local) - 1
+			if i >= 0 and local < periods[i][1]:
+				first, end, tzinfo, exact = periods[i]
+			else:
+				period = None
+				if exact and end <= local:
+					# Sorted occurrences run into the next period
+					period = offset_period(end, zone_name, first=end)
+					if local >= period[1]:
+						period = None
+				if period is None:
+					period = offset_period(local, zone_name)
+				first, end, tzinfo, exact = period
+				i = bisect.bisect_right(starts, first)
+				starts.insert(i, first)
+				periods.insert(i, period)
+		result.append(combine(local, local.time(), tzinfo))
+	return result
+
+def until_utc(last_date, zone_name):
+	"""
+	Returns the UNTIL value of a rule repeating through last_date in
+	the zone zone_name: the end of that local day in UTC, in the
+	basic RFC 5545 format, ie. '20300301T225959Z'.
+	"""
+	end_of_day = datetime.datetime.combine(last_date, datetime.time(23, 59, 59))
+	return to_utc(end_of_day, zone_name).strftime('%Y%m%dT%H%M%SZ')
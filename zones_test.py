@@ -0,0 +1,69 @@
+# Tests that localize_many agrees with zoneinfo, including around DST
+# changes
+#
+#	> python -m unittest zones_test
+#
+import datetime, random
+import unittest
+import zoneinfo
+
+import zones
+
+ZONES = ['Europe/Berlin', 'America/New_York', 'Australia/Sydney', 'America/Sao_Paulo', 'Asia/Kolkata', 'UTC']
+
+def every(start, end, step):
+	times = []
+	while start < end:
+		times.append(start)
+		start += step
+	return times
+
+class LocalizeManyTest(unittest.TestCase):
+	def assertMatchesZoneinfo(self, local_times, zone_name):
+		zone = zoneinfo.ZoneInfo(zone_name)
+		for local, aware in zip(local_times, zones.localize_many(local_times, zone_name)):
+			expected = local.replace(tzinfo=zone)
+			# The same wall clock time, offset and instant
+			self.assertEqual(aware.replace(tzinfo=None), local, (zone_name, local))
+			self.assertEqual(aware.utcoffset(), expected.utcoffset(), (zone_name, local))
+			self.assertEqual(aware.astimezone(zones.UTC), zones.to_utc(local, zone_name), (zone_name, local))
+
+	def test_around_dst_changes(self):
+		# Every quarter hour of the days around the 2030 changes of
+		# both hemispheres, including the skipped and repeated hours
+		for zone_name in ZONES:
+			for day in [datetime.date(2030, 3, 30), datetime.date(2030, 4, 6), datetime.date(2030, 10, 5),
+					datetime.date(2030, 10, 26), datetime.date(2030, 11, 2)]:
+				start = datetime.datetime.combine(day, datetime.time(0))
+				local_times = every(start, start + datetime.timedelta(days=3), datetime.timedelta(minutes=15))
+				self.assertMatchesZoneinfo(local_times, zone_name)
+
+	def test_daily_occurrences(self):
+		start = datetime.datetime(2029, 1, 1, 9, 30)
+		for zone_name in ZONES:
+			local_times = every(start, start + datetime.timedelta(days=3 * 365), datetime.timedelta(days=1))
+			self.assertMatchesZoneinfo(local_times, zone_name)
+
+	def test_unsorted(self):
+		rng = random.Random(1)
+		start = datetime.datetime(2030, 1, 1)
+		local_times = [start + datetime.timedelta(seconds=rng.randrange(2 * 365 * 86400)) for i in range(5000)]
+		# Around the exact second the clocks change too
+		change = datetime.datetime(2030, 3, 31, 2)
+		local_times += [change + datetime.timedelta(seconds=s) for s in range(-3, 3)]
+		rng.shuffle(local_times)
+		self.assertMatchesZoneinfo(local_times, 'Europe/Berlin')
+
+	def test_microseconds(self):
+		local_times = [datetime.datetime(2030, 10, 27, 2, 59, 59, 999999), datetime.datetime(2030, 10, 27, 3, 0, 0, 1)]
+		self.assertMatchesZoneinfo(local_times, 'Europe/Berlin')
+
+	def test_empty(self):
+		self.assertEqual(zones.localize_many([], 'Europe/Berlin'), [])
+
+	def test_unknown_zone(self):
+		with self.assertRaises(ValueError):
+			zones.localize_many([datetime.datetime(2030, 1, 1)], 'Mars/Olympus_Mons')
+
+if __name__ == '__main__':
+	unittest.main()